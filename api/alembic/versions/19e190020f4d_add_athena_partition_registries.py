@@ -0,0 +1,34 @@
+"""add athena partition registries
+
+Revision ID: 19e190020f4d
+Revises: 6362fcc8f3a4
+Create Date: 2026-10-18 14:02:47.519386
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '19e190020f4d'
+down_revision = '6362fcc8f3a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'athena_partition_registries',
+        sa.Column('project_id', sa.CHAR(length=36), nullable=False),
+        sa.Column('aws_account_id', sa.CHAR(length=36), nullable=True),
+        sa.Column('watermark_shard', sa.Text(), nullable=True),
+        sa.Column('reconciled_timestamp', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['aws_account_id'], ['aws_accounts.id'], ),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('project_id')
+    )
+
+
+def downgrade():
+    op.drop_table('athena_partition_registries')
@@ -0,0 +1,54 @@
+"""add execution log rollups
+
+Revision ID: 6362fcc8f3a4
+Revises: c1174c6e02ed
+Create Date: 2026-10-18 10:41:12.204317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6362fcc8f3a4'
+down_revision = 'c1174c6e02ed'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'execution_log_rollups',
+        sa.Column('id', sa.CHAR(length=36), nullable=False),
+        sa.Column('project_id', sa.CHAR(length=36), nullable=False),
+        sa.Column('date_shard', sa.Text(), nullable=False),
+        sa.Column('execution_pipeline_id', sa.CHAR(length=36), nullable=False),
+        sa.Column('arn', sa.Text(), nullable=False),
+        sa.Column('type', sa.Text(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('min_timestamp', sa.Integer(), nullable=True),
+        sa.Column('max_timestamp', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_execution_log_rollups_project_id_date_shard',
+        'execution_log_rollups',
+        ['project_id', 'date_shard'],
+        unique=False
+    )
+    op.create_index(
+        'ix_cached_execution_logs_shards_project_id_date_shard',
+        'cached_execution_logs_shards',
+        ['project_id', 'date_shard'],
+        unique=False
+    )
+
+
+def downgrade():
+    # Shards sealed as rollups have no raw rows to go back to, unsealing
+    # them gets them scanned out of S3 again.
+    op.execute('DELETE FROM cached_execution_logs_shards WHERE shard_data IS NULL')
+    op.drop_index('ix_cached_execution_logs_shards_project_id_date_shard', table_name='cached_execution_logs_shards')
+    op.drop_index('ix_execution_log_rollups_project_id_date_shard', table_name='execution_log_rollups')
+    op.drop_table('execution_log_rollups')
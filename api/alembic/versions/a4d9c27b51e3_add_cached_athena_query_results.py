@@ -0,0 +1,52 @@
+"""add cached athena query results
+
+Revision ID: a4d9c27b51e3
+Revises: 19e190020f4d
+Create Date: 2026-10-18 16:27:05.813204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d9c27b51e3'
+down_revision = '19e190020f4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'cached_athena_query_results',
+        sa.Column('id', sa.CHAR(length=64), nullable=False),
+        sa.Column('project_id', sa.CHAR(length=36), nullable=False),
+        sa.Column('query', sa.Text(), nullable=True),
+        sa.Column('sealed_shard', sa.Text(), nullable=True),
+        sa.Column('result_data', sa.JSON(), nullable=True),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('bytes_scanned', sa.BigInteger(), nullable=False),
+        sa.Column('hit_count', sa.Integer(), nullable=False),
+        sa.Column('last_used_timestamp', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_cached_athena_query_results_last_used_timestamp',
+        'cached_athena_query_results',
+        ['last_used_timestamp'],
+        unique=False
+    )
+    op.create_index(
+        'ix_cached_athena_query_results_project_id',
+        'cached_athena_query_results',
+        ['project_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_cached_athena_query_results_project_id', table_name='cached_athena_query_results')
+    op.drop_index('ix_cached_athena_query_results_last_used_timestamp', table_name='cached_athena_query_results')
+    op.drop_table('cached_athena_query_results')
@@ -0,0 +1,27 @@
+"""add oldest timestamp to cached athena query results
+
+Revision ID: d81f3a6c05b2
+Revises: a4d9c27b51e3
+Create Date: 2026-10-18 19:42:31.507316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f3a6c05b2'
+down_revision = 'a4d9c27b51e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Results cached so far are keyed on their oldest timestamp
+    op.execute('DELETE FROM cached_athena_query_results')
+    op.add_column('cached_athena_query_results', sa.Column('oldest_timestamp', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.execute('DELETE FROM cached_athena_query_results')
+    op.drop_column('cached_athena_query_results', 'oldest_timestamp')
@@ -80,6 +80,7 @@ class TornadoApp:
             (r"/api/v1/logs/executions/get-logs", GetProjectExecutionLogObjects),
             (r"/api/v1/logs/executions/get-contents", GetProjectExecutionLogsPage),
             (r"/api/v1/logs/executions/get", GetProjectExecutionLogs),
+            (r"/api/v1/logs/executions/phase-latencies", GetBlockPhaseLatencies),
             (r"/api/v1/logs/executions", GetProjectExecutions),
 
             (r"/api/v1/saved_blocks/create", SavedBlocksCreate),
@@ -146,6 +147,7 @@ class TornadoApp:
             (r"/services/v1/onboard_third_party_aws_account_plan", OnboardThirdPartyAWSAccountPlan),
             (r"/services/v1/dangerously_finalize_third_party_aws_onboarding", OnboardThirdPartyAWSAccountApply),
             (r"/services/v1/clear_s3_build_packages", ClearAllS3BuildPackages),
+            (r"/services/v1/reconcile_athena_partitions", ReconcileAthenaTablePartitions),
             (r"/services/v1/dangling_resources/([a-f0-9\-]+)", CleanupDanglingResources),
             (r"/services/v1/clear_stripe_invoice_drafts", ClearStripeInvoiceDrafts),
             (r"/services/v1/mark_account_needs_closing", MarkAccountNeedsClosing),
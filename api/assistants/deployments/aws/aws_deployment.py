@@ -251,6 +251,25 @@ class AwsDeployment(DeploymentDiagram):
             combined_warmup_list
         )
 
+        requested_count = 0
+        warmed_count = 0
+
+        for warmer_trigger in warmer_triggers_data:
+            for arn, warmed in warmer_trigger["warmed"].items():
+                requested_count += warmup_concurrency_level
+
+                if warmed is None:
+                    logit("Couldn't confirm the warmup of '" + arn + "'", "warning")
+                    continue
+
+                warmed_count += warmed
+
+                if warmed < warmup_concurrency_level:
+                    logit("Only " + str(warmed) + " of " + str(warmup_concurrency_level) +
+                          " containers of '" + arn + "' warmed up", "warning")
+
+        logit("Warmed up " + str(warmed_count) + " of " + str(requested_count) + " containers.")
+
         for warmer_trigger in warmer_triggers_data:
             warmer_id = warmer_trigger["id"]
             name = warmer_trigger["name"]
@@ -24,6 +24,8 @@ def create_warmer_for_lambda_set(task_spawner, credentials, warmup_concurrency_l
     # warmer Lambda so everything is kept hot.
     # Additionally we'll invoke them all once with a warmup request so
     # that they are hot if hit immediately
+    warmup_futures = []
+
     for deployed_lambda in combined_warmup_list:
         yield task_spawner.add_rule_target(
             credentials,
@@ -37,16 +39,26 @@ def create_warmer_for_lambda_set(task_spawner, credentials, warmup_concurrency_l
             })
         )
 
-        task_spawner.warm_up_lambda(
-            credentials,
-            deployed_lambda["arn"],
-            warmup_concurrency_level
+        warmup_futures.append(
+            task_spawner.warm_up_lambda(
+                credentials,
+                deployed_lambda["arn"],
+                warmup_concurrency_level
+            )
         )
 
+    # The runtime reports how many containers it actually warmed
+    warmed_counts = yield warmup_futures
+
+    warmed = {}
+    for deployed_lambda, warmed_count in zip(combined_warmup_list, warmed_counts):
+        warmed[deployed_lambda["arn"]] = warmed_count
+
     raise gen.Return({
         "id": warmer_trigger_result["id"],
         "name": warmer_trigger_name,
-        "arn": warmer_trigger_result["arn"]
+        "arn": warmer_trigger_result["arn"],
+        "warmed": warmed
     })
 
 
@@ -2,22 +2,33 @@ from tornado import gen
 from typing import AnyStr
 
 from assistants.aws_clients.aws_clients_assistant import AwsClientFactory
+from utils.athena_query_cache import AthenaQueryCache, ATHENA_QUERY_CACHE_MAX_BYTES
 from utils.general import log_exception
+from utils.lru_cache import LRUByteCache
 from utils.performance_decorators import emit_runtime_metrics
 from pinject import copy_args_to_public_fields
 from tornado.ioloop import IOLoop
 from tornado.concurrent import run_on_executor, futures
 
 from tasks.athena import (
-    perform_athena_query,
+    start_athena_query,
+    get_athena_query_execution,
+    get_athena_query_results,
+    get_athena_poll_delays,
+    is_athena_query_finished,
     get_athena_results_from_s3,
     get_block_executions,
+    write_block_execution_pages,
+    get_block_phase_latencies,
     create_project_id_log_table,
-    get_project_execution_logs
+    get_project_execution_logs,
+    is_partition_projection_enabled
 )
 from tasks.s3 import (
     read_from_s3,
     get_json_from_s3,
+    get_execution_log_from_s3,
+    get_execution_logs_from_s3,
     write_json_to_s3,
     s3_object_exists,
     read_from_s3_and_return_input,
@@ -25,8 +36,10 @@ from tasks.s3 import (
     get_s3_pipeline_execution_logs,
     get_build_packages,
     get_s3_list_from_prefix,
+    scan_s3_shards,
     get_s3_pipeline_execution_ids,
-    get_s3_pipeline_timestamp_prefixes
+    get_s3_pipeline_timestamp_prefixes,
+    EXECUTION_LOG_CACHE_MAX_BYTES
 )
 from tasks.role import (
     get_assume_role_credentials,
@@ -165,6 +178,22 @@ class TaskSpawner(object):
         self.executor = futures.ThreadPoolExecutor(60)
         self.loop = loop or IOLoop.current()
 
+        self.athena_query_cache = AthenaQueryCache(
+            db_session_maker,
+            aws_cloudwatch_client,
+            max_bytes=int(
+                app_config.get_if_exists("athena_query_cache_max_bytes") or ATHENA_QUERY_CACHE_MAX_BYTES
+            ),
+            partition_projection=is_partition_projection_enabled(app_config)
+        )
+
+        # Execution log objects never change once they're written
+        self.execution_log_object_cache = LRUByteCache(
+            int(
+                app_config.get_if_exists("execution_log_cache_max_bytes") or EXECUTION_LOG_CACHE_MAX_BYTES
+            )
+        )
+
     @run_on_executor
     @emit_runtime_metrics("create_third_party_aws_lambda_execute_role")
     def create_third_party_aws_lambda_execute_role(self, credentials):
@@ -183,6 +212,28 @@ class TaskSpawner(object):
             s3_path
         )
 
+    @run_on_executor
+    @emit_runtime_metrics("get_execution_log_from_s3")
+    def get_execution_log_from_s3(self, credentials, s3_bucket, s3_path, log_id):
+        return get_execution_log_from_s3(
+            self.aws_client_factory,
+            credentials,
+            s3_bucket,
+            s3_path,
+            log_id
+        )
+
+    @run_on_executor
+    @emit_runtime_metrics("get_execution_logs_from_s3")
+    def get_execution_logs_from_s3(self, credentials, s3_bucket, logs_to_fetch):
+        return get_execution_logs_from_s3(
+            self.aws_client_factory,
+            self.execution_log_object_cache,
+            credentials,
+            s3_bucket,
+            logs_to_fetch
+        )
+
     @run_on_executor
     @emit_runtime_metrics("write_json_to_s3")
     def write_json_to_s3(self, credentials, s3_bucket, s3_path, input_data):
@@ -199,6 +250,7 @@ class TaskSpawner(object):
     def get_block_executions(self, credentials, project_id, execution_pipeline_id, arn, oldest_timestamp):
         return get_block_executions(
             self.aws_client_factory,
+            self.athena_query_cache,
             credentials,
             project_id,
             execution_pipeline_id,
@@ -206,11 +258,36 @@ class TaskSpawner(object):
             oldest_timestamp
         )
 
+    @run_on_executor
+    @emit_runtime_metrics("write_block_execution_pages")
+    def write_block_execution_pages(self, credentials, project_id, execution_pipeline_id, arn, oldest_timestamp):
+        return write_block_execution_pages(
+            self.aws_client_factory,
+            self.athena_query_cache,
+            credentials,
+            project_id,
+            execution_pipeline_id,
+            arn,
+            oldest_timestamp
+        )
+
+    @run_on_executor
+    @emit_runtime_metrics("get_block_phase_latencies")
+    def get_block_phase_latencies(self, credentials, project_id, arn, oldest_timestamp):
+        return get_block_phase_latencies(
+            self.aws_client_factory,
+            credentials,
+            project_id,
+            arn,
+            oldest_timestamp
+        )
+
     @run_on_executor
     @emit_runtime_metrics("get_project_execution_logs")
     def get_project_execution_logs(self, credentials, project_id, oldest_timestamp):
         return get_project_execution_logs(
             self.aws_client_factory,
+            self.athena_query_cache,
             credentials,
             project_id,
             oldest_timestamp
@@ -222,19 +299,72 @@ class TaskSpawner(object):
         return create_project_id_log_table(
             self.aws_client_factory,
             credentials,
-            project_id
+            project_id,
+            partition_projection=is_partition_projection_enabled(self.app_config)
         )
 
     @run_on_executor
-    @emit_runtime_metrics("perform_athena_query")
-    def perform_athena_query(self, credentials, query, return_results):
-        return perform_athena_query(
+    @emit_runtime_metrics("start_athena_query")
+    def start_athena_query(self, credentials, query):
+        return start_athena_query(
+            self.aws_client_factory,
+            credentials,
+            query
+        )
+
+    # Not timed, it's polled many times for every query
+    @run_on_executor
+    def get_athena_query_execution(self, credentials, query_execution_id):
+        return get_athena_query_execution(
             self.aws_client_factory,
             credentials,
-            query,
-            return_results
+            query_execution_id
+        )
+
+    @run_on_executor
+    @emit_runtime_metrics("get_athena_query_results")
+    def get_athena_query_results(self, credentials, query_execution):
+        return get_athena_query_results(
+            self.aws_client_factory,
+            credentials,
+            query_execution
+        )
+
+    @gen.coroutine
+    def perform_athena_query(self, credentials, query, return_results):
+        """
+        Waits for the query on the IOLoop instead of an executor thread, a
+        thread is only taken for each poll of the query's status.
+        """
+        query_execution_id = yield self.start_athena_query(
+            credentials,
+            query
+        )
+
+        query_execution = None
+
+        for delay in get_athena_poll_delays():
+            yield gen.sleep(delay)
+
+            query_execution = yield self.get_athena_query_execution(
+                credentials,
+                query_execution_id
+            )
+
+            if is_athena_query_finished(query_execution):
+                break
+
+        # Sometimes we don't care about the result
+        if not return_results:
+            raise gen.Return(query_execution["ResultConfiguration"]["OutputLocation"])
+
+        query_results = yield self.get_athena_query_results(
+            credentials,
+            query_execution
         )
 
+        raise gen.Return(query_results)
+
     @run_on_executor
     @emit_runtime_metrics("get_athena_results_from_s3")
     def get_athena_results_from_s3(self, credentials, s3_bucket, s3_path):
@@ -847,6 +977,18 @@ class TaskSpawner(object):
             start_after
         )
 
+    @run_on_executor
+    @emit_runtime_metrics("scan_s3_shards")
+    def scan_s3_shards(self, credentials, s3_bucket, shard_prefixes, page_handler, delimiter=None):
+        return scan_s3_shards(
+            self.aws_client_factory,
+            credentials,
+            s3_bucket,
+            shard_prefixes,
+            page_handler,
+            delimiter=delimiter
+        )
+
     @run_on_executor
     @emit_runtime_metrics("get_s3_pipeline_execution_ids")
     def get_s3_pipeline_execution_ids(self, credentials, timestamp_prefix, max_results, continuation_token):
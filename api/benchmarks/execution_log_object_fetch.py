@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""
+Fetching the execution logs of a large execution the way the
+GetProjectExecutionLogObjects handler used to (one get_execution_log_from_s3
+at a time) against the bulk get_execution_logs_from_s3 fetch, opening the
+execution (an empty cache) and then reopening it (a warm cache).
+
+The log objects are read from an in-memory stand-in for S3 which answers
+get_object with a fixed latency per request. A share of the objects are
+gzipped and some hold several logs coalesced into one object.
+
+Usage:
+    python benchmarks/execution_log_object_fetch.py [--logs 50] [--log-bytes 4096]
+        [--latency-ms 20] [--logs-per-object 1] [--gzip-fraction 0.5]
+        [--max-workers 16] [--json]
+"""
+
+from os.path import dirname, realpath
+import threading
+import argparse
+import gzip
+import json
+import time
+import uuid
+import sys
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from tasks.s3 import get_execution_log_from_s3, get_execution_logs_from_s3, S3_LOG_FETCH_MAX_WORKERS
+from utils.lru_cache import LRUByteCache
+
+
+LOGS_BUCKET = "refinery-lambda-logging-benchmark"
+
+
+class LocalS3Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class LocalS3Client:
+    """
+    Just enough of an S3 client for reading objects, with latency_seconds
+    of (simulated) network latency per request.
+    """
+
+    def __init__(self, objects, latency_seconds):
+        self.objects = objects
+        self.latency_seconds = latency_seconds
+        self.request_count = 0
+        self.request_count_lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self.request_count_lock:
+            self.request_count += 1
+
+        time.sleep(self.latency_seconds)
+
+        return {
+            "Body": LocalS3Body(self.objects[Key])
+        }
+
+
+class LocalAwsClientFactory:
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def get_aws_client(self, client_type, credentials):
+        return self.s3_client
+
+
+def generate_log_objects(args):
+    project_id = str(uuid.uuid4())
+    execution_pipeline_id = str(uuid.uuid4())
+    objects = {}
+    logs_to_fetch = []
+
+    object_count = max(1, args.logs // args.logs_per_object)
+
+    for object_index in range(0, object_count):
+        log_ids = [str(uuid.uuid4()) for i in range(0, args.logs_per_object)]
+        s3_key = project_id + "/dt=2019-07-15-13-35/" + execution_pipeline_id + "/SUCCESS~Untitled_Code_Block~" + \
+            log_ids[0] + "~1563197795"
+
+        object_data = "\n".join([
+            json.dumps({
+                "id": log_id,
+                "type": "SUCCESS",
+                "program_output": "x" * args.log_bytes,
+            })
+            for log_id in log_ids
+        ]).encode("UTF-8")
+
+        if object_index < object_count * args.gzip_fraction:
+            object_data = gzip.compress(object_data)
+
+        objects[s3_key] = object_data
+
+        for log_id in log_ids:
+            logs_to_fetch.append({
+                "s3_key": s3_key,
+                "log_id": log_id
+            })
+
+    return objects, logs_to_fetch
+
+
+def fetch_serially(aws_client_factory, credentials, logs_to_fetch):
+    return [
+        {
+            "log_data": get_execution_log_from_s3(
+                aws_client_factory,
+                credentials,
+                LOGS_BUCKET,
+                log_to_fetch["s3_key"],
+                log_to_fetch["log_id"]
+            ),
+            "log_id": log_to_fetch["log_id"]
+        }
+        for log_to_fetch in logs_to_fetch
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks fetching execution log objects")
+    parser.add_argument("--logs", type=int, default=50, help="Number of logs to fetch")
+    parser.add_argument("--log-bytes", type=int, default=4096, help="Size of the output of each log")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latency of every S3 request")
+    parser.add_argument("--logs-per-object", type=int, default=1, help="Logs coalesced into each object")
+    parser.add_argument("--gzip-fraction", type=float, default=0.5, help="Share of the objects which are gzipped")
+    parser.add_argument("--max-workers", type=int, default=S3_LOG_FETCH_MAX_WORKERS,
+                        help="Most objects read at once")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    objects, logs_to_fetch = generate_log_objects(args)
+    credentials = {"logs_bucket": LOGS_BUCKET}
+    execution_log_object_cache = LRUByteCache(1024 * 1024 * 64)
+
+    results = {
+        "logs": len(logs_to_fetch),
+        "objects": len(objects),
+    }
+
+    # Each fetch gets its own client to count its requests, the bulk
+    # fetches share the cache: the first opens the execution, the second
+    # reopens it.
+    for fetch_name, fetch in [
+        ("serial", lambda factory: fetch_serially(factory, credentials, logs_to_fetch)),
+        ("bulk_cold", lambda factory: get_execution_logs_from_s3(factory, execution_log_object_cache, credentials,
+                                                                 LOGS_BUCKET, logs_to_fetch, args.max_workers)),
+        ("bulk_warm", lambda factory: get_execution_logs_from_s3(factory, execution_log_object_cache, credentials,
+                                                                 LOGS_BUCKET, logs_to_fetch, args.max_workers)),
+    ]:
+        s3_client = LocalS3Client(objects, args.latency_ms / 1000.0)
+
+        start_time = time.time()
+        results[fetch_name] = fetch(LocalAwsClientFactory(s3_client))
+        results[fetch_name + "_ms"] = round((time.time() - start_time) * 1000, 1)
+        results[fetch_name + "_requests"] = s3_client.request_count
+
+    if not (results["serial"] == results["bulk_cold"] == results["bulk_warm"]):
+        raise Exception("The bulk fetch returned different logs!")
+
+    del results["serial"]
+    del results["bulk_cold"]
+    del results["bulk_warm"]
+
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+        return
+
+    print("%6s %8s %12s %12s %12s %9s" % ("logs", "objects", "serial", "bulk (cold)", "bulk (warm)", "speedup"))
+    print("%6d %8d %10.1fms %10.1fms %10.1fms %8.1fx" % (
+        results["logs"],
+        results["objects"],
+        results["serial_ms"],
+        results["bulk_cold_ms"],
+        results["bulk_warm_ms"],
+        results["serial_ms"] / max(0.1, results["bulk_cold_ms"])
+    ))
+    print("S3 requests: %d serial, %d cold, %d warm" % (
+        results["serial_requests"],
+        results["bulk_cold_requests"],
+        results["bulk_warm_requests"]
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+"""
+Scanning the un-sealed execution log shards of a project for the execution
+stats, sequentially as it used to be done (a full listing of one shard after
+another, collecting every parsed key before counting) against the concurrent
+scan_s3_shards scanner which rolls the keys up as the pages come in.
+
+The keys are listed from an in-memory stand-in for S3 which answers
+list_objects_v2 (prefixes, delimiters and pagination) with a fixed latency
+per request, filled with a synthetic key layout:
+
+* wide: many executions with a few blocks each.
+* deep: a few executions with many blocks each.
+* coalesced: as wide, but with the logs of every execution coalesced
+  into a single key per block.
+
+Also reports how long only listing the executions of the shards takes (the
+"{{execution_pipeline_id}}/" prefixes, with a delimiter).
+
+Usage:
+    python benchmarks/execution_log_shard_scan.py [--shards 12] [--layout wide ...]
+        [--latency-ms 20] [--max-workers 16] [--json]
+"""
+
+from os.path import dirname, realpath
+import threading
+import argparse
+import bisect
+import json
+import time
+import uuid
+import sys
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from controller.logs.actions import get_execution_metadata_from_s3_key
+from tasks.s3 import get_all_s3_paths, scan_s3_shards, S3_SHARD_SCAN_MAX_WORKERS
+from utils.mapper import add_execution_log_result_to_rollups, execution_log_query_results_to_pipeline_id_dict
+
+
+AWS_REGION = "us-west-2"
+ACCOUNT_ID = "532121572788"
+LOGS_BUCKET = "refinery-lambda-logging-benchmark"
+
+# (executions per shard, blocks per execution, logs per key)
+LAYOUTS = {
+    "wide": (400, 3, 1),
+    "deep": (20, 60, 1),
+    "coalesced": (400, 3, 12),
+}
+
+EXECUTION_TYPES = ["SUCCESS", "SUCCESS", "SUCCESS", "CAUGHT_EXCEPTION", "EXCEPTION"]
+
+
+class LocalS3Client:
+    """
+    Just enough of an S3 client for listing, with latency_seconds of
+    (simulated) network latency per request.
+    """
+
+    def __init__(self, keys, latency_seconds):
+        self.keys = sorted(keys)
+        self.latency_seconds = latency_seconds
+        self.request_count = 0
+        self.request_count_lock = threading.Lock()
+
+    def list_objects_v2(self, Bucket, Prefix="", MaxKeys=1000, Delimiter=None, ContinuationToken=None,
+                        StartAfter=None):
+        with self.request_count_lock:
+            self.request_count += 1
+
+        time.sleep(self.latency_seconds)
+
+        index = bisect.bisect_left(self.keys, Prefix)
+
+        if ContinuationToken or StartAfter:
+            index = max(index, bisect.bisect_right(self.keys, ContinuationToken or StartAfter))
+
+        contents = []
+        common_prefixes = []
+        last_key = None
+
+        while index < len(self.keys) and self.keys[index].startswith(Prefix):
+            if len(contents) + len(common_prefixes) >= MaxKeys:
+                return self._get_response(contents, common_prefixes, last_key)
+
+            key = self.keys[index]
+
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common_prefix = key[:key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                common_prefixes.append({"Prefix": common_prefix})
+
+                # Skip over the rest of the keys under the common prefix
+                last_key = common_prefix + "\uffff"
+                index = bisect.bisect_right(self.keys, last_key)
+                continue
+
+            contents.append({"Key": key})
+            last_key = key
+            index += 1
+
+        return self._get_response(contents, common_prefixes, None)
+
+    def _get_response(self, contents, common_prefixes, next_continuation_token):
+        response = {
+            "IsTruncated": next_continuation_token is not None,
+            "KeyCount": len(contents) + len(common_prefixes),
+        }
+
+        if contents:
+            response["Contents"] = contents
+
+        if common_prefixes:
+            response["CommonPrefixes"] = common_prefixes
+
+        if next_continuation_token is not None:
+            response["NextContinuationToken"] = next_continuation_token
+
+        return response
+
+
+class LocalAwsClientFactory:
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def get_aws_client(self, client_type, credentials):
+        return self.s3_client
+
+
+def generate_shard_keys(project_id, shard_count, layout):
+    executions_per_shard, blocks_per_execution, logs_per_key = LAYOUTS[layout]
+    keys = []
+    timestamp = 1563197795
+
+    for shard_index in range(0, shard_count):
+        date_shard = "dt=2019-07-15-%02d-%02d" % (13 + (shard_index * 5) // 60, (shard_index * 5) % 60)
+
+        for execution_index in range(0, executions_per_shard):
+            execution_pipeline_id = str(uuid.uuid4())
+
+            for block_index in range(0, blocks_per_execution):
+                log_file_name = "~".join([
+                    EXECUTION_TYPES[(execution_index + block_index) % len(EXECUTION_TYPES)],
+                    "Untitled_Code_Block_" + str(block_index),
+                    str(uuid.uuid4()),
+                    str(timestamp + execution_index)
+                ])
+
+                if logs_per_key > 1:
+                    log_file_name += "~" + str(logs_per_key)
+
+                keys.append(project_id + "/" + date_shard + "/" + execution_pipeline_id + "/" + log_file_name)
+
+    return keys
+
+
+def get_shards(keys, project_id):
+    return sorted(set([key.split("/")[1] for key in keys]))
+
+
+def scan_sequentially(aws_client_factory, credentials, project_id, shards):
+    # As get_execution_stats_since_timestamp used to: every shard is fully
+    # listed in turn and all of the results are collected before counting.
+    all_s3_shards = []
+    for shard in shards:
+        if not (shard in all_s3_shards):
+            all_s3_shards.append(shard)
+
+    execution_log_results = []
+
+    for s3_shard in all_s3_shards:
+        execution_logs = get_all_s3_paths(
+            aws_client_factory,
+            credentials,
+            LOGS_BUCKET,
+            project_id + "/" + s3_shard,
+            -1
+        )
+
+        for execution_log in execution_logs:
+            execution_log_results = execution_log_results + [
+                get_execution_metadata_from_s3_key(AWS_REGION, ACCOUNT_ID, execution_log)
+            ]
+
+    return execution_log_query_results_to_pipeline_id_dict(
+        execution_log_results
+    )
+
+
+def scan_concurrently(aws_client_factory, credentials, project_id, shards, max_workers):
+    rollups = {}
+
+    def add_execution_log_page(shard_prefix, execution_logs):
+        for execution_log in execution_logs:
+            add_execution_log_result_to_rollups(
+                rollups,
+                get_execution_metadata_from_s3_key(AWS_REGION, ACCOUNT_ID, execution_log)
+            )
+
+    scan_s3_shards(
+        aws_client_factory,
+        credentials,
+        LOGS_BUCKET,
+        [project_id + "/" + shard + "/" for shard in shards],
+        add_execution_log_page,
+        max_workers=max_workers
+    )
+
+    return execution_log_query_results_to_pipeline_id_dict(
+        list(rollups.values())
+    )
+
+
+def count_executions(aws_client_factory, credentials, project_id, shards, max_workers):
+    execution_pipeline_ids = set()
+
+    def add_execution_pipeline_page(shard_prefix, execution_pipeline_prefixes):
+        for execution_pipeline_prefix in execution_pipeline_prefixes:
+            execution_pipeline_ids.add(
+                execution_pipeline_prefix.split("/")[2]
+            )
+
+    scan_s3_shards(
+        aws_client_factory,
+        credentials,
+        LOGS_BUCKET,
+        [project_id + "/" + shard + "/" for shard in shards],
+        add_execution_pipeline_page,
+        delimiter="/",
+        max_workers=max_workers
+    )
+
+    return len(execution_pipeline_ids)
+
+
+def run_layout(layout, args):
+    project_id = str(uuid.uuid4())
+    keys = generate_shard_keys(project_id, args.shards, layout)
+    shards = get_shards(keys, project_id)
+    credentials = {"logs_bucket": LOGS_BUCKET}
+
+    results = {
+        "layout": layout,
+        "shards": len(shards),
+        "keys": len(keys),
+    }
+
+    # Each scan gets its own client to count its requests
+    for scan_name, scan in [
+        ("sequential", lambda factory: scan_sequentially(factory, credentials, project_id, shards)),
+        ("concurrent", lambda factory: scan_concurrently(factory, credentials, project_id, shards,
+                                                         args.max_workers)),
+        ("executions_only", lambda factory: count_executions(factory, credentials, project_id, shards,
+                                                             args.max_workers)),
+    ]:
+        s3_client = LocalS3Client(keys, args.latency_ms / 1000.0)
+
+        start_time = time.time()
+        results[scan_name] = scan(LocalAwsClientFactory(s3_client))
+        results[scan_name + "_ms"] = round((time.time() - start_time) * 1000, 1)
+        results[scan_name + "_requests"] = s3_client.request_count
+
+    if results["sequential"] != results["concurrent"]:
+        raise Exception("The concurrent scan of the " + layout + " layout counted different executions!")
+
+    results["executions"] = results.pop("executions_only")
+    del results["sequential"]
+    del results["concurrent"]
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks scanning execution log shards")
+    parser.add_argument("--shards", type=int, default=12, help="Number of 5 minute shards to scan")
+    parser.add_argument("--layout", action="append", choices=sorted(LAYOUTS.keys()),
+                        help="Key layouts to benchmark (default: all of them)")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latency of every S3 request")
+    parser.add_argument("--max-workers", type=int, default=S3_SHARD_SCAN_MAX_WORKERS,
+                        help="Most listings in flight at once")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    all_results = [run_layout(layout, args) for layout in (args.layout or sorted(LAYOUTS.keys()))]
+
+    if args.json:
+        print(json.dumps(all_results, indent=4, sort_keys=True))
+        return
+
+    print("%-10s %7s %8s %12s %12s %16s %10s" % (
+        "layout", "shards", "keys", "sequential", "concurrent", "executions only", "speedup"))
+
+    for results in all_results:
+        print("%-10s %7d %8d %10.1fms %10.1fms %14.1fms %9.1fx" % (
+            results["layout"],
+            results["shards"],
+            results["keys"],
+            results["sequential_ms"],
+            results["concurrent_ms"],
+            results["executions_only_ms"],
+            results["sequential_ms"] / max(0.1, results["concurrent_ms"])
+        ))
+
+
+if __name__ == "__main__":
+    main()
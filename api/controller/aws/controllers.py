@@ -225,6 +225,10 @@ class RunTmpLambda(BaseHandler):
                 indent=4,
             )
             lambda_result["logs"] = s3_dict["program_output"]
+
+            # Hits/misses of the runtime's cache of inline code and shared files
+            if "inline_file_cache" in return_data["_refinery"]:
+                lambda_result["inline_file_cache"] = return_data["_refinery"]["inline_file_cache"]
         except Exception as e:
             self.logger("Exception occurred while loading temporary Lambda return data: ")
             self.logger(e)
@@ -4,7 +4,7 @@ from tornado import gen
 from controller import BaseHandler
 from controller.decorators import authenticated
 from controller.deployments.schemas import *
-from models import Deployment, CachedExecutionLogsShard
+from models import Deployment, CachedExecutionLogsShard, ExecutionLogRollup, CachedAthenaQueryResult
 
 
 class GetLatestProjectDeployment(BaseHandler):
@@ -78,6 +78,18 @@ class DeleteDeploymentsInProject(BaseHandler):
         ).filter(
             CachedExecutionLogsShard.project_id == self.json["project_id"]
         ).delete()
+
+        self.dbsession.query(
+            ExecutionLogRollup
+        ).filter(
+            ExecutionLogRollup.project_id == self.json["project_id"]
+        ).delete()
+
+        self.dbsession.query(
+            CachedAthenaQueryResult
+        ).filter(
+            CachedAthenaQueryResult.project_id == self.json["project_id"]
+        ).delete()
         self.dbsession.commit()
 
         self.write({
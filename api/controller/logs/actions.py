@@ -2,15 +2,22 @@ import datetime
 import re
 import time
 
+from sqlalchemy import func, null
 from tornado import gen
 
 from assistants.decorators import aws_exponential_backoff
-from models import CachedExecutionLogsShard
+from models import AthenaPartitionRegistry, CachedExecutionLogsShard, ExecutionLogRollup
 from pyconstants.project_constants import REGEX_WHITELISTS
-from utils.general import logit
+from utils.general import logit, get_five_minute_dt_from_dt, dt_to_shard
 from utils.locker import AcquireFailure
 from utils.mapper import execution_pipeline_id_dict_to_frontend_format
 from utils.mapper import execution_log_query_results_to_pipeline_id_dict
+from utils.mapper import add_execution_log_result_to_rollups, execution_log_results_to_rollups
+
+
+# How long a project's Athena partition registry goes before it's reconciled
+# against the partitions Athena actually has
+ATHENA_PARTITION_RECONCILE_INTERVAL_SECONDS = (60 * 60 * 24)
 
 
 @gen.coroutine
@@ -35,66 +42,153 @@ def delete_logs(task_spawner, credentials, project_id):
         )
 
 
-def chunk_list(input_list, chunk_size):
+@gen.coroutine
+def list_project_log_shards(task_spawner, credentials, project_id, start_after_shard=False):
     """
-    Chunk an input list into a list of lists
-    of size chunk_size. (e.g. 10 lists of size 100)
+    Lists the date shards (e.g. "dt=2019-07-15-04-45") of a project's execution
+    logs in S3, starting from start_after_shard (inclusive) if it's given.
     """
-    def _chunk_list(input_list, chunk_size):
-        for i in range(0, len(input_list), chunk_size):
-            yield input_list[i:i + chunk_size]
-    return list(_chunk_list(
-        input_list,
-        chunk_size
-    ))
+    s3_shards = set()
 
+    # Standard S3 prefix before date for all S3 shards
+    s3_prefix = project_id + "/dt="
 
-@gen.coroutine
-def write_remaining_project_execution_log_pages(task_spawner, credentials, data_to_write_list):
-    # How many logs to write to S3 in parallel
-    parallel_write_num = 5
+    start_after = False
+    if start_after_shard:
+        start_after = project_id + "/" + start_after_shard
+
+    continuation_token = False
 
-    # Futures for the writes
-    s3_write_futures = []
+    # For loops which do not have a discreet conditional break, we enforce
+    # an upper bound of iterations.
+    MAX_LOOP_ITERATIONS = 1000
+
+    # Bound this loop to only execute MAX_LOOP_ITERATION times since we
+    # cannot guarantee that the condition `continuation_token == False`
+    # will ever be true.
+    for _ in range(MAX_LOOP_ITERATIONS):
+        # List shards in the S3 bucket starting at the oldest available shard
+        # That's because S3 buckets will start at the oldest time and end at
+        # the latest time (due to inverse binary UTF-8 sort order)
+        s3_list_results = yield task_spawner.get_s3_list_from_prefix(
+            credentials,
+            credentials["logs_bucket"],
+            s3_prefix,
+            continuation_token,
+            start_after
+        )
+
+        continuation_token = s3_list_results["continuation_token"]
 
-    # Write results to S3
-    for i in range(0, parallel_write_num):
-        if len(data_to_write_list) == 0:
+        # Add all new shards, cleaned up so they're just dt=2019-07-15-04-45
+        for common_prefix in s3_list_results["common_prefixes"]:
+            s3_shards.add(
+                common_prefix.replace(
+                    project_id,
+                    ""
+                ).replace(
+                    "/",
+                    ""
+                )
+            )
+
+        # No further to go, we've exhausted the continuation token
+        if continuation_token == False:
             break
 
-        data_to_write = data_to_write_list.pop(0)
-        s3_write_futures.append(
-            task_spawner.write_json_to_s3(
+    raise gen.Return(s3_shards)
+
+
+def get_athena_partition_registry(dbsession, credentials, project_id):
+    athena_partition_registry = dbsession.query(AthenaPartitionRegistry).filter_by(
+        project_id=project_id
+    ).first()
+
+    if athena_partition_registry is None:
+        athena_partition_registry = AthenaPartitionRegistry()
+        athena_partition_registry.project_id = project_id
+        dbsession.add(athena_partition_registry)
+
+    athena_partition_registry.aws_account_id = credentials["id"]
+
+    return athena_partition_registry
+
+
+@gen.coroutine
+def update_athena_table_partitions(db_session_maker, task_spawner, credentials, project_id):
+    """
+    Adds the shards written to S3 since the last update to the Athena project
+    table as partitions. The newest shard added so far is the watermark of the
+    project's AthenaPartitionRegistry, so only the shards after it have to be
+    listed and Athena doesn't have to be asked which partitions it already has.
+
+    Projects without a watermark are reconciled instead, see
+    reconcile_athena_table_partitions.
+    """
+    project_id = re.sub(REGEX_WHITELISTS["project_id"], "", project_id)
+
+    dbsession = db_session_maker()
+
+    try:
+        athena_partition_registry = get_athena_partition_registry(
+            dbsession,
+            credentials,
+            project_id
+        )
+        watermark_shard = athena_partition_registry.watermark_shard
+
+        if watermark_shard is None:
+            dbsession.commit()
+            yield reconcile_athena_table_partitions(
+                db_session_maker,
+                task_spawner,
                 credentials,
-                credentials["logs_bucket"],
-                data_to_write["s3_path"],
-                data_to_write["chunked_data"]
+                project_id
             )
+            raise gen.Return()
+
+        s3_shards = yield list_project_log_shards(
+            task_spawner,
+            credentials,
+            project_id,
+            watermark_shard
         )
 
-        # If we've hit our parallel write number
-        # We should yield and wait for the results
-        s3_write_futures_number = len(s3_write_futures)
-        if s3_write_futures_number >= 5:
-            logit("Writing batch of #" + str(s3_write_futures_number) + " page(s) of search results to S3...")
-            yield s3_write_futures
+        # The list of shards which have not been imported into Athena
+        new_s3_shards = sorted([
+            s3_shard for s3_shard in s3_shards
+            if s3_shard > watermark_shard
+        ])
+
+        # If we have new partitions let's load them.
+        if len(new_s3_shards) > 0:
+            yield load_further_partitions(
+                task_spawner,
+                credentials,
+                project_id,
+                new_s3_shards
+            )
 
-            # Clear list of futures
-            s3_write_futures = []
+            athena_partition_registry.watermark_shard = new_s3_shards[-1]
+            athena_partition_registry.timestamp = int(time.time())
 
-    # If there are remaining futures we need to yield them
-    s3_write_futures_number = len(s3_write_futures)
-    if s3_write_futures_number > 0:
-        logit("Writing remaining batch of #" + str(s3_write_futures_number) + " page(s) of search results to S3...")
-        yield s3_write_futures
+        dbsession.commit()
+    finally:
+        dbsession.close()
 
 
 @gen.coroutine
-def update_athena_table_partitions(task_spawner, credentials, project_id):
+def reconcile_athena_table_partitions(db_session_maker, task_spawner, credentials, project_id):
     """
     Check all the partitions that are in the Athena project table and
     check S3 to see if there are any partitions which need to be added to the
-    table. If there are then kick off a query to load the new partitions.
+    table (e.g. shards which were written to after newer ones, behind the
+    watermark). If there are then kick off a query to load the new partitions,
+    and move the project's watermark up to the newest shard.
+
+    This takes two Athena queries and a listing of every shard of the project,
+    so it's kept off of the request path: it's done once to set up the
+    watermark and then periodically by the reconcile_athena_partitions job.
     """
     project_id = re.sub(REGEX_WHITELISTS["project_id"], "", project_id)
     query_template = "SHOW PARTITIONS PRJ_{{PROJECT_ID_REPLACE_ME}}"
@@ -114,76 +208,22 @@ def update_athena_table_partitions(task_spawner, credentials, project_id):
         True
     )
 
-    athena_known_shards = []
+    athena_known_shards = set()
 
     for result in results:
         for key, shard_string in result.items():
-            if not (shard_string in athena_known_shards):
-                athena_known_shards.append(
-                    shard_string
-                )
-
-    athena_known_shards.sort()
-
-    # S3 pulled shards
-    s3_pulled_shards = []
-
-    continuation_token = False
-
-    s3_prefix = project_id + "/"
-
-    latest_athena_known_shard = False
-    if len(athena_known_shards) > 0:
-        latest_athena_known_shard = s3_prefix + athena_known_shards[-1]
-
-    # For loops which do not have a discreet conditional break, we enforce
-    # an upper bound of iterations.
-    MAX_LOOP_ITERATIONS = 1000
-
-    # Bound this loop to only execute MAX_LOOP_ITERATION times since we
-    # cannot guarantee that the condition `continuation_token == False`
-    # will ever be true.
-    for _ in range(MAX_LOOP_ITERATIONS):
-        s3_list_results = yield task_spawner.get_s3_list_from_prefix(
-            credentials,
-            credentials["logs_bucket"],
-            s3_prefix,
-            continuation_token,
-            latest_athena_known_shard
-        )
-
-        s3_shards = s3_list_results["common_prefixes"]
-        continuation_token = s3_list_results["continuation_token"]
-
-        # Add all new shards to the list
-        for s3_shard in s3_shards:
-            if not (s3_shard in s3_pulled_shards):
-                s3_pulled_shards.append(
-                    s3_shard
-                )
+            athena_known_shards.add(
+                shard_string
+            )
 
-        # No further to go, we've exhausted the continuation token
-        if continuation_token == False:
-            break
+    s3_shards = yield list_project_log_shards(
+        task_spawner,
+        credentials,
+        project_id
+    )
 
     # The list of shards which have not been imported into Athena
-    new_s3_shards = []
-
-    for s3_pulled_shard in s3_pulled_shards:
-        # Clean it up so it's just dt=2019-07-15-04-45
-        s3_pulled_shard = s3_pulled_shard.replace(
-            project_id,
-            ""
-        )
-        s3_pulled_shard = s3_pulled_shard.replace(
-            "/",
-            ""
-        )
-
-        if not (s3_pulled_shard in athena_known_shards):
-            new_s3_shards.append(
-                s3_pulled_shard
-            )
+    new_s3_shards = sorted(s3_shards - athena_known_shards)
 
     # If we have new partitions let's load them.
     if len(new_s3_shards) > 0:
@@ -194,7 +234,27 @@ def update_athena_table_partitions(task_spawner, credentials, project_id):
             new_s3_shards
         )
 
-    raise gen.Return()
+    dbsession = db_session_maker()
+
+    try:
+        athena_partition_registry = get_athena_partition_registry(
+            dbsession,
+            credentials,
+            project_id
+        )
+
+        all_shards = sorted(s3_shards | athena_known_shards)
+        if len(all_shards) > 0:
+            athena_partition_registry.watermark_shard = max(
+                all_shards[-1],
+                athena_partition_registry.watermark_shard or ""
+            )
+
+        athena_partition_registry.reconciled_timestamp = int(time.time())
+        athena_partition_registry.timestamp = int(time.time())
+        dbsession.commit()
+    finally:
+        dbsession.close()
 
 
 @aws_exponential_backoff()
@@ -271,19 +331,6 @@ def generate_athena_add_shards_query(logs_bucket, project_id, new_shards_list):
     return query
 
 
-def get_five_minute_dt_from_dt(input_datetime):
-    round_to = (60 * 5)
-
-    seconds = (input_datetime.replace(tzinfo=None) - input_datetime.min).seconds
-    rounding = (seconds + round_to / 2) // round_to * round_to
-    nearest_datetime = input_datetime + datetime.timedelta(0, rounding - seconds, - input_datetime.microsecond)
-    return nearest_datetime
-
-
-def dt_to_shard(input_dt):
-    return input_dt.strftime("%Y-%m-%d-%H-%M")
-
-
 @gen.coroutine
 def get_execution_stats_since_timestamp(db_session_maker, task_spawner, credentials, project_id, oldest_timestamp):
     # Database session for pulling cached data
@@ -311,68 +358,15 @@ def get_execution_stats_since_timestamp(db_session_maker, task_spawner, credenti
     )
     oldest_shard_dt_shard = dt_to_shard(oldest_shard_dt)
 
-    # Standard S3 prefix before date for all S3 shards
-    s3_prefix = project_id + "/dt="
-
-    example_shard = s3_prefix + oldest_shard_dt_shard
-
-    all_s3_shards = []
-
-    common_prefixes = []
-
-    continuation_token = False
-
-    # For loops which do not have a discreet conditional break, we enforce
-    # an upper bound of iterations.
-    MAX_LOOP_ITERATIONS = 1000
-
-    # Bound this loop to only execute MAX_LOOP_ITERATION times since we
-    # cannot guarantee that the condition `continuation_token == False`
-    # will ever be true.
-    for _ in range(MAX_LOOP_ITERATIONS):
-        # List shards in the S3 bucket starting at the oldest available shard
-        # That's because S3 buckets will start at the oldest time and end at
-        # the latest time (due to inverse binary UTF-8 sort order)
-        s3_list_results = yield task_spawner.get_s3_list_from_prefix(
-            credentials,
-            credentials["logs_bucket"],
-            s3_prefix,
-            continuation_token,
-            example_shard
-        )
-
-        current_common_prefixes = s3_list_results["common_prefixes"]
-        continuation_token = s3_list_results["continuation_token"]
-
-        # Add all new shards to the list
-        for common_prefix in current_common_prefixes:
-            if not (common_prefix in common_prefixes):
-                common_prefixes.append(
-                    common_prefix
-                )
-
-        # No further to go, we've exhausted the continuation token
-        if continuation_token == False:
-            break
-
-    for shard_full_path in common_prefixes:
-        # Clean it up so it's just dt=2019-07-15-04-45
-        shard_full_path = shard_full_path.replace(
-            project_id,
-            ""
-        )
-        shard_full_path = shard_full_path.replace(
-            "/",
-            ""
-        )
-
-        if not (shard_full_path in all_s3_shards):
-            all_s3_shards.append(
-                shard_full_path
-            )
+    all_s3_shards = yield list_project_log_shards(
+        task_spawner,
+        credentials,
+        project_id,
+        "dt=" + oldest_shard_dt_shard
+    )
 
     """
-	execution_log_results example:
+	execution_log_result examples, as parsed out of the keys in S3:
 	[
 		{
 			"arn": "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn2",
@@ -398,126 +392,101 @@ def get_execution_stats_since_timestamp(db_session_maker, task_spawner, credenti
 		}
 	]
 	"""
-    # Array of all of the metadata for each execution
-    execution_log_results = []
-
     start_time = time.time()
 
-    # Before we do the next step we can save ourselves a lot of time
-    # by pulling all of the cached shard data from the database.
-    # All of the remaining shards we can go and scan out of S3.
-    cached_execution_shards = dbsession.query(CachedExecutionLogsShard).filter(
-        CachedExecutionLogsShard.project_id == project_id
-    ).filter(
-        CachedExecutionLogsShard.date_shard.in_(
-            all_s3_shards
-        )
-    ).all()
-
-    logit("--- Pulling shards from database: %s seconds ---" % (time.time() - start_time), "debug")
-
-    # Take the list of cached_execution_shards and remove all of the
-    # cached results contained in it from the list of shards we need to
-    # go scan S3 for.
-    cached_execution_log_results = []
+    # Before we do the next step we can save ourselves a lot of time by
+    # skipping the shards which are already sealed, their execution counts
+    # are rolled up in the database. Only the remaining shards have to be
+    # scanned out of S3.
+    sealed_shards = [
+        sealed_shard.date_shard for sealed_shard in dbsession.query(
+            CachedExecutionLogsShard.date_shard
+        ).filter(
+            CachedExecutionLogsShard.project_id == project_id
+        ).filter(
+            CachedExecutionLogsShard.date_shard.in_(
+                list(all_s3_shards)
+            )
+        ).all()
+    ]
 
     logit(
-        "Number of cached shards in the DB we can skip S3 scanning for: " + str(len(cached_execution_shards)),
+        "Number of sealed shards in the DB we can skip S3 scanning for: " + str(len(sealed_shards)),
         "debug"
     )
 
-    for cached_execution_shard in cached_execution_shards:
-        cached_execution_shard_dict = cached_execution_shard.to_dict()
+    all_s3_shards = all_s3_shards - set(sealed_shards)
 
-        # Add the cached shard data to the cached executions
-        cached_execution_log_results = cached_execution_log_results + cached_execution_shard_dict["shard_data"]
+    convert_legacy_execution_log_shards(
+        dbsession,
+        project_id,
+        sealed_shards
+    )
 
-        # Remove this from the shards to go scan since we already have it
-        if cached_execution_shard_dict["date_shard"] in all_s3_shards:
-            all_s3_shards.remove(cached_execution_shard_dict["date_shard"])
+    sealed_rollups = get_sealed_execution_log_rollups(
+        dbsession,
+        project_id,
+        sealed_shards
+    )
 
-    logit("Number of un-cached shards in S3 we have to scan: " + str(len(all_s3_shards)), "debug")
+    logit("--- Pulling rollups from database: %s seconds ---" % (time.time() - start_time), "debug")
 
-    for s3_shard in all_s3_shards:
-        full_shard = project_id + "/" + s3_shard
+    logit("Number of un-sealed shards in S3 we have to scan: " + str(len(all_s3_shards)), "debug")
 
-        start_time = time.time()
-        execution_logs = yield task_spawner.get_s3_pipeline_execution_logs(
-            credentials,
-            full_shard,
-            -1
-        )
-        logit("--- Pulling keys from S3: %s seconds ---" % (time.time() - start_time), "debug")
+    # The execution log results of the un-sealed shards, rolled up as
+    # their keys are listed (see add_execution_log_result_to_rollups):
+    # {"{{DT_SHARD}}": {{ROLLUPS_BY_KEY}}}
+    shard_rollups = {}
 
-        start_time = time.time()
+    def add_execution_log_page(shard_prefix, execution_logs):
         for execution_log in execution_logs:
-            execution_log_results.append(
-                get_execution_metadata_from_s3_key(
-                    credentials["region"],
-                    credentials["account_id"],
-                    execution_log
-                )
+            execution_log_result = get_execution_metadata_from_s3_key(
+                credentials["region"],
+                credentials["account_id"],
+                execution_log
             )
-        logit("--- Parsing S3 keys: %s seconds ---" % (time.time() - start_time), "debug")
 
-    # We now got over all the execution log results to see what can be cached. The way
-    # we do this is we go over each execution log result and we check if the "dt" shard
-    # is less than or equal to the time specified in the assured_cachable_dt. If it is,
-    # we than add it to our cachable_dict (format below) and at the end we store all of
-    # the results in the database so that we never have to pull those shards again.
-    """
-	{
-		"{{CACHEABLE_DT_SHARD}}": [
-			{
-				"arn": "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn2",
-				"count": "1",
-				"dt": "2019-07-15-13-35",
-				"execution_pipeline_id": "46b0fdd3-266d-4c6f-af7c-79198a112e96",
-				"function_name": "Untitled_Code_Block_RFNItzJNn2",
-				"log_id": "22e4625e-46d1-401a-b935-bcde17f8b667",
-				"project_id": "08757409-4bc8-4a29-ade7-371b1a46f99e",
-				"timestamp": 1563197795,
-				"type": "SUCCESS"
-			}
-			{
-				"arn": "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn3",
-				"count": "1",
-				"dt": "2019-07-15-13-35",
-				"execution_pipeline_id": "46b0fdd3-266d-4c6f-af7c-79198a112e96",
-				"function_name": "Untitled_Code_Block_RFNItzJNn3",
-				"log_id": "40b02027-c856-4d2b-bd63-c62f300944e5",
-				"project_id": "08757409-4bc8-4a29-ade7-371b1a46f99e",
-				"timestamp": 1563197795,
-				"type": "SUCCESS"
-			}
-		]
-		"2019-07-15-13-35": "",
-	}
-	"""
+            if not (execution_log_result["dt"] in shard_rollups):
+                shard_rollups[execution_log_result["dt"]] = {}
+
+            add_execution_log_result_to_rollups(
+                shard_rollups[execution_log_result["dt"]],
+                execution_log_result
+            )
+
+    start_time = time.time()
+    page_count = yield task_spawner.scan_s3_shards(
+        credentials,
+        credentials["logs_bucket"],
+        [project_id + "/" + s3_shard + "/" for s3_shard in all_s3_shards],
+        add_execution_log_page
+    )
+    logit("--- Scanning %s page(s) of keys from S3: %s seconds ---" % (page_count, time.time() - start_time), "debug")
+
+    # We now go over the rollups of each shard to see what can be sealed. The way we do
+    # this is we check if the "dt" shard is less than or equal to the time specified in
+    # the assured_cachable_dt. If it is, we store its rollups in the database at the end
+    # so that we never have to pull that shard again.
+    execution_log_rollups = list(sealed_rollups)
     cachable_dict = {}
 
-    for execution_log_result in execution_log_results:
-        # Check if dt share is within the cachable range
-        current_execution_log_result_dt = execution_log_result["dt"]
+    for date_shard_key, rollups in shard_rollups.items():
+        execution_log_rollups.extend(
+            rollups.values()
+        )
+
+        # Check if dt shard is within the cachable range
         shard_as_dt = datetime.datetime.strptime(
-            current_execution_log_result_dt,
+            date_shard_key,
             "%Y-%m-%d-%H-%M"
         )
 
         if shard_as_dt <= assured_cachable_dt:
-            if not (current_execution_log_result_dt in cachable_dict):
-                cachable_dict[current_execution_log_result_dt] = []
-
-            cachable_dict[current_execution_log_result_dt].append(
-                execution_log_result
-            )
-
-    # Now we add in the cached shard data
-    execution_log_results = execution_log_results + cached_execution_log_results
+            cachable_dict[date_shard_key] = list(rollups.values())
 
     start_time = time.time()
     execution_pipeline_dict = execution_log_query_results_to_pipeline_id_dict(
-        execution_log_results
+        execution_log_rollups
     )
     logit("--- Converting to execution_pipeline_dict: %s seconds ---" % (time.time() - start_time), "debug")
 
@@ -528,15 +497,21 @@ def get_execution_stats_since_timestamp(db_session_maker, task_spawner, credenti
     logit("--- Converting to front-end-format: %s seconds ---" % (time.time() - start_time), "debug")
 
     start_time = time.time()
-    # We now store all cachable shard data in the database so we don't have
+    # We now seal all cachable shards in the database so we don't have
     # to rescan those shards in S3.
-    for date_shard_key, cachable_execution_list in cachable_dict.items():
+    for date_shard_key, cachable_rollups in cachable_dict.items():
         new_execution_log_shard = CachedExecutionLogsShard()
         new_execution_log_shard.date_shard = "dt=" + date_shard_key
-        new_execution_log_shard.shard_data = cachable_execution_list
         new_execution_log_shard.project_id = project_id
         dbsession.add(new_execution_log_shard)
 
+        add_execution_log_rollups(
+            dbsession,
+            project_id,
+            "dt=" + date_shard_key,
+            cachable_rollups
+        )
+
     # Write the cache data to the database
     dbsession.commit()
     dbsession.close()
@@ -545,8 +520,100 @@ def get_execution_stats_since_timestamp(db_session_maker, task_spawner, credenti
     raise gen.Return(frontend_format)
 
 
+def add_execution_log_rollups(dbsession, project_id, date_shard, rollups):
+    for rollup in rollups:
+        execution_log_rollup = ExecutionLogRollup()
+        execution_log_rollup.project_id = project_id
+        execution_log_rollup.date_shard = date_shard
+        execution_log_rollup.execution_pipeline_id = rollup["execution_pipeline_id"]
+        execution_log_rollup.arn = rollup["arn"]
+        execution_log_rollup.type = rollup["type"]
+        execution_log_rollup.count = rollup["count"]
+        execution_log_rollup.min_timestamp = rollup["min_timestamp"]
+        execution_log_rollup.max_timestamp = rollup["max_timestamp"]
+        dbsession.add(execution_log_rollup)
+
+
+def convert_legacy_execution_log_shards(dbsession, project_id, sealed_shards):
+    """
+    Shards sealed before rollups existed hold all of their raw execution
+    log results, these are rolled up (and the raw results dropped) so the
+    shard is only ever read as rollups from here on.
+    """
+    if len(sealed_shards) == 0:
+        return
+
+    legacy_shards = dbsession.query(CachedExecutionLogsShard).filter(
+        CachedExecutionLogsShard.project_id == project_id
+    ).filter(
+        CachedExecutionLogsShard.date_shard.in_(
+            sealed_shards
+        )
+    ).filter(
+        CachedExecutionLogsShard.shard_data.isnot(None)
+    ).all()
+
+    for legacy_shard in legacy_shards:
+        add_execution_log_rollups(
+            dbsession,
+            project_id,
+            legacy_shard.date_shard,
+            execution_log_results_to_rollups(legacy_shard.shard_data)
+        )
+
+        # SQL NULL rather than a JSON null, so it's excluded above
+        legacy_shard.shard_data = null()
+
+    if len(legacy_shards) > 0:
+        logit("Converted " + str(len(legacy_shards)) + " legacy cached shard(s) to rollups", "debug")
+
+
+def get_sealed_execution_log_rollups(dbsession, project_id, sealed_shards):
+    """
+    Merges the rollups of the sealed shards in the database, returning one
+    rollup per execution pipeline, ARN and execution type in the format of
+    execution_log_results_to_rollups.
+    """
+    if len(sealed_shards) == 0:
+        return []
+
+    rollup_results = dbsession.query(
+        ExecutionLogRollup.execution_pipeline_id,
+        ExecutionLogRollup.arn,
+        ExecutionLogRollup.type,
+        func.sum(ExecutionLogRollup.count),
+        func.min(ExecutionLogRollup.min_timestamp),
+        func.max(ExecutionLogRollup.max_timestamp)
+    ).filter(
+        ExecutionLogRollup.project_id == project_id
+    ).filter(
+        ExecutionLogRollup.date_shard.in_(
+            sealed_shards
+        )
+    ).group_by(
+        ExecutionLogRollup.execution_pipeline_id,
+        ExecutionLogRollup.arn,
+        ExecutionLogRollup.type
+    ).all()
+
+    return [
+        {
+            "execution_pipeline_id": execution_pipeline_id,
+            "arn": arn,
+            "type": execution_type,
+            "count": int(count),
+            "min_timestamp": min_timestamp,
+            "max_timestamp": max_timestamp,
+            "timestamp": max_timestamp
+        }
+        for execution_pipeline_id, arn, execution_type, count, min_timestamp, max_timestamp in rollup_results
+    ]
+
+
 def get_execution_metadata_from_s3_key(aws_region, account_id, input_s3_key):
     # 08757409-4bc8-4a29-ade7-371b1a46f99e/dt=2019-07-15-18-00/e4e3571e-ab59-4790-8072-3049805301c3/SUCCESS~Untitled_Code_Block_RFNItzJNn2~3233e08a-baf0-4f8f-a4c2-ee2d3153f75b~1563213635
+    # Coalesced log objects have the number of logs they hold appended:
+    # .../SUCCESS~Untitled_Code_Block_RFNItzJNn2~3233e08a-baf0-4f8f-a4c2-ee2d3153f75b~1563213635~12
     s3_key_parts = input_s3_key.split(
         "/"
     )
@@ -563,7 +630,7 @@ def get_execution_metadata_from_s3_key(aws_region, account_id, input_s3_key):
         "function_name": log_file_name_parts[1],
         "log_id": log_file_name_parts[2],
         "timestamp": int(log_file_name_parts[3]),
-        "count": "1"
+        "count": log_file_name_parts[4] if len(log_file_name_parts) > 4 else "1"
     }
 
     return return_data
@@ -1,13 +1,11 @@
-import uuid
-
 from jsonschema import validate as validate_schema
 from tornado import gen
 
 from controller import BaseHandler
 from controller.decorators import authenticated, disable_on_overdue_payment
-from controller.logs.actions import chunk_list, write_remaining_project_execution_log_pages, \
-    get_execution_stats_since_timestamp, update_athena_table_partitions
+from controller.logs.actions import get_execution_stats_since_timestamp, update_athena_table_partitions
 from controller.logs.schemas import *
+from tasks.athena import is_partition_projection_enabled
 from utils.locker import AcquireFailure
 
 
@@ -25,22 +23,11 @@ class GetProjectExecutionLogObjects(BaseHandler):
 
         credentials = self.get_authenticated_user_cloud_configuration()
 
-        results_list = []
-
-        for log_to_fetch in self.json["logs_to_fetch"]:
-            s3_key = log_to_fetch["s3_key"]
-            log_id = log_to_fetch["log_id"]
-
-            log_data = yield self.task_spawner.get_json_from_s3(
-                credentials,
-                credentials["logs_bucket"],
-                s3_key
-            )
-
-            results_list.append({
-                "log_data": log_data,
-                "log_id": log_id
-            })
+        results_list = yield self.task_spawner.get_execution_logs_from_s3(
+            credentials,
+            credentials["logs_bucket"],
+            self.json["logs_to_fetch"]
+        )
 
         self.write({
             "success": True,
@@ -64,7 +51,9 @@ class GetProjectExecutionLogs(BaseHandler):
 
         credentials = self.get_authenticated_user_cloud_configuration()
 
-        results = yield self.task_spawner.get_block_executions(
+        # The first page of results, the rest are written to S3 as they're
+        # read from Athena to be loaded later by the frontend on demand.
+        final_return_data = yield self.task_spawner.write_block_execution_pages(
             credentials,
             self.json["project_id"],
             self.json["execution_pipeline_id"],
@@ -72,60 +61,11 @@ class GetProjectExecutionLogs(BaseHandler):
             self.json["oldest_timestamp"]
         )
 
-        # Split out shards
-        chunked_results = chunk_list(
-            results,
-            50
-        )
-
-        # The final return format
-        final_return_data = {
-            "results": [],
-            "pages": []
-        }
-
-        # Take the first 50 results and stuff it into "results"
-        if len(chunked_results) > 0:
-            # Pop first list of list of lists
-            final_return_data["results"] = chunked_results.pop(0)
-
-        # We batch up the work to do but we don't yield on it until
-        # after we write the response. This allows for fast response times
-        # and by the time they actually request a later page we've already
-        # written it.
-        data_to_write_list = []
-
-        # Turn the rest into S3 chunks which can be loaded later
-        # by the frontend on demand.
-        for chunked_result in chunked_results:
-            result_uuid = str(uuid.uuid4())
-            s3_path = "log_pagination_result_pages/" + result_uuid + ".json"
-            data_to_write_list.append({
-                "s3_path": s3_path,
-                "chunked_data": chunked_result
-            })
-
-            # We just add the UUID to the response as if we've
-            # already written it
-            final_return_data["pages"].append(
-                result_uuid
-            )
-
-        # Clear that memory ASAP
-        del chunked_results
-
         self.write({
             "success": True,
             "result": final_return_data
         })
 
-        # Write the remaining results
-        yield write_remaining_project_execution_log_pages(
-            self.task_spawner,
-            credentials,
-            data_to_write_list
-        )
-
 
 class GetProjectExecutionLogsPage(BaseHandler):
     @authenticated
@@ -194,13 +134,15 @@ class GetProjectExecutions(BaseHandler):
             # Enforce that we are only attempting to do this once per project
             with task_lock:
                 # We do this to always keep Athena partitioned for the later
-                # steps of querying
-                self.logger("Updating athena table partitions for project: " + project_id)
-                update_athena_table_partitions(
-                    self.task_spawner,
-                    credentials,
-                    project_id
-                )
+                # steps of querying, unless Athena projects the partitions itself
+                if not is_partition_projection_enabled(self.app_config):
+                    self.logger("Updating athena table partitions for project: " + project_id)
+                    update_athena_table_partitions(
+                        self.db_session_maker,
+                        self.task_spawner,
+                        credentials,
+                        project_id
+                    )
 
         except AcquireFailure:
             # This is not an error, we just already have one in progress
@@ -230,3 +172,40 @@ class GetProjectExecutions(BaseHandler):
             "success": True,
             "result": execution_pipeline_totals
         })
+
+
+class GetBlockPhaseLatencies(BaseHandler):
+    @authenticated
+    @disable_on_overdue_payment
+    @gen.coroutine
+    def post(self):
+        """
+        Get histograms of how long each phase of the runtime (loading
+        input, executing the block, invoking transitions, etc) took
+        for a deployed block. Only executions with runtime tracing
+        enabled are included.
+        """
+        validate_schema(self.json, GET_BLOCK_PHASE_LATENCIES_SCHEMA)
+
+        # Ensure user is owner of the project
+        if not self.is_owner_of_project(self.json["project_id"]):
+            self.write({
+                "success": False,
+                "code": "ACCESS_DENIED",
+                "msg": "You do not have priveleges to access that project's executions!",
+            })
+            raise gen.Return()
+
+        credentials = self.get_authenticated_user_cloud_configuration()
+
+        phase_latencies = yield self.task_spawner.get_block_phase_latencies(
+            credentials,
+            self.json["project_id"],
+            self.json["arn"],
+            self.json["oldest_timestamp"]
+        )
+
+        self.write({
+            "success": True,
+            "result": phase_latencies
+        })
@@ -75,3 +75,23 @@ GET_PROJECT_EXECUTIONS_SCHEMA = {
         "oldest_timestamp"
     ]
 }
+
+GET_BLOCK_PHASE_LATENCIES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "project_id": {
+            "type": "string",
+        },
+        "arn": {
+            "type": "string",
+        },
+        "oldest_timestamp": {
+            "type": "integer"
+        }
+    },
+    "required": [
+        "project_id",
+        "arn",
+        "oldest_timestamp"
+    ]
+}
@@ -11,7 +11,8 @@ from controller.decorators import authenticated
 from controller.logs.actions import delete_logs
 from controller.projects.actions import update_project_config
 from controller.projects.schemas import *
-from models import Deployment, ProjectVersion, ProjectConfig, Project, ProjectShortLink, User, CachedExecutionLogsShard
+from models import Deployment, ProjectVersion, ProjectConfig, Project, ProjectShortLink, User, CachedExecutionLogsShard, \
+    ExecutionLogRollup, AthenaPartitionRegistry, CachedAthenaQueryResult
 
 
 class SaveProjectConfig(BaseHandler):
@@ -327,6 +328,12 @@ class DeleteSavedProject(BaseHandler):
                 CachedExecutionLogsShard.project_id == project_id
             ).delete()
 
+            self.dbsession.query(
+                ExecutionLogRollup
+            ).filter(
+                ExecutionLogRollup.project_id == project_id
+            ).delete()
+
         # delete existing logs for the project
         delete_logs(
             self.task_spawner,
@@ -334,6 +341,18 @@ class DeleteSavedProject(BaseHandler):
             project_id
         )
 
+        self.dbsession.query(
+            AthenaPartitionRegistry
+        ).filter(
+            AthenaPartitionRegistry.project_id == project_id
+        ).delete()
+
+        self.dbsession.query(
+            CachedAthenaQueryResult
+        ).filter(
+            CachedAthenaQueryResult.project_id == project_id
+        ).delete()
+
         saved_project_result = self.dbsession.query(Project).filter_by(
             id=project_id
         ).first()
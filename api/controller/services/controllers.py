@@ -10,10 +10,12 @@ from traceback import print_exc
 
 from assistants.deployments.teardown import teardown_infrastructure
 from controller import BaseHandler
+from controller.logs.actions import reconcile_athena_table_partitions, ATHENA_PARTITION_RECONCILE_INTERVAL_SECONDS
 from controller.services.actions import clear_sub_account_packages, get_last_month_start_and_end_date_strings
-from models import AWSAccount, User, TerraformStateVersion
+from models import AWSAccount, User, TerraformStateVersion, AthenaPartitionRegistry
 from assistants.deployments.dangling_resources import get_user_dangling_resources
 from pyconstants.project_constants import THIRD_PARTY_AWS_ACCOUNT_ROLE_NAME
+from tasks.athena import is_partition_projection_enabled
 
 
 class AdministrativeAssumeAccount(BaseHandler):
@@ -374,6 +376,58 @@ class ClearAllS3BuildPackages(BaseHandler):
         self.logger("S3 package clearing complete.")
 
 
+class ReconcileAthenaTablePartitions(BaseHandler):
+    @gen.coroutine
+    def get(self):
+        """
+        Checks the Athena partition registry of every project which hasn't
+        been reconciled recently against the partitions its Athena table
+        actually has, adding the ones which are missing.
+        """
+        self.write({
+            "success": True,
+            "msg": "Athena partition reconcile job kicked off successfully!"
+        })
+        self.finish()
+
+        if is_partition_projection_enabled(self.app_config):
+            self.logger("Athena partition projection is enabled, there are no partitions to reconcile.")
+            raise gen.Return()
+
+        dbsession = self.db_session_maker()
+        stale_registries = dbsession.query(AthenaPartitionRegistry, AWSAccount).join(
+            AWSAccount,
+            AthenaPartitionRegistry.aws_account_id == AWSAccount.id
+        ).filter(
+            sql_or(
+                AthenaPartitionRegistry.reconciled_timestamp == None,
+                AthenaPartitionRegistry.reconciled_timestamp < int(time.time()) - ATHENA_PARTITION_RECONCILE_INTERVAL_SECONDS
+            )
+        ).all()
+
+        stale_projects = []
+        for athena_partition_registry, aws_account in stale_registries:
+            stale_projects.append(
+                (athena_partition_registry.project_id, aws_account.to_dict())
+            )
+        dbsession.close()
+
+        self.logger("Reconciling Athena table partitions for " + str(len(stale_projects)) + " project(s)...")
+
+        for project_id, credentials in stale_projects:
+            try:
+                yield reconcile_athena_table_partitions(
+                    self.db_session_maker,
+                    self.task_spawner,
+                    credentials,
+                    project_id
+                )
+            except Exception as e:
+                self.logger("Unable to reconcile Athena table partitions for project " + project_id + ": " + repr(e))
+
+        self.logger("Athena partition reconciling complete.")
+
+
 class MaintainAWSAccountReserves(BaseHandler):
     @gen.coroutine
     def get(self):
@@ -2,13 +2,16 @@
 Model definitions
 """
 
+from .athena_partition_registry import AthenaPartitionRegistry
 from .aws_accounts import AWSAccount
+from .cached_athena_query_result import CachedAthenaQueryResult
 from .cached_billing_collections import CachedBillingCollection
 from .cached_billing_items import CachedBillingItem
 from .cached_execution_logs_shard import CachedExecutionLogsShard
 from .deployments import Deployment
 from .deployment_log import DeploymentLog
 from .email_auth_tokens import EmailAuthToken
+from .execution_log_rollup import ExecutionLogRollup
 from .git_repo import GitRepoModel
 from .git_repo_data_record import GitRepoDataRecordsModel
 from .inline_execution_lambdas import InlineExecutionLambda
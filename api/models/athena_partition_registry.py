@@ -0,0 +1,60 @@
+from .initiate_database import *
+from .aws_accounts import AWSAccount
+from .projects import Project
+import time
+
+
+class AthenaPartitionRegistry(Base):
+    """
+    Which date shards of a project's execution logs are registered as
+    partitions of its Athena table: every shard up to and including the
+    watermark. Only the shards written after it have to be looked for and
+    registered, instead of diffing all of the project's shards in S3 against
+    the partitions Athena has.
+    """
+    __tablename__ = "athena_partition_registries"
+
+    # Project ID of the Athena table
+    project_id = Column(
+        CHAR(36),
+        ForeignKey(Project.id),
+        primary_key=True
+    )
+
+    # AWS account holding the project's logs and Athena table
+    aws_account_id = Column(
+        CHAR(36),
+        ForeignKey(AWSAccount.id)
+    )
+
+    # Newest date shard registered as a partition
+    # e.g. "dt=2019-07-15-13-35"
+    watermark_shard = Column(Text())
+
+    # When the registry was last checked against the partitions
+    # Athena actually has
+    reconciled_timestamp = Column(Integer())
+
+    timestamp = Column(Integer())
+
+    def __init__(self):
+        self.timestamp = int(time.time())
+
+    def to_dict(self):
+        exposed_attributes = [
+            "project_id",
+            "aws_account_id",
+            "watermark_shard",
+            "reconciled_timestamp",
+            "timestamp"
+        ]
+
+        return_dict = {}
+
+        for attribute in exposed_attributes:
+            return_dict[attribute] = getattr(self, attribute)
+
+        return return_dict
+
+    def __str__(self):
+        return self.project_id
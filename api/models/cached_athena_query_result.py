@@ -0,0 +1,102 @@
+from sqlalchemy import Index
+
+from .initiate_database import *
+from .projects import Project
+import time
+
+
+class CachedAthenaQueryResult(Base):
+    """
+    The rows an Athena query over a project's execution logs returned from
+    its sealed date shards (every shard from oldest_timestamp up to and
+    including sealed_shard), which no more logs will land in. Only the
+    shards after it ever have to be queried again.
+    """
+    __tablename__ = "cached_athena_query_results"
+
+    # SHA256 of the AWS account and the normalized query
+    id = Column(
+        CHAR(64),
+        primary_key=True
+    )
+
+    # Project ID of the queried Athena table
+    project_id = Column(
+        CHAR(36),
+        ForeignKey(Project.id),
+        nullable=False
+    )
+
+    # The normalized query, without its oldest_timestamp
+    query = Column(Text())
+
+    # Oldest and newest date shards the rows cover
+    # e.g. "2019-07-15-13-35"
+    oldest_timestamp = Column(Text())
+    sealed_shard = Column(Text())
+
+    result_data = Column(JSON())
+
+    # Size of the result data as JSON, counted against the size of the cache
+    size_bytes = Column(
+        BigInteger(),
+        nullable=False
+    )
+
+    # Bytes Athena scanned for the rows, saved on every hit
+    bytes_scanned = Column(
+        BigInteger(),
+        nullable=False
+    )
+
+    hit_count = Column(
+        Integer(),
+        nullable=False
+    )
+
+    # The least recently used results are evicted first
+    last_used_timestamp = Column(Integer())
+
+    timestamp = Column(Integer())
+
+    def __init__(self):
+        self.hit_count = 0
+        self.bytes_scanned = 0
+        self.timestamp = int(time.time())
+        self.last_used_timestamp = self.timestamp
+
+    def to_dict(self):
+        exposed_attributes = [
+            "id",
+            "project_id",
+            "query",
+            "oldest_timestamp",
+            "sealed_shard",
+            "result_data",
+            "size_bytes",
+            "bytes_scanned",
+            "hit_count",
+            "last_used_timestamp",
+            "timestamp"
+        ]
+
+        return_dict = {}
+
+        for attribute in exposed_attributes:
+            return_dict[attribute] = getattr(self, attribute)
+
+        return return_dict
+
+    def __str__(self):
+        return self.id
+
+
+Index(
+    'ix_cached_athena_query_results_last_used_timestamp',
+    CachedAthenaQueryResult.last_used_timestamp
+)
+
+Index(
+    'ix_cached_athena_query_results_project_id',
+    CachedAthenaQueryResult.project_id
+)
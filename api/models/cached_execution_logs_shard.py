@@ -1,3 +1,5 @@
+from sqlalchemy import Index
+
 from .initiate_database import *
 from .projects import Project
 import uuid
@@ -5,6 +7,11 @@ import time
 
 
 class CachedExecutionLogsShard(Base):
+    """
+    Marks a date shard of a project's execution logs as sealed: no more logs
+    will land in it, and its execution counts are stored as rollups (see
+    ExecutionLogRollup) so it never has to be scanned out of S3 again.
+    """
     __tablename__ = "cached_execution_logs_shards"
 
     id = Column(
@@ -20,6 +27,9 @@ class CachedExecutionLogsShard(Base):
     )
 
     """
+    # Only set for shards sealed before rollups existed, which are converted
+    # to rollups (and this cleared) the next time they're read.
+    #
     # All of the cached data for a given shard (e.g. "dt=2019-07-15-13-35")
     [
         {
@@ -79,3 +89,10 @@ class CachedExecutionLogsShard(Base):
 
     def __str__(self):
         return self.id
+
+
+Index(
+    'ix_cached_execution_logs_shards_project_id_date_shard',
+    CachedExecutionLogsShard.project_id,
+    CachedExecutionLogsShard.date_shard
+)
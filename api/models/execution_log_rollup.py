@@ -0,0 +1,101 @@
+from sqlalchemy import Index
+
+from .initiate_database import *
+from .projects import Project
+import uuid
+
+
+class ExecutionLogRollup(Base):
+    """
+    The execution counts of a sealed date shard (see CachedExecutionLogsShard),
+    one row per execution pipeline, block and execution type:
+
+    {
+        "date_shard": "dt=2019-07-15-13-35",
+        "execution_pipeline_id": "46b0fdd3-266d-4c6f-af7c-79198a112e96",
+        "arn": "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn2",
+        "type": "SUCCESS",
+        "count": 12,
+        "min_timestamp": 1563197795,
+        "max_timestamp": 1563197850
+    }
+    """
+    __tablename__ = "execution_log_rollups"
+
+    id = Column(
+        CHAR(36),
+        primary_key=True
+    )
+
+    # Project ID these logs are related to
+    project_id = Column(
+        CHAR(36),
+        ForeignKey(Project.id),
+        nullable=False
+    )
+
+    # The date shard this rollup was sealed from
+    # e.g. "dt=2019-07-15-13-35"
+    date_shard = Column(
+        Text(),
+        nullable=False
+    )
+
+    execution_pipeline_id = Column(
+        CHAR(36),
+        nullable=False
+    )
+
+    arn = Column(
+        Text(),
+        nullable=False
+    )
+
+    # SUCCESS, CAUGHT_EXCEPTION or EXCEPTION
+    type = Column(
+        Text(),
+        nullable=False
+    )
+
+    # Number of executions in the shard
+    count = Column(
+        Integer(),
+        nullable=False
+    )
+
+    # Timestamps of the oldest and the newest of those executions
+    min_timestamp = Column(Integer())
+    max_timestamp = Column(Integer())
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+
+    def to_dict(self):
+        exposed_attributes = [
+            "id",
+            "project_id",
+            "date_shard",
+            "execution_pipeline_id",
+            "arn",
+            "type",
+            "count",
+            "min_timestamp",
+            "max_timestamp"
+        ]
+
+        return_dict = {}
+
+        for attribute in exposed_attributes:
+            return_dict[attribute] = getattr(self, attribute)
+
+        return return_dict
+
+    def __str__(self):
+        return self.id
+
+
+Index(
+    'ix_execution_log_rollups_project_id_date_shard',
+    ExecutionLogRollup.project_id,
+    ExecutionLogRollup.date_shard
+)
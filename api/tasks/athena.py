@@ -1,18 +1,23 @@
+from codecs import getincrementaldecoder
+from concurrent import futures
 from csv import DictReader
 from datetime import datetime
+from heapq import merge
 
 from assistants.decorators import aws_exponential_backoff
-from tasks.s3 import read_from_s3
+from tasks.s3 import read_from_s3, stream_from_s3, write_json_to_s3
 from pyconstants.project_constants import REGEX_WHITELISTS
 from pystache import render
 from time import sleep
-from utils.general import logit
+from utils.general import logit, get_newest_sealed_shard
 from re import sub
 from utils.mapper import (
     execution_log_query_results_to_pipeline_id_dict,
     execution_pipeline_id_dict_to_frontend_format
 )
 from io import StringIO
+from json import loads
+from uuid import uuid4
 
 
 def get_athena_results_from_s3(aws_client_factory, credentials, s3_bucket, s3_path):
@@ -53,7 +58,38 @@ def _get_athena_execution_result(athena_client, **kwargs):
     return athena_client.get_query_execution(**kwargs)
 
 
-def perform_athena_query(aws_client_factory, credentials, query, return_results):
+# Polls for the status of a query start this far apart, backing off to the
+# max delay, until the query has run for the timeout
+ATHENA_POLL_INITIAL_DELAY_SECONDS = 0.05
+ATHENA_POLL_MAX_DELAY_SECONDS = 1.0
+ATHENA_QUERY_TIMEOUT_SECONDS = 60
+
+ATHENA_QUERY_FAILED_STATES = [
+    "CANCELLED",
+    "FAILED"
+]
+
+
+def get_athena_poll_delays():
+    """
+    Yields how long to wait before each poll for the status of a query.
+    Most queries run for well under a second, so the first polls come
+    quickly and they back off from there.
+    """
+    delay = ATHENA_POLL_INITIAL_DELAY_SECONDS
+    total_delay = 0
+
+    while total_delay < ATHENA_QUERY_TIMEOUT_SECONDS:
+        yield delay
+
+        total_delay += delay
+        delay = min(delay * 2, ATHENA_POLL_MAX_DELAY_SECONDS)
+
+
+def start_athena_query(aws_client_factory, credentials, query):
+    """
+    Starts the query, returning its execution ID.
+    """
     athena_client = aws_client_factory.get_aws_client(
         "athena",
         credentials,
@@ -83,64 +119,112 @@ def perform_athena_query(aws_client_factory, credentials, query, return_results)
         logit(query_start_response)
         raise Exception("No query execution ID in response!")
 
-    query_execution_id = query_start_response["QueryExecutionId"]
-
-    QUERY_FAILED_STATES = [
-        "CANCELLED",
-        "FAILED"
-    ]
+    return query_start_response["QueryExecutionId"]
 
-    query_status_results = {}
 
-    # Max amount of times we'll attempt to query the execution
-    # status. If the counter hits zero we break out.
-    max_counter = 60
+def get_athena_query_execution(aws_client_factory, credentials, query_execution_id):
+    """
+    Returns the QueryExecution of a query, raising if the query failed.
+    """
+    athena_client = aws_client_factory.get_aws_client(
+        "athena",
+        credentials,
+    )
 
-    # Poll for query status
-    # For loops which do not have a discreet conditional break, we enforce
-    # an upper bound of iterations.
-    MAX_LOOP_ITERATIONS = 10000
+    query_status_result = _get_athena_execution_result(
+        athena_client,
+        QueryExecutionId=query_execution_id
+    )
 
-    query_status_result = None
+    query_execution = query_status_result["QueryExecution"]
 
-    # Bound this loop to only execute MAX_LOOP_ITERATION times since we
-    # cannot guarantee that the condition `continuation_token == False`
-    # will ever be true.
-    for _ in range(MAX_LOOP_ITERATIONS):
-        # Check the status of the query
-        query_status_result = _get_athena_execution_result(
-            athena_client,
-            QueryExecutionId=query_execution_id
+    if query_execution["Status"]["State"] in ATHENA_QUERY_FAILED_STATES:
+        logit(query_status_result)
+        raise Exception(
+            "Athena query failed: " + query_execution["Status"].get("StateChangeReason", "no reason given")
         )
 
-        query_execution_results = {}
-        query_execution_status = "RUNNING"
+    return query_execution
 
-        if "QueryExecution" in query_status_result:
-            query_execution_status = query_status_result["QueryExecution"]["Status"]["State"]
 
-        if query_execution_status in QUERY_FAILED_STATES:
-            logit(query_status_result)
-            raise Exception("Athena query failed!")
+def is_athena_query_finished(query_execution):
+    return query_execution["Status"]["State"] == "SUCCEEDED"
 
-        if query_execution_status == "SUCCEEDED":
-            break
 
-        sleep(1)
+def run_athena_query(aws_client_factory, credentials, query):
+    """
+    Runs the query, returning its QueryExecution once it has finished (or
+    the last one polled if it's still running after the timeout).
+    """
+    query_execution_id = start_athena_query(
+        aws_client_factory,
+        credentials,
+        query
+    )
+
+    query_execution = None
+
+    for delay in get_athena_poll_delays():
+        sleep(delay)
 
-        # Decrement counter
-        max_counter = max_counter - 1
+        query_execution = get_athena_query_execution(
+            aws_client_factory,
+            credentials,
+            query_execution_id
+        )
 
-        if max_counter <= 0:
+        if is_athena_query_finished(query_execution):
             break
 
-    s3_object_location = query_status_result["QueryExecution"]["ResultConfiguration"]["OutputLocation"]
+    return query_execution
+
+
+def iterate_csv_rows(chunks):
+    """
+    Yields the rows of CSV data (with a header row) as dicts, parsing the
+    chunks of bytes it's made of as they come in.
+    """
+    def iterate_lines():
+        decoder = getincrementaldecoder("UTF-8")()
+
+        # Pieces of a line which goes on over chunks
+        partial_line = []
+
+        for chunk in chunks:
+            lines = decoder.decode(chunk).split("\n")
+
+            # The last line goes on in the next chunk
+            partial_line.append(lines.pop())
+
+            if not lines:
+                continue
+
+            lines[0] = "".join(partial_line[:-1]) + lines[0]
+            partial_line = partial_line[-1:]
+
+            for line in lines:
+                yield line + "\n"
+
+        partial_line.append(decoder.decode(b"", final=True))
+        if "".join(partial_line):
+            yield "".join(partial_line)
+
+    return DictReader(
+        iterate_lines(),
+        delimiter=",",
+        quotechar='"'
+    )
 
-    # Sometimes we don't care about the result
-    # In those cases we just return the S3 path in case the caller
-    # Wants to grab the results themselves later
-    if not return_results:
-        return s3_object_location
+
+def iterate_athena_query_results(aws_client_factory, credentials, query_execution):
+    """
+    Yields the rows of a finished query as they're read from its results
+    in S3, so they don't all have to be held in memory at once.
+    """
+    if not is_athena_query_finished(query_execution):
+        raise Exception("Athena query did not finish in time!")
+
+    s3_object_location = query_execution["ResultConfiguration"]["OutputLocation"]
 
     # Get S3 bucket and path from the s3 location string
     # s3://refinery-lambda-logging-uoits4nibdlslbq97qhfyb6ngkvzyewf/athena/
@@ -149,26 +233,195 @@ def perform_athena_query(aws_client_factory, credentials, query, return_results)
         ""
     )
 
-    return get_athena_results_from_s3(
+    return iterate_csv_rows(
+        stream_from_s3(
+            aws_client_factory,
+            credentials,
+            "refinery-lambda-logging-" + credentials["s3_bucket_suffix"],
+            s3_path
+        )
+    )
+
+
+def get_athena_query_results(aws_client_factory, credentials, query_execution):
+    return list(
+        iterate_athena_query_results(
+            aws_client_factory,
+            credentials,
+            query_execution
+        )
+    )
+
+
+def get_athena_query_bytes_scanned(query_execution):
+    return int(
+        query_execution.get("Statistics", {}).get("DataScannedInBytes", 0)
+    )
+
+
+def perform_athena_query(aws_client_factory, credentials, query, return_results):
+    query_execution = run_athena_query(
         aws_client_factory,
         credentials,
-        "refinery-lambda-logging-" + credentials["s3_bucket_suffix"],
-        s3_path
+        query
+    )
+
+    # Sometimes we don't care about the result
+    # In those cases we just return the S3 path in case the caller
+    # Wants to grab the results themselves later
+    if not return_results:
+        return query_execution["ResultConfiguration"]["OutputLocation"]
+
+    return get_athena_query_results(
+        aws_client_factory,
+        credentials,
+        query_execution
+    )
+
+
+def iterate_sealed_athena_query(aws_client_factory, athena_query_cache, credentials, project_id, query_template,
+                                query_template_data, sort_key):
+    """
+    Yields the rows of a query over the date shards from query_template_data["oldest_timestamp"]
+    onwards, with the rows of the sealed shards (see AthenaQueryCache.get_sealed_shard) served
+    from the athena_query_cache. Only the shards after the newest cached one are
+    queried (those which sealed since are added to the cache), so a query which
+    is cached up to the open shards only scans what's still being written to.
+
+    The query has to select the dt of its rows, and only the rows with a dt of
+    at least oldest_timestamp. Its rows must not span date shards (no
+    aggregating across them) and it has to be ordered by sort_key, which the
+    rows are yielded in. The cache is only updated once every row has been
+    read.
+    """
+    oldest_timestamp = query_template_data["oldest_timestamp"]
+    query = render(query_template, query_template_data)
+    sealed_shard = athena_query_cache.get_sealed_shard(
+        project_id,
+        get_newest_sealed_shard()
+    )
+
+    # Nothing of the query is sealed yet
+    if sealed_shard is None or oldest_timestamp > sealed_shard:
+        query_execution = run_athena_query(
+            aws_client_factory,
+            credentials,
+            query
+        )
+
+        for row in iterate_athena_query_results(aws_client_factory, credentials, query_execution):
+            yield row
+
+        return
+
+    # The same query from any oldest_timestamp, so that it's cached once
+    # however its window slides
+    cache_query = render(
+        query_template,
+        dict(query_template_data, oldest_timestamp="")
     )
 
+    cached_result = athena_query_cache.get(
+        credentials,
+        cache_query
+    )
+
+    # Cached from a later oldest_timestamp, it's missing the rows before that
+    if cached_result is not None and cached_result["oldest_timestamp"] > oldest_timestamp:
+        cached_result = None
+
+    cached_rows = []
+    bytes_scanned_saved = 0
+    refresh_query = query
+
+    if cached_result is not None:
+        cached_rows = sorted(
+            [row for row in cached_result["result_data"] if row["dt"] >= oldest_timestamp],
+            key=sort_key
+        )
+        bytes_scanned_saved = cached_result["bytes_scanned"]
+
+        # Picks up after the newest shard which was cached
+        refresh_query = render(
+            query_template,
+            dict(query_template_data, oldest_timestamp=cached_result["sealed_shard"])
+        )
+
+    query_execution = run_athena_query(
+        aws_client_factory,
+        credentials,
+        refresh_query
+    )
+
+    newly_sealed_rows = []
+
+    def iterate_refreshed_rows():
+        for row in iterate_athena_query_results(aws_client_factory, credentials, query_execution):
+            if cached_result is not None and row["dt"] <= cached_result["sealed_shard"]:
+                continue
+
+            if row["dt"] <= sealed_shard:
+                newly_sealed_rows.append(row)
+
+            yield row
+
+    # Copies, callers are free to change the rows
+    for row in merge(cached_rows, iterate_refreshed_rows(), key=sort_key):
+        yield dict(row)
+
+    bytes_scanned = get_athena_query_bytes_scanned(query_execution)
+
+    athena_query_cache.emit_metrics(
+        cached_result is not None,
+        bytes_scanned,
+        bytes_scanned_saved
+    )
+
+    if cached_result is None:
+        athena_query_cache.put(
+            credentials,
+            project_id,
+            cache_query,
+            oldest_timestamp,
+            sealed_shard,
+            newly_sealed_rows,
+            bytes_scanned
+        )
+    elif cached_result["sealed_shard"] < sealed_shard:
+        # Everything which was cached, not just the rows of this window
+        athena_query_cache.put(
+            credentials,
+            project_id,
+            cache_query,
+            cached_result["oldest_timestamp"],
+            sealed_shard,
+            cached_result["result_data"] + newly_sealed_rows,
+            bytes_scanned_saved + bytes_scanned
+        )
+
 
 GET_BLOCK_EXECUTIONS = """
-    SELECT type, id, function_name, timestamp, dt
+    SELECT type, id, function_name, timestamp, dt, "$path" AS s3_path
     FROM "refinery"."{{{project_id_table_name}}}"
     WHERE project_id = '{{{project_id}}}' AND
     arn = '{{{arn}}}' AND
     execution_pipeline_id = '{{{execution_pipeline_id}}}' AND
-    dt > '{{{oldest_timestamp}}}'
+    dt >= '{{{oldest_timestamp}}}'
     ORDER BY type, timestamp DESC
 """
 
 
-def get_block_executions(aws_client_factory, credentials, project_id, execution_pipeline_id, arn, oldest_timestamp):
+def get_block_execution_sort_key(query_result):
+    # The order of GET_BLOCK_EXECUTIONS
+    return query_result["type"], -int(query_result["timestamp"])
+
+
+def iterate_block_executions(aws_client_factory, athena_query_cache, credentials, project_id, execution_pipeline_id,
+                             arn, oldest_timestamp):
+    """
+    Yields the executions of a block in an execution pipeline as they're read
+    from Athena, by type and then newest first.
+    """
     project_id = sub(REGEX_WHITELISTS["project_id"], "", project_id)
     timestamp_datetime = datetime.fromtimestamp(oldest_timestamp)
 
@@ -183,19 +436,18 @@ def get_block_executions(aws_client_factory, credentials, project_id, execution_
         "oldest_timestamp": timestamp_datetime.strftime("%Y-%m-%d-%H-%M"),
     }
 
-    query = render(GET_BLOCK_EXECUTIONS, query_template_data)
-
     # Query for project execution logs
     logit("Performing Athena query...")
-    query_results = perform_athena_query(
+    query_results = iterate_sealed_athena_query(
         aws_client_factory,
+        athena_query_cache,
         credentials,
-        query,
-        True
+        project_id,
+        GET_BLOCK_EXECUTIONS,
+        query_template_data,
+        get_block_execution_sort_key
     )
 
-    logit("Processing Athena results...")
-
     # Format query results
     for query_result in query_results:
         # For the front-end
@@ -203,23 +455,99 @@ def get_block_executions(aws_client_factory, credentials, project_id, execution_
         query_result["timestamp"] = int(query_result["timestamp"])
         del query_result["id"]
 
-        # Generate a log path from the available data
-        # example: PROJECT_ID/dt=DATE_SHARD/EXECUTION_PIPELINE_ID/TYPE~NAME~LOG_ID~TIMESTAMP
-
-        log_file_path = project_id + "/dt=" + query_result["dt"]
-        log_file_path += "/" + execution_pipeline_id + "/"
-        log_file_path += query_result["type"] + "~"
-        log_file_path += query_result["function_name"] + "~"
-        log_file_path += query_result["log_id"] + "~"
-        log_file_path += str(query_result["timestamp"])
-
-        query_result["s3_key"] = log_file_path
+        # The log path comes from the object the row was read from, since
+        # coalesced logs share an object whose key has a different log ID.
+        # example: s3://BUCKET/PROJECT_ID/dt=DATE_SHARD/EXECUTION_PIPELINE_ID/TYPE~NAME~LOG_ID~TIMESTAMP
+        query_result["s3_key"] = query_result["s3_path"].split("/", 3)[3]
 
+        del query_result["s3_path"]
         del query_result["dt"]
 
+        yield query_result
+
     logit("Athena results have been processed.")
 
-    return query_results
+
+def get_block_executions(aws_client_factory, athena_query_cache, credentials, project_id, execution_pipeline_id, arn,
+                         oldest_timestamp):
+    return list(
+        iterate_block_executions(
+            aws_client_factory,
+            athena_query_cache,
+            credentials,
+            project_id,
+            execution_pipeline_id,
+            arn,
+            oldest_timestamp
+        )
+    )
+
+
+# Block executions per page of results
+BLOCK_EXECUTIONS_PAGE_SIZE = 50
+
+# Pages of results written to S3 at once
+BLOCK_EXECUTIONS_PAGE_WRITERS = 5
+
+
+def write_block_execution_pages(aws_client_factory, athena_query_cache, credentials, project_id,
+                                execution_pipeline_id, arn, oldest_timestamp, page_size=BLOCK_EXECUTIONS_PAGE_SIZE):
+    """
+    Pages the executions of a block as they're read from Athena. The first
+    page is returned, every page after it is written to S3 as JSON as soon as
+    it's full (to be lazily loaded by the front-end) and only its ID is:
+
+    {
+        "results": [...],
+        "pages": ["6c43b7d4-c6ed-4e25-b5b2-c5ac7fd1ac4e", ...]
+    }
+    """
+    pages = {
+        "results": [],
+        "pages": []
+    }
+
+    page = []
+    page_write_futures = []
+
+    def add_page(page_results):
+        if not pages["results"] and not pages["pages"]:
+            pages["results"] = page_results
+            return
+
+        page_id = str(uuid4())
+        pages["pages"].append(page_id)
+
+        page_write_futures.append(
+            page_writer.submit(
+                write_json_to_s3,
+                aws_client_factory,
+                credentials,
+                credentials["logs_bucket"],
+                "log_pagination_result_pages/" + page_id + ".json",
+                page_results
+            )
+        )
+
+    with futures.ThreadPoolExecutor(max_workers=BLOCK_EXECUTIONS_PAGE_WRITERS) as page_writer:
+        for block_execution in iterate_block_executions(aws_client_factory, athena_query_cache, credentials,
+                                                        project_id, execution_pipeline_id, arn, oldest_timestamp):
+            page.append(block_execution)
+
+            if len(page) == page_size:
+                add_page(page)
+                page = []
+
+        if page:
+            add_page(page)
+
+        # Raises if any of the writes failed
+        for page_write_future in page_write_futures:
+            page_write_future.result()
+
+    logit("Wrote " + str(len(pages["pages"])) + " page(s) of block executions to S3.")
+
+    return pages
 
 
 # We set case sensitivity (because of nested JSON) and to ignore malformed JSON (just in case)
@@ -244,7 +572,8 @@ CREATE_PROJECT_ID_LOG_TABLE = """
         `input_data` string,
         `backpack` string,
         `return_data` string,
-        `execution_pipeline_id` string
+        `execution_pipeline_id` string,
+        `trace` string
     )
     PARTITIONED BY (dt string)
     ROW FORMAT SERDE 'org.openx.data.jsonserde.JsonSerDe'
@@ -257,7 +586,57 @@ CREATE_PROJECT_ID_LOG_TABLE = """
 """
 
 
-def create_project_id_log_table(aws_client_factory, credentials, project_id):
+# Lets Athena work out the partitions of a project log table from the date
+# shard layout of its logs, instead of them having to be registered
+PROJECT_LOG_TABLE_PARTITION_PROJECTION = """
+    ALTER TABLE refinery.{{REPLACE_ME_PROJECT_TABLE_NAME}} SET TBLPROPERTIES (
+        'projection.enabled' = 'true',
+        'projection.dt.type' = 'date',
+        'projection.dt.format' = 'yyyy-MM-dd-HH-mm',
+        'projection.dt.range' = '2019-01-01-00-00,NOW',
+        'projection.dt.interval' = '5',
+        'projection.dt.interval.unit' = 'MINUTES',
+        'storage.location.template' = 's3://refinery-lambda-logging-{{S3_BUCKET_SUFFIX}}/{{REPLACE_ME_PROJECT_ID}}/dt=${dt}/'
+    )
+"""
+
+
+def is_partition_projection_enabled(app_config):
+    """
+    With partition projection enabled ("athena_partition_projection") the
+    project log tables never have partitions added, Athena projects them
+    from the five minute date shards instead.
+    """
+    return loads(
+        app_config.get_if_exists("athena_partition_projection") or "false"
+    )
+
+
+def get_project_log_table_columns(aws_client_factory, credentials, table_name):
+    """
+    Returns the column names of a project log table from the Glue data
+    catalog Athena keeps its tables in, None if there's no such table.
+    """
+    glue_client = aws_client_factory.get_aws_client(
+        "glue",
+        credentials,
+    )
+
+    try:
+        response = glue_client.get_table(
+            DatabaseName="refinery",
+            # The catalog lower-cases table names
+            Name=table_name.lower()
+        )
+    except glue_client.exceptions.EntityNotFoundException:
+        return None
+
+    return [
+        column["Name"] for column in response["Table"]["StorageDescriptor"]["Columns"]
+    ]
+
+
+def create_project_id_log_table(aws_client_factory, credentials, project_id, partition_projection=False):
     project_id = sub(REGEX_WHITELISTS["project_id"], "", project_id)
     table_name = "PRJ_" + project_id.replace("-", "_")
 
@@ -280,14 +659,65 @@ def create_project_id_log_table(aws_client_factory, credentials, project_id):
         credentials["s3_bucket_suffix"]
     )
 
-    # Perform the table creation query
-    return perform_athena_query(
+    table_creation_result = None
+
+    table_columns = get_project_log_table_columns(
         aws_client_factory,
         credentials,
-        query,
-        False
+        table_name
     )
 
+    if table_columns is None:
+        # Perform the table creation query
+        table_creation_result = perform_athena_query(
+            aws_client_factory,
+            credentials,
+            query,
+            False
+        )
+    elif "trace" not in table_columns:
+        # Tables created before the runtime traced its phases need the trace
+        # column added
+        try:
+            perform_athena_query(
+                aws_client_factory,
+                credentials,
+                ADD_TRACE_COLUMN_TO_LOG_TABLE.replace(
+                    "{{REPLACE_ME_PROJECT_TABLE_NAME}}",
+                    table_name
+                ),
+                False
+            )
+        except Exception as e:
+            # Added by a concurrent deploy in the meantime
+            if not ("Duplicate column name" in str(e)):
+                raise
+
+    if partition_projection:
+        # Also switches tables created before projection was enabled over
+        perform_athena_query(
+            aws_client_factory,
+            credentials,
+            PROJECT_LOG_TABLE_PARTITION_PROJECTION.replace(
+                "{{REPLACE_ME_PROJECT_TABLE_NAME}}",
+                table_name
+            ).replace(
+                "{{REPLACE_ME_PROJECT_ID}}",
+                project_id
+            ).replace(
+                "{{S3_BUCKET_SUFFIX}}",
+                credentials["s3_bucket_suffix"]
+            ),
+            False
+        )
+
+    return table_creation_result
+
+
+ADD_TRACE_COLUMN_TO_LOG_TABLE = """
+    ALTER TABLE refinery.{{REPLACE_ME_PROJECT_TABLE_NAME}} ADD COLUMNS (`trace` string)
+"""
+
 
 GET_PROJECT_EXECUTION_LOGS = """
     SELECT arn, type, execution_pipeline_id, timestamp, dt, COUNT(*) as count
@@ -297,7 +727,7 @@ GET_PROJECT_EXECUTION_LOGS = """
 """
 
 
-def get_project_execution_logs(aws_client_factory, credentials, project_id, oldest_timestamp):
+def get_project_execution_logs(aws_client_factory, athena_query_cache, credentials, project_id, oldest_timestamp):
     timestamp_datetime = datetime.fromtimestamp(oldest_timestamp)
     project_id = sub(REGEX_WHITELISTS["project_id"], "", project_id)
 
@@ -306,17 +736,15 @@ def get_project_execution_logs(aws_client_factory, credentials, project_id, olde
         "oldest_timestamp": timestamp_datetime.strftime("%Y-%m-%d-%H-%M")
     }
 
-    query = render(
-        GET_PROJECT_EXECUTION_LOGS,
-        query_template_data
-    )
-
     # Query for project execution logs
-    query_results = perform_athena_query(
+    query_results = iterate_sealed_athena_query(
         aws_client_factory,
+        athena_query_cache,
         credentials,
-        query,
-        True
+        project_id,
+        GET_PROJECT_EXECUTION_LOGS,
+        query_template_data,
+        lambda query_result: int(query_result["timestamp"])
     )
 
     # Convert the Athena query results into an execution pipeline ID with the
@@ -331,3 +759,89 @@ def get_project_execution_logs(aws_client_factory, credentials, project_id, olde
     return execution_pipeline_id_dict_to_frontend_format(
         execution_pipeline_id_dict
     )
+
+
+# Spans are bucketed by powers of two of their duration in milliseconds
+GET_BLOCK_PHASE_LATENCIES = """
+    SELECT phase, bucket_ms, COUNT(*) as count
+    FROM (
+        SELECT
+            json_extract_scalar(span, '$.name') AS phase,
+            CAST(POWER(2, CEIL(LOG2(GREATEST(CAST(json_extract_scalar(span, '$.duration_ms') AS double), 1)))) AS bigint) AS bucket_ms
+        FROM "refinery"."{{{project_id_table_name}}}"
+        CROSS JOIN UNNEST(CAST(json_extract(trace, '$.spans') AS array(json))) AS spans (span)
+        WHERE arn = '{{{arn}}}' AND
+        trace IS NOT NULL AND
+        dt > '{{{oldest_timestamp}}}'
+    )
+    GROUP BY phase, bucket_ms
+    ORDER BY phase, bucket_ms
+"""
+
+
+def phase_latency_rows_to_histograms(query_results):
+    """
+    Turns the rows of the phase latency query into a histogram per phase:
+
+    {
+        "Executing Lambda": {
+            "total": 14,
+            "buckets": [
+                {
+                    "le_ms": 512,
+                    "count": 3
+                },
+                {
+                    "le_ms": 1024,
+                    "count": 11
+                }
+            ]
+        }
+    }
+    """
+    histograms = {}
+
+    for query_result in query_results:
+        phase = query_result["phase"]
+        count = int(query_result["count"])
+
+        if phase not in histograms:
+            histograms[phase] = {
+                "total": 0,
+                "buckets": []
+            }
+
+        histograms[phase]["total"] += count
+        histograms[phase]["buckets"].append({
+            "le_ms": int(query_result["bucket_ms"]),
+            "count": count
+        })
+
+    for histogram in histograms.values():
+        histogram["buckets"].sort(key=lambda bucket: bucket["le_ms"])
+
+    return histograms
+
+
+def get_block_phase_latencies(aws_client_factory, credentials, project_id, arn, oldest_timestamp):
+    project_id = sub(REGEX_WHITELISTS["project_id"], "", project_id)
+    timestamp_datetime = datetime.fromtimestamp(oldest_timestamp)
+
+    query_template_data = {
+        "project_id_table_name": "PRJ_" + project_id.replace("-", "_"),
+        "arn": sub(REGEX_WHITELISTS["arn"], "", arn),
+        "oldest_timestamp": timestamp_datetime.strftime("%Y-%m-%d-%H-%M"),
+    }
+
+    query = render(GET_BLOCK_PHASE_LATENCIES, query_template_data)
+
+    query_results = perform_athena_query(
+        aws_client_factory,
+        credentials,
+        query,
+        True
+    )
+
+    return phase_latency_rows_to_histograms(
+        query_results
+    )
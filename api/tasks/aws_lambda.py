@@ -75,21 +75,41 @@ def get_lambda_arns(aws_client_factory, credentials):
 
 
 def warm_up_lambda(aws_client_factory, credentials, arn, warmup_concurrency_level):
+    """
+    Warms up warmup_concurrency_level containers of the Lambda and waits for
+    the runtime to report back how many distinct containers actually warmed.
+    Returns None if that couldn't be determined.
+    """
     lambda_client = aws_client_factory.get_aws_client(
         "lambda",
         credentials
     )
-    response = lambda_invoke(
-        lambda_client,
-        arn=arn,
-        invocation_type=LambdaInvocationType.EVENT,
-        log_type=LambdaLogType.TAIL,
-        payload=dumps({
-            "_refinery": {
-                "warmup": warmup_concurrency_level,
-            }
-        })
-    )
+
+    try:
+        response = lambda_invoke(
+            lambda_client,
+            arn=arn,
+            invocation_type=LambdaInvocationType.REQUEST_RESPONSE,
+            log_type=LambdaLogType.TAIL,
+            payload=dumps({
+                "_refinery": {
+                    "warmup": warmup_concurrency_level,
+                }
+            })
+        )
+
+        warmup_result = loads(
+            response["Payload"].read()
+        )
+    except Exception as e:
+        logit("Error occurred while warming up Lambda '" + arn + "': " + repr(e), "error")
+        return None
+
+    # Runtimes from before warmups were tree-shaped don't report a count
+    if not isinstance(warmup_result, dict) or "warmed" not in warmup_result:
+        return None
+
+    return warmup_result["warmed"]
 
 
 def execute_aws_lambda(aws_client_factory, credentials, arn, input_data):
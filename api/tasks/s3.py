@@ -1,5 +1,20 @@
 from botocore.exceptions import ClientError
+from concurrent import futures
 from json import loads, dumps
+import threading
+import gzip
+
+
+# Most listings a shard scan has in flight at once
+S3_SHARD_SCAN_MAX_WORKERS = 16
+
+# Most log objects a bulk fetch reads at once
+S3_LOG_FETCH_MAX_WORKERS = 16
+
+# Most bytes of execution log objects kept in memory by default
+EXECUTION_LOG_CACHE_MAX_BYTES = (1024 * 1024 * 64)
+
+GZIP_MAGIC_NUMBER = b"\x1f\x8b"
 
 
 def s3_object_exists(aws_client_factory, credentials, bucket_name, object_key):
@@ -40,6 +55,119 @@ def get_json_from_s3(aws_client_factory, credentials, s3_bucket, s3_path):
     )
 
 
+def read_execution_log_object(s3_client, s3_bucket, s3_path):
+    """
+    Returns the bytes of an execution log object, decompressed if it was
+    written gzipped.
+    """
+    response = s3_client.get_object(
+        Bucket=s3_bucket,
+        Key=s3_path
+    )
+
+    object_data = response["Body"].read()
+
+    if response.get("ContentEncoding") == "gzip" or object_data[:2] == GZIP_MAGIC_NUMBER:
+        object_data = gzip.decompress(object_data)
+
+    return object_data
+
+
+def get_execution_log_from_object(object_data, log_id):
+    """
+    Coalesced execution log objects hold one JSON log per line, so
+    we pull out the requested log (or the first one if it's not there).
+    """
+    log_lines = object_data.splitlines()
+
+    if len(log_lines) == 1:
+        return loads(
+            log_lines[0]
+        )
+
+    execution_logs = [loads(log_line) for log_line in log_lines if log_line.strip()]
+
+    for execution_log in execution_logs:
+        if execution_log.get("id") == log_id:
+            return execution_log
+
+    return execution_logs[0]
+
+
+def get_execution_log_from_s3(aws_client_factory, credentials, s3_bucket, s3_path, log_id):
+    s3_client = aws_client_factory.get_aws_client(
+        "s3",
+        credentials
+    )
+
+    return get_execution_log_from_object(
+        read_execution_log_object(
+            s3_client,
+            s3_bucket,
+            s3_path
+        ),
+        log_id
+    )
+
+
+def get_execution_logs_from_s3(aws_client_factory, execution_log_object_cache, credentials, s3_bucket, logs_to_fetch,
+                               max_workers=S3_LOG_FETCH_MAX_WORKERS):
+    """
+    Fetches a batch of execution logs ({"s3_key": ..., "log_id": ...}), returning
+    them in the same order as {"log_id": ..., "log_data": ...}.
+
+    Each log object is read once however many of the logs are coalesced into
+    it, up to max_workers of them at once. Log objects never change once
+    they're written, so they're kept in the execution_log_object_cache (an
+    LRUByteCache) by bucket and key and only read out of S3 the first time.
+    """
+    s3_client = aws_client_factory.get_aws_client(
+        "s3",
+        credentials
+    )
+
+    log_objects = {}
+    missing_s3_keys = []
+
+    for log_to_fetch in logs_to_fetch:
+        s3_key = log_to_fetch["s3_key"]
+
+        if s3_key in log_objects or s3_key in missing_s3_keys:
+            continue
+
+        object_data = execution_log_object_cache.get(s3_bucket + "/" + s3_key)
+
+        if object_data is None:
+            missing_s3_keys.append(s3_key)
+        else:
+            log_objects[s3_key] = object_data
+
+    if missing_s3_keys:
+        with futures.ThreadPoolExecutor(max_workers=min(max_workers, len(missing_s3_keys))) as executor:
+            object_data_list = executor.map(
+                lambda s3_key: read_execution_log_object(s3_client, s3_bucket, s3_key),
+                missing_s3_keys
+            )
+
+            for s3_key, object_data in zip(missing_s3_keys, object_data_list):
+                log_objects[s3_key] = object_data
+                execution_log_object_cache.put(
+                    s3_bucket + "/" + s3_key,
+                    object_data
+                )
+
+    return [
+        {
+            "log_data": get_execution_log_from_object(
+                log_objects[log_to_fetch["s3_key"]],
+                log_to_fetch["log_id"]
+            ),
+            "log_id": log_to_fetch["log_id"]
+        }
+        for log_to_fetch in logs_to_fetch
+    ]
+
+
 def write_json_to_s3(aws_client_factory, credentials, s3_bucket, s3_path, input_data):
     # Create S3 client
     s3_client = aws_client_factory.get_aws_client(
@@ -77,6 +205,33 @@ def read_from_s3(aws_client_factory, credentials, s3_bucket, path):
     return s3_object["Body"].read()
 
 
+# Bytes read at a time when streaming an object
+S3_STREAM_CHUNK_SIZE = (1024 * 256)
+
+
+def stream_from_s3(aws_client_factory, credentials, s3_bucket, path, chunk_size=S3_STREAM_CHUNK_SIZE):
+    """
+    Yields the bytes of an object as they're read, chunk_size at a time,
+    instead of holding all of it in memory.
+    """
+    s3_client = aws_client_factory.get_aws_client(
+        "s3",
+        credentials,
+    )
+
+    # Remove leading / because they are almost always not intended
+    if path.startswith("/"):
+        path = path[1:]
+
+    s3_object = s3_client.get_object(
+        Bucket=s3_bucket,
+        Key=path
+    )
+
+    for chunk in s3_object["Body"].iter_chunks(chunk_size):
+        yield chunk
+
+
 def read_from_s3_and_return_input(aws_client_factory, credentials, s3_bucket, path):
     return_data = read_from_s3(
         aws_client_factory,
@@ -192,6 +347,71 @@ def get_s3_list_from_prefix(aws_client_factory, credentials, s3_bucket, s3_prefi
     }
 
 
+def scan_s3_shards(aws_client_factory, credentials, s3_bucket, shard_prefixes, page_handler, delimiter=None,
+                   max_workers=S3_SHARD_SCAN_MAX_WORKERS):
+    """
+    Lists every shard prefix concurrently (up to max_workers listings at once)
+    and calls page_handler(shard_prefix, page) with each page of keys as soon
+    as it arrives, so the results never have to be held in memory at once.
+
+    With a delimiter the pages hold the common prefixes under each shard
+    instead of its keys, e.g. just the "{{execution_pipeline_id}}/" prefixes
+    of an execution log shard rather than a key per block execution.
+
+    Calls to page_handler are serialized, it doesn't have to be thread safe.
+    Returns the number of pages listed.
+    """
+    s3_client = aws_client_factory.get_aws_client(
+        "s3",
+        credentials,
+    )
+
+    page_handler_lock = threading.Lock()
+
+    def scan_shard(shard_prefix):
+        list_objects_params = {
+            "Bucket": s3_bucket,
+            "Prefix": shard_prefix,
+            "MaxKeys": 1000,
+        }
+
+        if delimiter:
+            list_objects_params["Delimiter"] = delimiter
+
+        page_count = 0
+
+        # Only list up to 10k pages per shard
+        for _ in range(10000):
+            response = s3_client.list_objects_v2(
+                **list_objects_params
+            )
+            page_count += 1
+
+            if delimiter:
+                page = [s3_prefix["Prefix"] for s3_prefix in response.get("CommonPrefixes", [])]
+            else:
+                page = [s3_object["Key"] for s3_object in response.get("Contents", [])]
+
+            if len(page) > 0:
+                with page_handler_lock:
+                    page_handler(shard_prefix, page)
+
+            if not response.get("IsTruncated"):
+                break
+
+            list_objects_params["ContinuationToken"] = response["NextContinuationToken"]
+
+        return page_count
+
+    shard_prefixes = sorted(set(shard_prefixes))
+
+    if len(shard_prefixes) == 0:
+        return 0
+
+    with futures.ThreadPoolExecutor(min(max_workers, len(shard_prefixes))) as executor:
+        return sum(executor.map(scan_shard, shard_prefixes))
+
+
 def get_all_s3_paths(aws_client_factory, credentials, s3_bucket, prefix, max_results, **kwargs):
     s3_client = aws_client_factory.get_aws_client(
         "s3",
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from controller.logs.actions import get_execution_metadata_from_s3_key
+from utils.mapper import execution_log_query_results_to_pipeline_id_dict, execution_log_results_to_rollups
+
+
+class TestExecutionLogKeys(TestCase):
+    def test_get_execution_metadata_from_s3_key(self):
+        metadata = get_execution_metadata_from_s3_key(
+            "us-west-2",
+            "532121572788",
+            "08757409-4bc8-4a29-ade7-371b1a46f99e/dt=2019-07-15-18-00/e4e3571e-ab59-4790-8072-3049805301c3/SUCCESS~Untitled_Code_Block_RFNItzJNn2~3233e08a-baf0-4f8f-a4c2-ee2d3153f75b~1563213635"
+        )
+
+        self.assertEqual(metadata["arn"], "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn2")
+        self.assertEqual(metadata["dt"], "2019-07-15-18-00")
+        self.assertEqual(metadata["execution_pipeline_id"], "e4e3571e-ab59-4790-8072-3049805301c3")
+        self.assertEqual(metadata["timestamp"], 1563213635)
+        self.assertEqual(metadata["count"], "1")
+
+    def test_get_execution_metadata_from_coalesced_s3_key(self):
+        metadata = get_execution_metadata_from_s3_key(
+            "us-west-2",
+            "532121572788",
+            "08757409-4bc8-4a29-ade7-371b1a46f99e/dt=2019-07-15-18-00/e4e3571e-ab59-4790-8072-3049805301c3/SUCCESS~Untitled_Code_Block_RFNItzJNn2~3233e08a-baf0-4f8f-a4c2-ee2d3153f75b~1563213635~12"
+        )
+
+        self.assertEqual(metadata["log_id"], "3233e08a-baf0-4f8f-a4c2-ee2d3153f75b")
+        self.assertEqual(metadata["timestamp"], 1563213635)
+        self.assertEqual(metadata["count"], "12")
+
+
+class TestExecutionLogRollups(TestCase):
+    def test_execution_log_results_to_rollups(self):
+        arn = "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block_RFNItzJNn2"
+        execution_log_results = [
+            {"execution_pipeline_id": "e4e3571e", "arn": arn, "type": "SUCCESS", "count": "1", "timestamp": 1563213635},
+            {"execution_pipeline_id": "e4e3571e", "arn": arn, "type": "SUCCESS", "count": "12", "timestamp": 1563213600},
+            {"execution_pipeline_id": "e4e3571e", "arn": arn, "type": "EXCEPTION", "count": "1", "timestamp": 1563213700},
+        ]
+
+        rollups = sorted(
+            execution_log_results_to_rollups(execution_log_results),
+            key=lambda rollup: rollup["type"]
+        )
+
+        self.assertEqual(len(rollups), 2)
+        self.assertEqual(rollups[1]["type"], "SUCCESS")
+        self.assertEqual(rollups[1]["count"], 13)
+        self.assertEqual(rollups[1]["min_timestamp"], 1563213600)
+        self.assertEqual(rollups[1]["max_timestamp"], 1563213635)
+
+        # Rollups merge into the same pipeline totals as the raw results
+        self.assertEqual(
+            execution_log_query_results_to_pipeline_id_dict(rollups),
+            execution_log_query_results_to_pipeline_id_dict(execution_log_results)
+        )
+        self.assertEqual(
+            execution_log_query_results_to_pipeline_id_dict(rollups)["e4e3571e"]["timestamp"],
+            1563213700
+        )
@@ -0,0 +1,147 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from tasks.athena import get_athena_poll_delays, iterate_csv_rows, iterate_sealed_athena_query, \
+    phase_latency_rows_to_histograms, ATHENA_QUERY_TIMEOUT_SECONDS
+
+
+QUERY_TEMPLATE = "SELECT id, dt FROM logs WHERE dt >= '{{{oldest_timestamp}}}'"
+CACHE_QUERY = "SELECT id, dt FROM logs WHERE dt >= ''"
+
+
+class DictAthenaQueryCache:
+    def __init__(self):
+        self.cached_results = {}
+        self.metrics = []
+
+    def is_enabled(self):
+        return True
+
+    def get_sealed_shard(self, project_id, newest_sealed_shard):
+        return newest_sealed_shard
+
+    def get(self, credentials, query):
+        return self.cached_results.get(query)
+
+    def put(self, credentials, project_id, query, oldest_timestamp, sealed_shard, result_data, bytes_scanned):
+        self.cached_results[query] = {
+            "oldest_timestamp": oldest_timestamp,
+            "sealed_shard": sealed_shard,
+            "result_data": result_data,
+            "bytes_scanned": bytes_scanned
+        }
+
+    def emit_metrics(self, hit, bytes_scanned, bytes_scanned_saved):
+        self.metrics.append((hit, bytes_scanned, bytes_scanned_saved))
+
+
+class TestPhaseLatencies(TestCase):
+    def test_phase_latency_rows_to_histograms(self):
+        # Athena results come back from CSV, so everything is a string
+        histograms = phase_latency_rows_to_histograms([
+            {"phase": "Executing Lambda", "bucket_ms": "1024", "count": "11"},
+            {"phase": "Executing Lambda", "bucket_ms": "512", "count": "3"},
+            {"phase": "Invoking Transitions", "bucket_ms": "16", "count": "14"},
+        ])
+
+        self.assertEqual(histograms["Executing Lambda"], {
+            "total": 14,
+            "buckets": [
+                {"le_ms": 512, "count": 3},
+                {"le_ms": 1024, "count": 11},
+            ]
+        })
+        self.assertEqual(histograms["Invoking Transitions"]["total"], 14)
+
+
+class TestAthenaQueries(TestCase):
+    def test_get_athena_poll_delays(self):
+        delays = list(get_athena_poll_delays())
+
+        self.assertLess(delays[0], 0.1)
+        self.assertEqual(delays, sorted(delays))
+        self.assertGreaterEqual(sum(delays), ATHENA_QUERY_TIMEOUT_SECONDS)
+
+    def test_iterate_csv_rows(self):
+        csv_data = '"id","program_output"\n"a","multi\nline"\n"b","\u00e9"\n'.encode("UTF-8")
+
+        # Chunks which split lines and characters
+        rows = iterate_csv_rows([
+            csv_data[i:i + 3] for i in range(0, len(csv_data), 3)
+        ])
+
+        self.assertEqual([dict(row) for row in rows], [
+            {"id": "a", "program_output": "multi\nline"},
+            {"id": "b", "program_output": "\u00e9"},
+        ])
+
+
+class TestSealedAthenaQuery(TestCase):
+    def setUp(self):
+        self.rows = [
+            {"id": "a", "dt": "2019-07-15-13-35"},
+            {"id": "b", "dt": "2019-07-15-13-40"},
+        ]
+        self.queries = []
+
+    def run_athena_query(self, aws_client_factory, credentials, query):
+        self.queries.append(query)
+        return {"Statistics": {"DataScannedInBytes": 100}}
+
+    def iterate_athena_query_results(self, aws_client_factory, credentials, query_execution):
+        oldest_timestamp = self.queries[-1].split("'")[1]
+        return [row for row in self.rows if row["dt"] >= oldest_timestamp]
+
+    def perform_query(self, athena_query_cache, sealed_shard, oldest_timestamp="2019-07-15-13-30"):
+        with patch("tasks.athena.run_athena_query", self.run_athena_query), \
+                patch("tasks.athena.iterate_athena_query_results", self.iterate_athena_query_results), \
+                patch("tasks.athena.get_newest_sealed_shard", lambda: sealed_shard):
+            return list(iterate_sealed_athena_query(
+                None,
+                athena_query_cache,
+                {},
+                "project",
+                QUERY_TEMPLATE,
+                {"oldest_timestamp": oldest_timestamp},
+                lambda row: row["dt"]
+            ))
+
+    def test_iterate_sealed_athena_query(self):
+        athena_query_cache = DictAthenaQueryCache()
+
+        # Only the sealed shard is cached
+        rows = self.perform_query(athena_query_cache, "2019-07-15-13-35")
+        self.assertEqual([row["id"] for row in rows], ["a", "b"])
+        cached_result = athena_query_cache.cached_results[CACHE_QUERY]
+        self.assertEqual(cached_result["result_data"], [self.rows[0]])
+
+        # Only the shards after it are queried again
+        self.rows.append({"id": "c", "dt": "2019-07-15-13-45"})
+        rows = self.perform_query(athena_query_cache, "2019-07-15-13-35")
+        self.assertEqual([row["id"] for row in rows], ["a", "b", "c"])
+        self.assertIn("'2019-07-15-13-35'", self.queries[1])
+
+        # Shards which have sealed since are added to the cache
+        rows = self.perform_query(athena_query_cache, "2019-07-15-13-40")
+        self.assertEqual([row["id"] for row in rows], ["a", "b", "c"])
+        self.assertEqual(
+            athena_query_cache.cached_results[CACHE_QUERY]["result_data"],
+            [self.rows[0], self.rows[1]]
+        )
+
+        # A later window is served from the same cached result
+        rows = self.perform_query(athena_query_cache, "2019-07-15-13-40", "2019-07-15-13-40")
+        self.assertEqual([row["id"] for row in rows], ["b", "c"])
+        self.assertIn("'2019-07-15-13-40'", self.queries[3])
+        self.assertEqual(list(athena_query_cache.cached_results), [CACHE_QUERY])
+
+        # Nothing is cached while the window is all open shards
+        rows = self.perform_query(athena_query_cache, "2019-07-15-13-40", "2019-07-15-13-45")
+        self.assertEqual([row["id"] for row in rows], ["c"])
+
+        self.assertEqual(athena_query_cache.metrics, [
+            (False, 100, 0),
+            (True, 100, 100),
+            (True, 100, 100),
+            (True, 100, 200),
+        ])
@@ -0,0 +1,130 @@
+from unittest import TestCase
+import gzip
+import json
+
+from tasks.s3 import get_execution_logs_from_s3, scan_s3_shards
+from utils.lru_cache import LRUByteCache
+
+
+class PagedS3Client:
+    def __init__(self, pages_by_prefix):
+        self.pages_by_prefix = pages_by_prefix
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys, Delimiter=None, ContinuationToken=None):
+        pages = self.pages_by_prefix[Prefix]
+        page_index = int(ContinuationToken or 0)
+
+        response = {
+            "Contents": [{"Key": key} for key in pages[page_index]],
+            "IsTruncated": page_index + 1 < len(pages),
+        }
+
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(page_index + 1)
+
+        return response
+
+
+class ObjectS3Client:
+    def __init__(self, objects):
+        self.objects = objects
+        self.get_count = 0
+
+    def get_object(self, Bucket, Key):
+        self.get_count += 1
+        return {
+            "Body": BytesBody(self.objects[Key])
+        }
+
+
+class BytesBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class PagedAwsClientFactory:
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def get_aws_client(self, client_type, credentials):
+        return self.s3_client
+
+
+class TestScanS3Shards(TestCase):
+    def test_scan_s3_shards(self):
+        aws_client_factory = PagedAwsClientFactory(PagedS3Client({
+            "project/dt=2019-07-15-13-35/": [["a", "b"], ["c"]],
+            "project/dt=2019-07-15-13-40/": [["d"]],
+        }))
+        pages = []
+
+        page_count = scan_s3_shards(
+            aws_client_factory,
+            {},
+            "logs",
+            # Shards listed more than once are only scanned once
+            ["project/dt=2019-07-15-13-35/", "project/dt=2019-07-15-13-40/", "project/dt=2019-07-15-13-35/"],
+            lambda shard_prefix, page: pages.append((shard_prefix, page))
+        )
+
+        self.assertEqual(page_count, 3)
+        self.assertEqual(sorted(pages), [
+            ("project/dt=2019-07-15-13-35/", ["a", "b"]),
+            ("project/dt=2019-07-15-13-35/", ["c"]),
+            ("project/dt=2019-07-15-13-40/", ["d"]),
+        ])
+
+
+class TestGetExecutionLogsFromS3(TestCase):
+    def test_get_execution_logs_from_s3(self):
+        s3_client = ObjectS3Client({
+            "single": json.dumps({"id": "a"}).encode("UTF-8"),
+            # Gzipped, with two logs coalesced into it
+            "coalesced": gzip.compress(
+                (json.dumps({"id": "b"}) + "\n" + json.dumps({"id": "c"}) + "\n").encode("UTF-8")
+            ),
+        })
+        execution_log_object_cache = LRUByteCache(1024)
+        logs_to_fetch = [
+            {"s3_key": "coalesced", "log_id": "c"},
+            {"s3_key": "single", "log_id": "a"},
+            {"s3_key": "coalesced", "log_id": "b"},
+        ]
+
+        for _ in range(2):
+            results = get_execution_logs_from_s3(
+                PagedAwsClientFactory(s3_client),
+                execution_log_object_cache,
+                {},
+                "logs",
+                logs_to_fetch
+            )
+
+            self.assertEqual(results, [
+                {"log_id": "c", "log_data": {"id": "c"}},
+                {"log_id": "a", "log_data": {"id": "a"}},
+                {"log_id": "b", "log_data": {"id": "b"}},
+            ])
+
+        # Each object is only read once, the second time from the cache
+        self.assertEqual(s3_client.get_count, 2)
+        self.assertEqual(execution_log_object_cache.hits, 2)
+
+    def test_lru_byte_cache(self):
+        lru_byte_cache = LRUByteCache(10)
+        lru_byte_cache.put("a", b"1234")
+        lru_byte_cache.put("b", b"1234")
+        lru_byte_cache.get("a")
+        lru_byte_cache.put("c", b"1234")
+
+        # The least recently used value is evicted
+        self.assertIsNone(lru_byte_cache.get("b"))
+        self.assertEqual(lru_byte_cache.get("a"), b"1234")
+        self.assertEqual(lru_byte_cache.total_bytes, 8)
+
+        # Too large to cache at all
+        lru_byte_cache.put("d", b"12345678901")
+        self.assertIsNone(lru_byte_cache.get("d"))
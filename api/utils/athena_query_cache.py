@@ -0,0 +1,206 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import exc
+
+from models import AthenaPartitionRegistry, CachedAthenaQueryResult
+from utils.general import logit
+from utils.performance_decorators import get_metrics_namespace
+
+
+# Most bytes of results kept in the cache, the least recently used results
+# are evicted past it
+ATHENA_QUERY_CACHE_MAX_BYTES = (1024 * 1024 * 256)
+
+
+def normalize_athena_query(query):
+    """
+    Collapses the whitespace of a query, so that the same query always
+    gets the same key however it was laid out.
+    """
+    return " ".join(query.split())
+
+
+def get_athena_query_cache_key(credentials, query):
+    return hashlib.sha256(
+        (credentials["id"] + "\n" + normalize_athena_query(query)).encode("UTF-8")
+    ).hexdigest()
+
+
+class AthenaQueryCache:
+    """
+    Keeps the rows Athena queries returned from sealed date shards in the
+    database, up to max_bytes of them (a max_bytes of zero turns the cache
+    off). Hits, misses and the bytes of scanning saved are emitted to
+    Cloudwatch.
+
+    Without partition_projection a shard's rows can only be queried once
+    it's registered as a partition, so only registered shards count as
+    sealed.
+    """
+
+    def __init__(self, db_session_maker, cloudwatch_client=None, max_bytes=ATHENA_QUERY_CACHE_MAX_BYTES,
+                 partition_projection=False):
+        self.db_session_maker = db_session_maker
+        self.cloudwatch_client = cloudwatch_client
+        self.max_bytes = max_bytes
+        self.partition_projection = partition_projection
+
+    def is_enabled(self):
+        return self.max_bytes > 0
+
+    def get_sealed_shard(self, project_id, newest_sealed_shard):
+        """
+        Returns the newest date shard (e.g. "2019-07-15-13-35") of the project
+        whose rows can be cached: newest_sealed_shard, capped at the partition
+        watermark of the project (see AthenaPartitionRegistry) unless
+        partitions are projected. None if nothing can be cached.
+        """
+        if not self.is_enabled():
+            return None
+
+        if self.partition_projection:
+            return newest_sealed_shard
+
+        dbsession = self.db_session_maker()
+
+        try:
+            athena_partition_registry = dbsession.query(AthenaPartitionRegistry).filter_by(
+                project_id=project_id
+            ).first()
+
+            if athena_partition_registry is None or athena_partition_registry.watermark_shard is None:
+                return None
+
+            return min(
+                newest_sealed_shard,
+                athena_partition_registry.watermark_shard.replace("dt=", "")
+            )
+        finally:
+            dbsession.close()
+
+    def get(self, credentials, query):
+        """
+        Returns the cached result of the query as a dict with the rows
+        ("result_data"), the oldest and newest date shards they cover
+        ("oldest_timestamp" and "sealed_shard") and the bytes Athena scanned
+        for them ("bytes_scanned"). None if the query isn't cached.
+        """
+        dbsession = self.db_session_maker()
+
+        try:
+            cached_result = dbsession.query(CachedAthenaQueryResult).filter_by(
+                id=get_athena_query_cache_key(credentials, query)
+            ).first()
+
+            if cached_result is None:
+                return None
+
+            cached_result.hit_count = cached_result.hit_count + 1
+            cached_result.last_used_timestamp = int(time.time())
+            dbsession.commit()
+
+            return cached_result.to_dict()
+        finally:
+            dbsession.close()
+
+    def put(self, credentials, project_id, query, oldest_timestamp, sealed_shard, result_data, bytes_scanned):
+        """
+        Caches the rows of the query from oldest_timestamp up to and including
+        sealed_shard, replacing what was cached for it before.
+        """
+        serialized_result_data = json.dumps(result_data)
+
+        if len(serialized_result_data) > self.max_bytes:
+            return
+
+        dbsession = self.db_session_maker()
+
+        try:
+            cache_key = get_athena_query_cache_key(credentials, query)
+
+            cached_result = dbsession.query(CachedAthenaQueryResult).filter_by(
+                id=cache_key
+            ).first()
+
+            if cached_result is None:
+                cached_result = CachedAthenaQueryResult()
+                cached_result.id = cache_key
+                cached_result.project_id = project_id
+                cached_result.query = normalize_athena_query(query)
+                dbsession.add(cached_result)
+
+            cached_result.oldest_timestamp = oldest_timestamp
+            cached_result.sealed_shard = sealed_shard
+            cached_result.result_data = result_data
+            cached_result.size_bytes = len(serialized_result_data)
+            cached_result.bytes_scanned = bytes_scanned
+            cached_result.last_used_timestamp = int(time.time())
+            dbsession.commit()
+
+            self._evict(dbsession)
+        except exc.IntegrityError:
+            # Cached by a concurrent request in the meantime
+            dbsession.rollback()
+        finally:
+            dbsession.close()
+
+    def _evict(self, dbsession):
+        cached_results = dbsession.query(
+            CachedAthenaQueryResult.id,
+            CachedAthenaQueryResult.size_bytes
+        ).order_by(
+            CachedAthenaQueryResult.last_used_timestamp.desc()
+        )
+
+        total_bytes = 0
+        evicted_ids = []
+
+        for cached_result_id, size_bytes in cached_results:
+            total_bytes += size_bytes
+
+            if total_bytes > self.max_bytes:
+                evicted_ids.append(cached_result_id)
+
+        if not evicted_ids:
+            return
+
+        logit("Evicting " + str(len(evicted_ids)) + " cached Athena query result(s)...", "debug")
+
+        dbsession.query(CachedAthenaQueryResult).filter(
+            CachedAthenaQueryResult.id.in_(evicted_ids)
+        ).delete(synchronize_session=False)
+        dbsession.commit()
+
+    def emit_metrics(self, hit, bytes_scanned, bytes_scanned_saved):
+        """
+        Best effort, the hit rate is the average of athena_query_cache_hit.
+        """
+        if self.cloudwatch_client is None:
+            return
+
+        timestamp = datetime.utcnow()
+
+        metric_values = [
+            ("athena_query_cache_hit", 1 if hit else 0, "Count"),
+            ("athena_query_bytes_scanned", bytes_scanned, "Bytes"),
+            ("athena_query_cache_bytes_scanned_saved", bytes_scanned_saved, "Bytes"),
+        ]
+
+        try:
+            self.cloudwatch_client.put_metric_data(
+                Namespace=get_metrics_namespace(),
+                MetricData=[
+                    {
+                        "MetricName": metric_name,
+                        "Timestamp": timestamp,
+                        "Value": value,
+                        "Unit": unit
+                    }
+                    for metric_name, value, unit in metric_values
+                ]
+            )
+        except Exception as e:
+            logit("Unable to emit Athena query cache metrics: " + repr(e), "warning")
@@ -1,5 +1,6 @@
 import os
 import sys
+import datetime
 import uuid
 import json
 import string
@@ -110,6 +111,31 @@ def get_safe_workflow_state_name(input_name):
     return "".join([c for c in input_name if c in whitelist])[:64]
 
 
+def get_five_minute_dt_from_dt(input_datetime):
+    round_to = (60 * 5)
+
+    seconds = (input_datetime.replace(tzinfo=None) - input_datetime.min).seconds
+    rounding = (seconds + round_to / 2) // round_to * round_to
+    nearest_datetime = input_datetime + datetime.timedelta(0, rounding - seconds, - input_datetime.microsecond)
+    return nearest_datetime
+
+
+def dt_to_shard(input_dt):
+    return input_dt.strftime("%Y-%m-%d-%H-%M")
+
+
+def get_newest_sealed_shard():
+    """
+    The newest date shard no more logs will land in (the execution logs of a
+    block are written to the shard nearest to when they were logged).
+    """
+    return dt_to_shard(
+        get_five_minute_dt_from_dt(
+            datetime.datetime.now() - datetime.timedelta(minutes=5)
+        )
+    )
+
+
 def log_exception(f):
     def wrapped(*args, **kw):
         try:
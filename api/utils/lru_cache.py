@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUByteCache:
+    """
+    A thread-safe in-memory cache of bytes, holding up to max_bytes of
+    values. The least recently used values are evicted past that, values
+    larger than max_bytes are never cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._values.get(key)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._values.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous_value = self._values.pop(key, None)
+            if previous_value is not None:
+                self.total_bytes -= len(previous_value)
+
+            self._values[key] = value
+            self.total_bytes += len(value)
+
+            while self.total_bytes > self.max_bytes:
+                evicted_key, evicted_value = self._values.popitem(last=False)
+                self.total_bytes -= len(evicted_value)
+
+    def __len__(self):
+        return len(self._values)
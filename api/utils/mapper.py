@@ -68,7 +68,8 @@ def execution_log_query_results_to_pipeline_id_dict(query_results):
         execution_pipeline_timestamp = execution_pipeline_id_dict[
             query_result["execution_pipeline_id"]]["timestamp"]
         if int(query_result["timestamp"]) > execution_pipeline_timestamp:
-            execution_pipeline_timestamp = int(query_result["timestamp"])
+            execution_pipeline_id_dict[query_result["execution_pipeline_id"]]["timestamp"] = int(
+                query_result["timestamp"])
 
         # If this is the first ARN we've seen for this execution ID we'll set it up
         # with the default object template as well.
@@ -93,3 +94,69 @@ def execution_log_query_results_to_pipeline_id_dict(query_results):
                          ][query_result["type"]] += execution_int_count
 
     return execution_pipeline_id_dict
+
+
+def execution_log_results_to_rollups(execution_log_results):
+    """
+    Rolls up execution log results (the metadata of the logs in S3, see
+    get_execution_metadata_from_s3_key) into one result per execution
+    pipeline, ARN and execution type:
+
+    [
+            {
+                    "execution_pipeline_id": "{{execution_pipeline_id}}",
+                    "arn": "{{arn}}",
+                    "type": "SUCCESS",
+                    "count": 12,
+                    "min_timestamp": 1563197795,
+                    "max_timestamp": 1563197850,
+                    "timestamp": 1563197850
+            }
+    ]
+
+    "timestamp" is the newest of the executions, so the rollups can be
+    passed to execution_log_query_results_to_pipeline_id_dict like the
+    results they were rolled up from.
+    """
+    rollups = {}
+
+    for execution_log_result in execution_log_results:
+        add_execution_log_result_to_rollups(
+            rollups,
+            execution_log_result
+        )
+
+    return list(rollups.values())
+
+
+def add_execution_log_result_to_rollups(rollups, execution_log_result):
+    """
+    Adds an execution log result to rollups, a dict of the rollups (in the
+    format of execution_log_results_to_rollups) by execution pipeline ID,
+    ARN and type. Lets results be rolled up as they're listed instead of
+    collecting all of them first.
+    """
+    rollup_key = (
+        execution_log_result["execution_pipeline_id"],
+        execution_log_result["arn"],
+        execution_log_result["type"]
+    )
+    timestamp = int(execution_log_result["timestamp"])
+    execution_int_count = int(execution_log_result["count"])
+
+    if not (rollup_key in rollups):
+        rollups[rollup_key] = {
+            "execution_pipeline_id": execution_log_result["execution_pipeline_id"],
+            "arn": execution_log_result["arn"],
+            "type": execution_log_result["type"],
+            "count": 0,
+            "min_timestamp": timestamp,
+            "max_timestamp": timestamp,
+            "timestamp": timestamp
+        }
+
+    rollup = rollups[rollup_key]
+    rollup["count"] += execution_int_count
+    rollup["min_timestamp"] = min(rollup["min_timestamp"], timestamp)
+    rollup["max_timestamp"] = max(rollup["max_timestamp"], timestamp)
+    rollup["timestamp"] = rollup["max_timestamp"]
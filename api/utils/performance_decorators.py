@@ -11,13 +11,9 @@ def unix_time_millis(dt):
     return (dt - epoch).total_seconds() * 1000.0
 
 
-def emit_runtime_metrics(metric_name):
+def get_metrics_namespace():
     """
-    Decorator that emits metrics to Cloudwatch about an invocation.
-    Designed to provide an easier debugging experience for production issues, as well as to create alerts.
-    :param metric_name: Name of the metric that will be emitted.
-    :type metric_name: basestring
-    :return: Decorated function
+    Cloudwatch namespace of the performance metrics of this environment.
     """
     is_debug = (os.environ.get("is_debug").lower() == "true")
 
@@ -26,6 +22,19 @@ def emit_runtime_metrics(metric_name):
     if not is_debug:
         env_name = "Production"
 
+    return "Refinery-Performance-Metrics__" + env_name
+
+
+def emit_runtime_metrics(metric_name):
+    """
+    Decorator that emits metrics to Cloudwatch about an invocation.
+    Designed to provide an easier debugging experience for production issues, as well as to create alerts.
+    :param metric_name: Name of the metric that will be emitted.
+    :type metric_name: basestring
+    :return: Decorated function
+    """
+    metrics_namespace = get_metrics_namespace()
+
     def decorator(func):
         def wrapper(*args, **kwargs):
             self = args[0]
@@ -52,7 +61,7 @@ def emit_runtime_metrics(metric_name):
             # Best effort to log the metric to Cloudwatch
             try:
                 cloudwatch_client.put_metric_data(
-                    Namespace="Refinery-Performance-Metrics__" + env_name,
+                    Namespace=metrics_namespace,
                     MetricData=[
                         {
                             "MetricName": "task_invocation",
@@ -0,0 +1,475 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+
+Runs custom_runtime end to end on one machine, against a real (local)
+redis server, so the transition paths can be measured without deploying.
+
+Every emulated Lambda gets its own pool of worker processes ("containers")
+with the environment a deployed Lambda would have. Each worker imports the
+runtime and runs _init for the invocations of its function. boto3 clients
+are replaced in the workers by local stand-ins:
+
+* lambda: invoke() queues the payload for the target function's workers.
+* sqs: send_message_batch() counts the messages it was sent.
+* sns: publish() counts the messages it was sent.
+* s3: put_object() counts the objects it was sent (pipeline logs, etc).
+
+Blocks are real Python 2.7 blocks (user code + api/lambda_bases/python2.7)
+run by the runtime exactly as on Lambda.
+"""
+
+from os.path import dirname, realpath, join
+import multiprocessing
+import resource
+import tempfile
+import shutil
+import json
+import time
+import uuid
+import sys
+import os
+
+
+CUSTOM_RUNTIME_DIR = dirname(dirname(realpath(__file__)))
+LAMBDA_BASES_DIR = join(dirname(CUSTOM_RUNTIME_DIR), "api", "lambda_bases")
+
+ACCOUNT_ID = "000000000000"
+REGION = "us-west-2"
+
+_COUNTERS = [
+    "invocations",
+    "failed_invocations",
+    "redis_round_trips",
+    "sqs_messages",
+    "sns_messages",
+    "s3_objects",
+]
+
+
+def get_function_arn(function_name):
+    return "arn:aws:lambda:" + REGION + ":" + ACCOUNT_ID + ":function:" + function_name
+
+
+def get_queue_arn(queue_name):
+    return "arn:aws:sqs:" + REGION + ":" + ACCOUNT_ID + ":" + queue_name
+
+
+class EmulatorStats:
+    """
+    Counters shared between the emulator and all of its worker processes.
+    """
+
+    def __init__(self):
+        self.lock = multiprocessing.Lock()
+        self.counters = dict([
+            (counter_name, multiprocessing.Value("l", 0, lock=False))
+            for counter_name in _COUNTERS
+        ])
+
+        # Invocations queued or running, the emulator is idle at zero
+        self.in_flight = multiprocessing.Value("l", 0, lock=False)
+
+        # Largest max RSS (in KB) reported by any worker process
+        self.peak_rss_kb = multiprocessing.Value("l", 0, lock=False)
+
+    def add(self, counter_name, amount=1):
+        with self.lock:
+            self.counters[counter_name].value += amount
+
+    def add_in_flight(self, amount):
+        with self.lock:
+            self.in_flight.value += amount
+
+    def report_rss(self, rss_kb):
+        with self.lock:
+            self.peak_rss_kb.value = max(self.peak_rss_kb.value, rss_kb)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = dict([
+                (counter_name, counter.value)
+                for counter_name, counter in self.counters.items()
+            ])
+            snapshot["peak_rss_mb"] = round(self.peak_rss_kb.value / 1024.0, 1)
+
+        return snapshot
+
+    def reset(self):
+        with self.lock:
+            for counter in self.counters.values():
+                counter.value = 0
+            self.peak_rss_kb.value = 0
+
+
+class _LocalLambdaClient:
+    def __init__(self, function_queues, stats):
+        self.function_queues = function_queues
+        self.stats = stats
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse", **kwargs):
+        function_name = FunctionName.split(":")[-1]
+
+        self.stats.add_in_flight(1)
+        self.function_queues[function_name].put(Payload)
+
+        return {
+            "StatusCode": 202
+        }
+
+
+class _LocalSQSClient:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        self.stats.add("sqs_messages", len(Entries))
+
+        return {
+            "Successful": [
+                {
+                    "Id": entry["Id"],
+                    "MessageId": str(uuid.uuid4())
+                } for entry in Entries
+            ],
+            "Failed": []
+        }
+
+
+class _LocalSNSClient:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def publish(self, **kwargs):
+        self.stats.add("sns_messages")
+
+        return {
+            "MessageId": str(uuid.uuid4())
+        }
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries, **kwargs):
+        self.stats.add("sns_messages", len(PublishBatchRequestEntries))
+
+        return {
+            "Successful": [
+                {
+                    "Id": entry["Id"],
+                    "MessageId": str(uuid.uuid4())
+                } for entry in PublishBatchRequestEntries
+            ],
+            "Failed": []
+        }
+
+
+class _LocalS3Client:
+    def __init__(self, stats):
+        self.stats = stats
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.stats.add("s3_objects")
+        self.objects[Bucket + "/" + Key] = Body
+
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Bucket + "/" + Key, None)
+
+        return {}
+
+
+class _LocalCustomRuntime:
+    """
+    Stands in for custom_runtime.base.CustomRuntime, which would post the
+    result back to the Lambda runtime API.
+    """
+
+    def __init__(self):
+        self.failed = False
+
+    def send_response(self, request_id, return_data):
+        pass
+
+    def send_error(self, request_id, error_data):
+        self.failed = True
+
+
+class _ContextObject:
+    def __init__(self, function_name, memory_limit_in_mb, timeout_seconds):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = get_function_arn(function_name)
+        self.memory_limit_in_mb = str(memory_limit_in_mb)
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = "/aws/lambda/" + function_name
+        self.log_stream_name = "emulator"
+        self.deadline_ms = int(time.time() * 1000) + (timeout_seconds * 1000)
+
+    def get_remaining_time_in_millis(self):
+        return self.deadline_ms - int(time.time() * 1000)
+
+
+def _patch_aws_clients(function_queues, stats):
+    import boto3
+
+    clients = {
+        "lambda": _LocalLambdaClient(function_queues, stats),
+        "sqs": _LocalSQSClient(stats),
+        "sns": _LocalSNSClient(stats),
+        "s3": _LocalS3Client(stats),
+    }
+
+    def local_client(service_name, *args, **kwargs):
+        return clients[service_name]
+
+    boto3.client = local_client
+
+
+def _patch_redis_round_trips(round_trips):
+    import redis.connection
+
+    send_packed_command = redis.connection.Connection.send_packed_command
+
+    # Single commands and whole pipelines are each sent as one packed command
+    def counting_send_packed_command(self, *args, **kwargs):
+        round_trips[0] += 1
+        return send_packed_command(self, *args, **kwargs)
+
+    redis.connection.Connection.send_packed_command = counting_send_packed_command
+
+
+def _function_worker(function, environment, function_queues, stats):
+    os.environ.update(environment)
+
+    # Has to happen before the runtime is imported, since it builds
+    # some of its clients at import time.
+    _patch_aws_clients(function_queues, stats)
+
+    round_trips = [0]
+    _patch_redis_round_trips(round_trips)
+
+    sys.path.insert(0, CUSTOM_RUNTIME_DIR)
+
+    import custom_runtime.init
+    from custom_runtime.init import _init
+    from custom_runtime.constants import PIPELINE_LOG_WRITER
+
+    custom_runtime.init.RUNTIME_DIR = function["runtime_path"]
+
+    # Keep the block's output out of the benchmark's output
+    devnull = open(os.devnull, "w")
+    os.dup2(devnull.fileno(), 1)
+
+    invoke_queue = function_queues[function["name"]]
+
+    while True:
+        payload = invoke_queue.get()
+
+        # Told to shut down
+        if payload is None:
+            break
+
+        local_runtime = _LocalCustomRuntime()
+        context = _ContextObject(
+            function["name"],
+            function["memory"],
+            function["timeout"]
+        )
+
+        execution_details = {
+            "initialization_time": int(time.time()),
+            "aws_region": REGION,
+            "group_name": context.log_group_name,
+            "stream_name": context.log_stream_name,
+            "function_name": context.function_name,
+            "function_version": context.function_version,
+            "invoked_function_arn": context.invoked_function_arn,
+            "memory_limit_in_mb": int(context.memory_limit_in_mb),
+            "aws_request_id": context.aws_request_id
+        }
+
+        round_trips[0] = 0
+
+        try:
+            _init(
+                local_runtime,
+                context.aws_request_id,
+                json.loads(payload),
+                context,
+                execution_details
+            )
+            PIPELINE_LOG_WRITER.flush()
+        except Exception:
+            local_runtime.failed = True
+            import traceback
+            sys.stderr.write(traceback.format_exc())
+
+        stats.add("invocations")
+        if local_runtime.failed:
+            stats.add("failed_invocations")
+        stats.add("redis_round_trips", round_trips[0])
+        stats.report_rss(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        )
+
+        stats.add_in_flight(-1)
+
+
+class RuntimeEmulator:
+    """
+    Usage:
+
+    emulator = RuntimeEmulator(redis_hostname="127.0.0.1", redis_port=6379)
+    emulator.add_function("Fan_Out", block_code, transitions={"fan-out": [...]})
+    emulator.add_function(...)
+    emulator.start()
+
+    emulator.invoke("Fan_Out", {"count": 1000})
+    emulator.wait_until_idle()
+    print(emulator.stats.snapshot())
+
+    emulator.stop()
+    """
+
+    def __init__(self, redis_hostname="127.0.0.1", redis_port=6379, redis_password="", workers_per_function=4, warm_workers=False, pipeline_logging_level="LOG_NONE"):
+        self.redis_hostname = redis_hostname
+        self.redis_port = redis_port
+        self.redis_password = redis_password
+        self.workers_per_function = workers_per_function
+        self.warm_workers = warm_workers
+        self.pipeline_logging_level = pipeline_logging_level
+
+        self.stats = EmulatorStats()
+        self.functions = {}
+        self.function_queues = {}
+        self.processes = []
+        self.work_dir = tempfile.mkdtemp()
+
+        # Function names are unique per emulator so state left in redis
+        # (learned fan-out rates, etc) by earlier runs doesn't carry over.
+        self.run_id = str(uuid.uuid4()).split("-")[0]
+
+        # Blocks run under the same interpreter as the emulator
+        self.runtime_path = join(self.work_dir, "runtime")
+        with open(self.runtime_path, "w") as file_handler:
+            file_handler.write("#!/usr/bin/env bash\nexec \"" + sys.executable + "\" \"$@\"\n")
+        os.chmod(self.runtime_path, 0o775)
+
+        with open(join(LAMBDA_BASES_DIR, "python2.7"), "r") as file_handler:
+            self.python_base_code = file_handler.read()
+
+    def get_function_name(self, name):
+        return name + "_" + self.run_id
+
+    def get_function_arn(self, name):
+        return get_function_arn(self.get_function_name(name))
+
+    def add_function(self, name, block_code, transitions=None, memory=1024, timeout=900):
+        """
+        Adds a Python 2.7 block. transitions is in the same format as the
+        TRANSITION_DATA of a deployed Lambda, using ARNs from
+        get_function_arn().
+        """
+        function_name = self.get_function_name(name)
+        task_root = join(self.work_dir, function_name)
+        os.mkdir(task_root)
+
+        with open(join(task_root, "lambda"), "w") as file_handler:
+            file_handler.write(block_code + self.python_base_code)
+
+        all_transitions = {
+            "then": [],
+            "else": [],
+            "exception": [],
+            "if": [],
+            "fan-out": [],
+            "fan-in": [],
+            "merge": [],
+        }
+        all_transitions.update(transitions or {})
+
+        self.functions[function_name] = {
+            "name": function_name,
+            "memory": memory,
+            "timeout": timeout,
+            "runtime_path": self.runtime_path,
+            "environment": {
+                "_HANDLER": "lambda._init",
+                "LAMBDA_TASK_ROOT": task_root,
+                "EXECUTION_PIPELINE_ID": "emulator-" + self.run_id,
+                "LOG_BUCKET_NAME": "refinery-lambda-logging-emulator",
+                "PIPELINE_LOGGING_LEVEL": self.pipeline_logging_level,
+                "EXECUTION_MODE": "REGULAR",
+                "TRANSITION_DATA": json.dumps(all_transitions),
+                "REDIS_HOSTNAME": self.redis_hostname,
+                "REDIS_PORT": str(self.redis_port),
+                "REDIS_PASSWORD": self.redis_password,
+                "WARM_WORKER_MODE": str(self.warm_workers),
+                "AWS_REGION": REGION,
+                "AWS_DEFAULT_REGION": REGION,
+            }
+        }
+        self.function_queues[function_name] = multiprocessing.Queue()
+
+    def start(self):
+        for function in self.functions.values():
+            for i in range(0, self.workers_per_function):
+                process = multiprocessing.Process(
+                    target=_function_worker,
+                    args=(
+                        function,
+                        function["environment"],
+                        self.function_queues,
+                        self.stats
+                    )
+                )
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+
+    def invoke(self, name, input_data):
+        self.stats.add_in_flight(1)
+        self.function_queues[self.get_function_name(name)].put(
+            json.dumps(input_data)
+        )
+
+    def wait_until_idle(self, timeout=600, poll_interval=0.05):
+        """
+        Blocks until every invocation (including the ones it caused) is done.
+        """
+        deadline = time.time() + timeout
+
+        while self.stats.in_flight.value > 0:
+            if time.time() > deadline:
+                raise Exception(
+                    "Emulator still had " + str(self.stats.in_flight.value) +
+                    " invocation(s) in flight after " + str(timeout) + " seconds"
+                )
+
+            for process in self.processes:
+                if not process.is_alive():
+                    raise Exception("An emulator worker process died")
+
+            time.sleep(poll_interval)
+
+    def stop(self):
+        for function_name, function_queue in self.function_queues.items():
+            for i in range(0, self.workers_per_function):
+                function_queue.put(None)
+
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+        self.processes = []
+        shutil.rmtree(self.work_dir, ignore_errors=True)
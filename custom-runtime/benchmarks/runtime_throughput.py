@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+
+Throughput of the runtime's transition paths, run through the local
+emulator (see emulator.py). For each graph it reports items per second,
+redis round-trips per item and the peak memory of any worker process:
+
+* fan_out: a block fans out N items to a second block.
+* fan_in: as fan_out, with the second block fanning back in to a third.
+* merge: N executions of a block which branches to two blocks that merge.
+* sqs_insert: a block returns N items to an SQS queue transition.
+
+Needs a redis server, either pointed at with --redis-host/--redis-port or
+started by the benchmark with --start-redis (redis-server must be on the
+PATH). Nothing is flushed, the emulated functions are unique per run.
+
+Usage:
+    python benchmarks/runtime_throughput.py [--items 1000] [--graph fan_out ...]
+        [--workers-per-function 8] [--warm-workers] [--output results.json]
+"""
+
+from os.path import dirname, realpath
+import subprocess
+import argparse
+import os
+import socket
+import json
+import time
+import sys
+
+from emulator import RuntimeEmulator, get_queue_arn
+
+
+FAN_OUT_BLOCK = "def main(block_input, backpack):\n\treturn list(range(block_input['items']))\n\n"
+IDENTITY_BLOCK = "def main(block_input, backpack):\n\treturn block_input\n\n"
+
+
+def build_fan_out(emulator, items):
+    emulator.add_function("Source", FAN_OUT_BLOCK, {
+        "fan-out": [{"type": "fan_out", "arn": emulator.get_function_arn("Item")}],
+    })
+    emulator.add_function("Item", IDENTITY_BLOCK)
+
+    return {
+        "invocations": [("Source", {"items": items})],
+        "expected_invocations": 1 + items,
+    }
+
+
+def build_fan_in(emulator, items):
+    emulator.add_function("Source", FAN_OUT_BLOCK, {
+        "fan-out": [{"type": "fan_out", "arn": emulator.get_function_arn("Item")}],
+    })
+    emulator.add_function("Item", IDENTITY_BLOCK, {
+        "fan-in": [{"type": "fan_in", "arn": emulator.get_function_arn("Sink")}],
+    })
+    emulator.add_function("Sink", IDENTITY_BLOCK)
+
+    return {
+        "invocations": [("Source", {"items": items})],
+        "expected_invocations": 2 + items,
+    }
+
+
+def build_merge(emulator, items):
+    merge_transition = {
+        "type": "merge",
+        "arn": emulator.get_function_arn("Merged"),
+        "merge_lambdas": [
+            emulator.get_function_arn("Left"),
+            emulator.get_function_arn("Right"),
+        ]
+    }
+
+    emulator.add_function("Source", IDENTITY_BLOCK, {
+        "then": [
+            {"type": "lambda", "arn": emulator.get_function_arn("Left")},
+            {"type": "lambda", "arn": emulator.get_function_arn("Right")},
+        ],
+    })
+    emulator.add_function("Left", IDENTITY_BLOCK, {"merge": [merge_transition]})
+    emulator.add_function("Right", IDENTITY_BLOCK, {"merge": [merge_transition]})
+    emulator.add_function("Merged", IDENTITY_BLOCK)
+
+    return {
+        "invocations": [("Source", {"execution": i}) for i in range(0, items)],
+        "expected_invocations": 4 * items,
+    }
+
+
+def build_sqs_insert(emulator, items):
+    emulator.add_function("Source", FAN_OUT_BLOCK, {
+        "then": [{"type": "sqs_queue", "arn": get_queue_arn("Emulator_Queue")}],
+    })
+
+    return {
+        "invocations": [("Source", {"items": items})],
+        "expected_sqs_messages": items,
+    }
+
+
+GRAPHS = {
+    "fan_out": build_fan_out,
+    "fan_in": build_fan_in,
+    "merge": build_merge,
+    "sqs_insert": build_sqs_insert,
+}
+
+
+def run_graph(graph_name, items, args):
+    emulator = RuntimeEmulator(
+        redis_hostname=args.redis_host,
+        redis_port=args.redis_port,
+        redis_password=args.redis_password,
+        workers_per_function=args.workers_per_function,
+        warm_workers=args.warm_workers,
+    )
+
+    try:
+        graph = GRAPHS[graph_name](emulator, items)
+        emulator.start()
+
+        start_time = time.time()
+        for function_name, input_data in graph["invocations"]:
+            emulator.invoke(function_name, input_data)
+        emulator.wait_until_idle(timeout=args.timeout)
+        seconds = time.time() - start_time
+    finally:
+        emulator.stop()
+
+    stats = emulator.stats.snapshot()
+
+    result = {
+        "items": items,
+        "seconds": round(seconds, 3),
+        "items_per_second": round(items / seconds, 1),
+        "redis_round_trips": stats["redis_round_trips"],
+        "redis_round_trips_per_item": round(float(stats["redis_round_trips"]) / items, 2),
+        "peak_rss_mb": stats["peak_rss_mb"],
+        "invocations": stats["invocations"],
+        "failed_invocations": stats["failed_invocations"],
+        "sqs_messages": stats["sqs_messages"],
+    }
+
+    # Fan-outs also self-invoke spawners, so invocations are a lower bound
+    result["complete"] = (
+        stats["failed_invocations"] == 0 and
+        stats["invocations"] >= graph.get("expected_invocations", 0) and
+        stats["sqs_messages"] >= graph.get("expected_sqs_messages", 0)
+    )
+
+    return result
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_redis_server():
+    port = get_free_port()
+
+    redis_process = subprocess.Popen(
+        [
+            "redis-server",
+            "--port", str(port),
+            "--save", "",
+            "--appendonly", "no",
+        ],
+        stdout=open("/dev/null", "w"),
+    )
+
+    # Wait until it's accepting connections
+    for i in range(0, 100):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return redis_process, port
+        except socket.error:
+            time.sleep(0.05)
+
+    redis_process.kill()
+    raise Exception("redis-server didn't start listening on port " + str(port))
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=dirname(realpath(__file__)),
+            stderr=open(os.devnull, "w")
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transition path throughput through the local runtime emulator")
+    parser.add_argument("--items", type=int, action="append", default=[],
+                        help="Number of items per graph, can be given more than once (default 1000)")
+    parser.add_argument("--graph", action="append", default=[], choices=sorted(GRAPHS.keys()),
+                        help="Graph(s) to run (default all)")
+    parser.add_argument("--workers-per-function", type=int, default=8)
+    parser.add_argument("--warm-workers", action="store_true",
+                        help="Run blocks in warm workers")
+    parser.add_argument("--timeout", type=int, default=1800,
+                        help="Seconds to wait for a graph to finish")
+    parser.add_argument("--redis-host", default="127.0.0.1")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument("--start-redis", action="store_true",
+                        help="Start a throwaway redis-server for the run")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    redis_process = None
+    if args.start_redis:
+        redis_process, args.redis_port = start_redis_server()
+        args.redis_host = "127.0.0.1"
+
+    results = {
+        "commit": get_git_commit(),
+        "timestamp": int(time.time()),
+        "workers_per_function": args.workers_per_function,
+        "warm_workers": args.warm_workers,
+        "graphs": {},
+    }
+
+    try:
+        for graph_name in (args.graph or sorted(GRAPHS.keys())):
+            results["graphs"][graph_name] = []
+
+            for items in (args.items or [1000]):
+                sys.stderr.write("Running " + graph_name + " with " + str(items) + " item(s)...\n")
+                results["graphs"][graph_name].append(
+                    run_graph(graph_name, items, args)
+                )
+    finally:
+        if redis_process is not None:
+            redis_process.kill()
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as file_handler:
+            file_handler.write(output + "\n")
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
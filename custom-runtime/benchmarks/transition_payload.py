@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+
+Time taken to dispatch a block's return data along N outgoing transitions
+(building the invocations and running them through _parallel_invoke),
+for an increasing number of edges. Each edge count is run twice:
+
+* serialize_once: every transition shares one TransitionPayload, the way
+  the runtime dispatches them.
+* copy_per_edge: every transition gets its own deep copy of the return
+  data and encodes it separately, the way the runtime used to.
+
+Lambda edges store their input in redis, so a redis server is needed
+(see --redis-host/--redis-port). AWS calls are answered locally by the
+emulator's clients (see emulator.py).
+
+Usage:
+    python benchmarks/transition_payload.py [--edges 1 --edges 8 ...]
+        [--payload-kb 1024] [--edge-type lambda|sns_topic] [--json]
+"""
+
+import collections
+import argparse
+import json
+import time
+import sys
+import os
+
+from emulator import CUSTOM_RUNTIME_DIR, EmulatorStats, _patch_aws_clients
+from emulator import get_function_arn
+
+
+class _DiscardQueue:
+    def put(self, item):
+        pass
+
+
+def get_return_data(payload_kb):
+    # Roughly payload_kb of nested JSON
+    return [
+        {
+            "id": i,
+            "name": "item-" + str(i),
+            "values": list(range(0, 16)),
+        } for i in range(0, payload_kb * 10)
+    ]
+
+
+def build_invocations(return_data, backpack, edges, edge_type, serialize_once):
+    from custom_runtime.payload import TransitionPayload
+
+    transition_payload = TransitionPayload(
+        return_data,
+        backpack
+    )
+
+    invocation_list = []
+
+    for i in range(0, edges):
+        invocation = {
+            "backpack": backpack,
+            "execution_id": "benchmark",
+            "fan_out_ids": [],
+            "type": edge_type,
+            "arn": get_function_arn("Target_" + str(i)),
+        }
+
+        if serialize_once:
+            invocation["input_data"] = return_data
+            invocation["payload"] = transition_payload
+        else:
+            invocation["input_data"] = json.loads(
+                json.dumps(
+                    return_data
+                )
+            )
+
+        invocation_list.append(invocation)
+
+    return invocation_list
+
+
+def time_dispatch(return_data, edges, edge_type, serialize_once, iterations):
+    from custom_runtime.parallel_invoke import _parallel_invoke
+
+    backpack = {
+        "user": "benchmark",
+        "tags": ["a", "b", "c"],
+    }
+
+    timings = []
+
+    for i in range(0, iterations):
+        start_time = time.time()
+        _parallel_invoke(
+            ["benchmark-branch"],
+            build_invocations(
+                return_data,
+                backpack,
+                edges,
+                edge_type,
+                serialize_once
+            )
+        )
+        timings.append(time.time() - start_time)
+
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transition dispatch time versus the number of outgoing edges")
+    parser.add_argument("--edges", type=int, action="append", default=[],
+                        help="Number of outgoing edges, can be given more than once (default 1 to 64)")
+    parser.add_argument("--payload-kb", type=int, default=1024,
+                        help="Approximate size of the return data")
+    parser.add_argument("--edge-type", default="lambda", choices=["lambda", "sns_topic"])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--redis-host", default="127.0.0.1")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "REDIS_HOSTNAME": args.redis_host,
+        "REDIS_PORT": str(args.redis_port),
+        "REDIS_PASSWORD": args.redis_password,
+        "AWS_DEFAULT_REGION": "us-west-2",
+    })
+
+    # Has to happen before the runtime is imported
+    _patch_aws_clients(
+        collections.defaultdict(_DiscardQueue),
+        EmulatorStats()
+    )
+
+    sys.path.insert(0, CUSTOM_RUNTIME_DIR)
+
+    return_data = get_return_data(args.payload_kb)
+    payload_bytes = len(json.dumps(return_data))
+
+    results = []
+
+    for edges in (args.edges or [1, 2, 4, 8, 16, 32, 64]):
+        serialize_once_seconds = time_dispatch(
+            return_data, edges, args.edge_type, True, args.iterations)
+        copy_per_edge_seconds = time_dispatch(
+            return_data, edges, args.edge_type, False, args.iterations)
+
+        results.append({
+            "edges": edges,
+            "serialize_once_ms": round(serialize_once_seconds * 1000, 2),
+            "copy_per_edge_ms": round(copy_per_edge_seconds * 1000, 2),
+        })
+
+    if args.json:
+        print(json.dumps({
+            "edge_type": args.edge_type,
+            "payload_bytes": payload_bytes,
+            "results": results,
+        }, indent=4, sort_keys=True))
+        return
+
+    print("%s edges, %d byte return data" % (args.edge_type, payload_bytes))
+    print("%-8s %18s %18s" % ("edges", "serialize once ms", "copy per edge ms"))
+    for result in results:
+        print("%-8d %18.2f %18.2f" % (
+            result["edges"],
+            result["serialize_once_ms"],
+            result["copy_per_edge_ms"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+
+Compares the latency of running a block cold (a new interpreter per call,
+the way the runtime always has) against running it in a warm worker, for
+each language wrapper in api/lambda_bases/.
+
+Languages whose wrapper doesn't speak the warm worker protocol, or whose
+interpreter isn't installed, are reported as such.
+
+Usage:
+    python benchmarks/warm_worker.py [--iterations 50] [--json]
+        [--interpreter python2.7=/usr/bin/python2.7 ...]
+"""
+
+from os.path import dirname, realpath, join
+import subprocess
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+
+
+CUSTOM_RUNTIME_DIR = dirname(dirname(realpath(__file__)))
+LAMBDA_BASES_DIR = join(dirname(CUSTOM_RUNTIME_DIR), "api", "lambda_bases")
+
+sys.path.insert(0, CUSTOM_RUNTIME_DIR)
+
+from custom_runtime.worker import LanguageWorker, supports_warm_worker
+
+
+# Interpreter and a block which returns its input, for each language
+LANGUAGES = {
+    "python2.7": {
+        "interpreter": "python2.7",
+        "block_code": "def main(block_input, backpack):\n\treturn block_input\n\n",
+    },
+    "python3.6": {
+        "interpreter": "python3",
+        "block_code": "def main(block_input, backpack):\n\treturn block_input\n\n",
+    },
+    "nodejs10.20.1": {
+        "interpreter": "node",
+        "block_code": "async function main(blockInput) {\n\treturn blockInput;\n}\n\n",
+    },
+    "ruby2.6.4": {
+        "interpreter": "ruby",
+        "block_code": "def main(block_input, backpack)\n\treturn block_input\nend\n\n",
+    },
+    "php7.3": {
+        "interpreter": "php",
+        "block_code": "<?php\nfunction main($block_input) {\n\treturn $block_input;\n}\n\n",
+    },
+}
+
+BLOCK_INPUT = {
+    "lambda_input": {
+        "items": list(range(0, 100))
+    },
+    "backpack": {}
+}
+
+
+def which(command):
+    if os.path.isabs(command):
+        return command if os.path.exists(command) else None
+
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = join(path, command)
+        if os.path.exists(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+
+    return None
+
+
+def write_runtime(work_dir, interpreter_path):
+    """
+    Stand-in for the layer's runtime script (e.g. languages/python3.6/runtime)
+    """
+    runtime_path = join(work_dir, "runtime")
+
+    with open(runtime_path, "w") as file_handler:
+        file_handler.write("#!/usr/bin/env bash\nexec " + interpreter_path + " \"$@\"\n")
+
+    os.chmod(runtime_path, 0o775)
+
+    return runtime_path
+
+
+def write_block(work_dir, language_name, block_code):
+    executable_path = join(work_dir, "block")
+
+    with open(join(LAMBDA_BASES_DIR, language_name), "r") as file_handler:
+        base_code = file_handler.read()
+
+    with open(executable_path, "w") as file_handler:
+        file_handler.write(block_code + base_code)
+
+    return executable_path
+
+
+def run_cold(runtime_path, executable_path, work_dir):
+    process_handler = subprocess.Popen(
+        [
+            runtime_path,
+            executable_path
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.PIPE,
+        cwd=work_dir,
+    )
+
+    output = process_handler.communicate(
+        json.dumps(BLOCK_INPUT).encode("utf8")
+    )[0]
+
+    if process_handler.returncode != 0:
+        raise Exception("Block failed when run cold: " + output.decode("utf8"))
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+
+    return {
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+    }
+
+
+def benchmark_language(language_name, interpreter_path, block_code, iterations):
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        runtime_path = write_runtime(work_dir, interpreter_path)
+        executable_path = write_block(work_dir, language_name, block_code)
+
+        cold_latencies = []
+        for i in range(0, iterations):
+            start_time = time.time()
+            run_cold(runtime_path, executable_path, work_dir)
+            cold_latencies.append(time.time() - start_time)
+
+        result = {
+            "cold": summarize(cold_latencies),
+            "warm": None,
+        }
+
+        if not supports_warm_worker(executable_path):
+            return result
+
+        worker = LanguageWorker(runtime_path, executable_path, work_dir)
+
+        warm_latencies = []
+        try:
+            for i in range(0, iterations + 1):
+                start_time = time.time()
+                response = worker.invoke(
+                    BLOCK_INPUT["lambda_input"],
+                    BLOCK_INPUT["backpack"],
+                    30
+                )
+                warm_latencies.append(time.time() - start_time)
+
+                if response["exit_code"] != 0:
+                    raise Exception("Block failed in warm worker: " + response["output"])
+        finally:
+            worker.stop()
+
+        # The first call includes starting the worker
+        result["warm_first_call_ms"] = round(warm_latencies[0] * 1000, 3)
+        result["warm"] = summarize(warm_latencies[1:])
+        result["speedup"] = round(
+            result["cold"]["mean_ms"] / result["warm"]["mean_ms"], 2)
+
+        return result
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cold-per-call vs warm worker block latency")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--json", action="store_true",
+                        help="Print machine-readable results")
+    parser.add_argument("--interpreter", action="append", default=[],
+                        help="Override a language's interpreter, e.g. python2.7=/usr/bin/python2.7")
+    args = parser.parse_args()
+
+    interpreters = {}
+    for override in args.interpreter:
+        language_name, interpreter = override.split("=", 1)
+        interpreters[language_name] = interpreter
+
+    results = {}
+
+    for language_name in sorted(LANGUAGES.keys()):
+        interpreter_path = which(interpreters.get(
+            language_name, LANGUAGES[language_name]["interpreter"]))
+
+        if interpreter_path is None:
+            results[language_name] = {
+                "skipped": "interpreter not found"
+            }
+            continue
+
+        try:
+            results[language_name] = benchmark_language(
+                language_name,
+                interpreter_path,
+                LANGUAGES[language_name]["block_code"],
+                args.iterations
+            )
+        except Exception as e:
+            results[language_name] = {
+                "skipped": str(e)
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+        return
+
+    for language_name in sorted(results.keys()):
+        result = results[language_name]
+
+        if "skipped" in result:
+            print(language_name + ": skipped (" + result["skipped"] + ")")
+        elif result["warm"] is None:
+            print(language_name + ": cold " + str(result["cold"]["mean_ms"]) +
+                  " ms (no warm worker support)")
+        else:
+            print(language_name + ": cold " + str(result["cold"]["mean_ms"]) + " ms, warm " +
+                  str(result["warm"]["mean_ms"]) + " ms (first call " +
+                  str(result["warm_first_call_ms"]) + " ms), " + str(result["speedup"]) + "x")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,3 +12,7 @@ deactivate
 rm -rf env dist build custom_runtime.egg-info
 rm -rf base-src/pip
 find base-src -name "*.pyc" | xargs rm
+# Lambda can't write bytecode next to the (read-only) layer, so compile
+# it in, otherwise every cold start compiles boto3 & co from source.
+`which python2.7` -m compileall -q base-src
+`which python2.7` base-src/bootstrap --measure-cold-start ${COLD_START_BUDGET_MS:+--budget-ms $COLD_START_BUDGET_MS}
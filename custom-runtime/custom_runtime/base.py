@@ -20,10 +20,10 @@ import sys
 import os
 
 
-from .clock import _start_clock, _stop_clock
+from .clock import _start_clock, _stop_clock, _reset_clock, _emit_trace_metrics
 from .init import _init
 from .utils import _write_pipeline_logs
-from .constants import http
+from .constants import http, gmemory, PIPELINE_LOG_WRITER
 
 
 class CustomRuntime():
@@ -50,6 +50,13 @@ class CustomRuntime():
     def process_next_event(self):
         event_data = self.get_next_invocation()
 
+        # Spans are traced per invocation
+        _reset_clock()
+
+        # Redis payload codec and connection stats are reported per
+        # invocation, and the connection is checked after a thaw.
+        gmemory.start_invocation()
+
         context_dict = {
             "function_name": os.getenv("AWS_LAMBDA_FUNCTION_NAME"),
             "function_version": os.getenv("AWS_LAMBDA_FUNCTION_VERSION"),
@@ -136,6 +143,22 @@ class CustomRuntime():
                 ""
             )
             return
+        finally:
+            # Lambda freezes us once we ask for the next event, so any
+            # logs still uploading have to finish first.
+            _start_clock("Flushing Pipeline Logs")
+            PIPELINE_LOG_WRITER.flush()
+            _stop_clock("Flushing Pipeline Logs")
+
+            _emit_trace_metrics(new_context.function_name)
+
+            if gmemory.codec.get_stats()["values"] > 0:
+                print(gmemory.codec.get_stats_line())
+                sys.stdout.flush()
+
+            if gmemory.connection_manager.stats.round_trips > 0:
+                print(gmemory.get_stats_line())
+                sys.stdout.flush()
 
     def get_next_invocation(self):
         response = http.request(
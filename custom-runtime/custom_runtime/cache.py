@@ -0,0 +1,213 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import collections
+import hashlib
+import shutil
+import uuid
+import os
+
+
+class FileCache:
+    """
+    A content-addressed file cache in /tmp which lives as long as the
+    container stays warm. Inline executions from the editor tend to run
+    the same code (and shared files, and Go binaries) over and over, so
+    instead of re-writing and re-downloading them on every run they're
+    stored once under the hash of their contents.
+
+    The cache is capped at max_bytes, least recently used files are
+    evicted first. Files used by the current invocation (see
+    start_invocation()) are never evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        # Cache key -> size in bytes, in least to most recently used order
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.loaded = False
+
+        # Keys in use by the current invocation
+        self.pinned = set()
+
+        # Materialized path -> (cache key, size, mtime) it was written with
+        self.materialized = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def start_invocation(self):
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def get_path(self, key):
+        return os.path.join(
+            self.cache_dir,
+            key
+        )
+
+    def put_text(self, text):
+        """
+        Caches the UTF-8 encoding of text, returns the path it's cached at.
+        """
+        data = text.encode("utf8")
+        key = hashlib.sha256(data).hexdigest()
+
+        if not self._lookup(key):
+            self._store(key, data)
+
+        return self.get_path(key)
+
+    def put_s3_object(self, s3_client, s3_bucket, s3_key):
+        """
+        Caches an S3 object, returns the path it's cached at. The object is
+        looked up by its ETag (the MD5 of its contents for regular uploads),
+        so it's only downloaded when the contents aren't cached yet.
+        """
+        head_response = s3_client.head_object(
+            Bucket=s3_bucket,
+            Key=s3_key
+        )
+        key = "s3-" + head_response["ETag"].strip("\"")
+
+        if not self._lookup(key):
+            s3_response = s3_client.get_object(
+                Bucket=s3_bucket,
+                Key=s3_key
+            )
+            self._store(
+                key,
+                s3_response["Body"].read()
+            )
+
+        return self.get_path(key)
+
+    def materialize(self, cached_path, target_path):
+        """
+        Copies a cached file to target_path, unless the file there was
+        already written from the same cache entry and hasn't changed since.
+        """
+        key = os.path.basename(cached_path)
+
+        try:
+            target_stat = os.stat(target_path)
+
+            if self.materialized.get(target_path) == (key, target_stat.st_size, target_stat.st_mtime):
+                return
+        except OSError:
+            pass
+
+        target_dir = os.path.dirname(target_path)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+
+        shutil.copyfile(
+            cached_path,
+            target_path
+        )
+
+        target_stat = os.stat(target_path)
+        self.materialized[target_path] = (
+            key,
+            target_stat.st_size,
+            target_stat.st_mtime
+        )
+
+    def forget_materialized(self, target_path):
+        self.materialized.pop(target_path, None)
+
+    def _load(self):
+        """
+        Picks up anything already in the cache directory, oldest first.
+        """
+        self.loaded = True
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+            return
+
+        cached_files = []
+        for file_name in os.listdir(self.cache_dir):
+            # Left behind by a write which didn't finish
+            if file_name.startswith("."):
+                os.remove(self.get_path(file_name))
+                continue
+
+            file_stat = os.stat(self.get_path(file_name))
+            cached_files.append(
+                (file_stat.st_atime, file_name, file_stat.st_size)
+            )
+
+        for access_time, file_name, size in sorted(cached_files):
+            self.entries[file_name] = size
+            self.total_bytes += size
+
+    def _lookup(self, key):
+        if not self.loaded:
+            self._load()
+
+        self.pinned.add(key)
+
+        if key not in self.entries or not os.path.exists(self.get_path(key)):
+            self.misses += 1
+            return False
+
+        # Move to the most recently used end
+        self.entries[key] = self.entries.pop(key)
+        self.hits += 1
+        return True
+
+    def _store(self, key, data):
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)
+
+        self._evict(len(data))
+
+        # The block could have removed it
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # Write then rename so a partially written file is never cached
+        temporary_path = self.get_path("." + str(uuid.uuid4()))
+        with open(temporary_path, "wb") as file_handler:
+            file_handler.write(data)
+        os.rename(temporary_path, self.get_path(key))
+
+        self.entries[key] = len(data)
+        self.total_bytes += len(data)
+
+    def _evict(self, incoming_bytes):
+        for key in list(self.entries.keys()):
+            if self.total_bytes + incoming_bytes <= self.max_bytes:
+                return
+
+            if key in self.pinned:
+                continue
+
+            self.total_bytes -= self.entries.pop(key)
+
+            try:
+                os.remove(self.get_path(key))
+            except OSError:
+                pass
@@ -13,44 +13,178 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-import datetime
+import ctypes
+import json
 import time
+import os
 
 
+"""
+Tracing is off unless RUNTIME_TRACING is set, in which case the spans of
+each invocation are attached to its pipeline logs (LOGS) or additionally
+printed as a CloudWatch embedded metric format line (EMF).
+"""
+_TRACING_MODE = os.getenv("RUNTIME_TRACING", "")
+_TRACING_ENABLED = _TRACING_MODE in ["LOGS", "EMF"]
+
+# Spans kept per invocation, anything past this is only counted
+_MAX_SPANS = 128
+
 """
 {
-	"action_name": {
-		"start": time.time(),
-		"end": time.time(),
-		"total": 0,
-	}
+	"action_name": {{MONOTONIC_START_SECONDS}}
 }
 """
-_CLOCK_TIMES = {}
+_OPEN_SPANS = {}
+
+"""
+[
+	{
+		"name": "Executing Lambda",
+		"start_ms": 12.418,
+		"duration_ms": 803.122
+	}
+]
+"""
+_SPANS = []
+_DROPPED_SPANS = 0
+_TRACE_START = 0
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_long),
+        ("tv_nsec", ctypes.c_long)
+    ]
+
+
+_CLOCK_MONOTONIC = 1
+_clock_gettime = None
+
+
+def _load_clock_gettime():
+    # Python 2.7 has no time.monotonic() so we go to libc for it
+    for library_name in [None, "librt.so.1"]:
+        try:
+            clock_gettime = ctypes.CDLL(
+                library_name,
+                use_errno=True
+            ).clock_gettime
+        except (OSError, AttributeError):
+            continue
+
+        clock_gettime.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(_timespec)
+        ]
+        return clock_gettime
+
+    return None
+
+
+def _monotonic():
+    timespec = _timespec()
+
+    if _clock_gettime is None or _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+        return time.time()
+
+    return timespec.tv_sec + (timespec.tv_nsec * 1e-9)
+
+
+if _TRACING_ENABLED:
+    _clock_gettime = _load_clock_gettime()
+
+
+def _reset_clock():
+    """
+    Called at the start of every invocation.
+    """
+    if not _TRACING_ENABLED:
+        return
+
+    global _OPEN_SPANS, _SPANS, _DROPPED_SPANS, _TRACE_START
+    _OPEN_SPANS = {}
+    _SPANS = []
+    _DROPPED_SPANS = 0
+    _TRACE_START = _monotonic()
 
 
 def _start_clock(action_name):
-    return
-    global _CLOCK_TIMES
-    _CLOCK_TIMES[action_name] = {
-        "start": datetime.datetime.now(),
-        "end": 0,
-        "total": 0,
-    }
+    if not _TRACING_ENABLED:
+        return
+
+    _OPEN_SPANS[action_name] = _monotonic()
 
 
 def _stop_clock(action_name):
-    return
-    global _CLOCK_TIMES
-    _CLOCK_TIMES[action_name]["end"] = datetime.datetime.now()
-    _CLOCK_TIMES[action_name]["total"] = (
-        (
-            time.mktime(_CLOCK_TIMES[action_name]["end"].timetuple(
-            ))*1e3 + _CLOCK_TIMES[action_name]["end"].microsecond/1e3
-        ) - (
-            time.mktime(_CLOCK_TIMES[action_name]["start"].timetuple(
-            ))*1e3 + _CLOCK_TIMES[action_name]["start"].microsecond/1e3
+    if not _TRACING_ENABLED:
+        return
+
+    start = _OPEN_SPANS.pop(action_name, None)
+
+    # Never started, or already stopped
+    if start is None:
+        return
+
+    global _DROPPED_SPANS
+    if len(_SPANS) >= _MAX_SPANS:
+        _DROPPED_SPANS += 1
+        return
+
+    _SPANS.append({
+        "name": action_name,
+        "start_ms": round((start - _TRACE_START) * 1000, 3),
+        "duration_ms": round((_monotonic() - start) * 1000, 3),
+    })
+
+
+def _get_trace():
+    """
+    Returns the spans finished so far in this invocation, or None if
+    tracing isn't enabled.
+    """
+    if not _TRACING_ENABLED:
+        return None
+
+    return {
+        "spans": list(_SPANS),
+        "dropped_spans": _DROPPED_SPANS,
+    }
+
+
+def _emit_trace_metrics(function_name):
+    """
+    Prints the invocation's spans as a CloudWatch embedded metric format
+    line, with one metric per phase under the Refinery/Runtime namespace.
+    """
+    if _TRACING_MODE != "EMF" or len(_SPANS) == 0:
+        return
+
+    phase_durations = {}
+    for span in _SPANS:
+        phase_durations.setdefault(span["name"], []).append(
+            span["duration_ms"]
         )
-    )
-    print("[ INFO ] The action '" + action_name + "' took " +
-          str((_CLOCK_TIMES[action_name]["total"] * 0.001)) + " second(s).")
+
+    metric_line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": "Refinery/Runtime",
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [
+                    {
+                        "Name": phase_name,
+                        "Unit": "Milliseconds"
+                    } for phase_name in phase_durations.keys()
+                ]
+            }]
+        },
+        "FunctionName": function_name,
+    }
+
+    # EMF takes at most 100 values per metric
+    for phase_name, durations in phase_durations.iteritems():
+        metric_line[phase_name] = durations[:100]
+
+    print(json.dumps(metric_line))
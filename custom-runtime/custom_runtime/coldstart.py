@@ -0,0 +1,241 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+
+Measures the cold start of the runtime: `bootstrap --measure-cold-start`
+starts a fresh interpreter, imports the runtime the way the bootstrap does
+and reports where the time went, module by module. Run it against a built
+layer (see build_custom_runtime.sh) before publishing it, with --budget-ms
+to fail when the imports got slower than they should be.
+"""
+
+import subprocess
+import argparse
+import json
+import time
+import sys
+import os
+
+
+# Modules which should only be imported once they're used
+_DEFERRED_MODULES = [
+    "boto3",
+    "botocore",
+    "redis",
+    "websocket",
+]
+
+# Runs in the fresh interpreter. Every import which loads new modules is
+# timed, minus the time of the imports nested inside of it, so the times
+# add up to the total.
+_MEASURE_SCRIPT = r"""
+import __builtin__
+import time
+import json
+import sys
+
+_original_import = __builtin__.__import__
+_import_stack = []
+_module_times = {}
+
+
+def _get_module_name(name, globals, level):
+    if level != 0 and globals and "__name__" in globals:
+        package = globals.get("__package__") or globals["__name__"]
+
+        if "__path__" not in globals and not globals.get("__package__"):
+            package = package.rpartition(".")[0]
+
+        # Python 2 tries implicit relative imports first, leaving None
+        # in sys.modules when they're not found
+        if package and sys.modules.get(package + "." + name) is not None:
+            return package + "." + name
+
+        if not name:
+            return package
+
+    return name
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    module_count = len(sys.modules)
+    start_time = time.time()
+    _import_stack.append(0.0)
+
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed_seconds = time.time() - start_time
+        nested_seconds = _import_stack.pop()
+
+        # Imports of already loaded modules count towards their importer
+        if len(sys.modules) != module_count:
+            module_name = _get_module_name(name, globals, level)
+            _module_times[module_name] = _module_times.get(module_name, 0.0) + elapsed_seconds - nested_seconds
+
+            if _import_stack:
+                _import_stack[-1] += elapsed_seconds
+
+
+__builtin__.__import__ = _timed_import
+
+start_time = time.time()
+import custom_runtime.base
+import_seconds = time.time() - start_time
+
+__builtin__.__import__ = _original_import
+
+sys.stdout.write(json.dumps({
+    "import_ms": import_seconds * 1000,
+    "modules": dict([
+        (module_name, module_seconds * 1000)
+        for module_name, module_seconds in _module_times.items()
+    ]),
+    "loaded": sorted(set([
+        module_name.split(".")[0] for module_name in sys.modules
+    ])),
+}))
+"""
+
+
+def _get_runtime_root():
+    # The directory holding the custom_runtime package (and the bootstrap)
+    return os.path.dirname(
+        os.path.dirname(
+            os.path.realpath(__file__)
+        )
+    )
+
+
+def _run_fresh_interpreter():
+    environment = dict(os.environ)
+
+    # The runtime reads these at import time, nothing connects to them
+    environment.setdefault("REDIS_HOSTNAME", "localhost")
+    environment.setdefault("REDIS_PASSWORD", "")
+    environment.setdefault("REDIS_PORT", "6379")
+
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [_get_runtime_root()] + [
+            path for path in environment.get("PYTHONPATH", "").split(os.pathsep) if path
+        ]
+    )
+
+    start_time = time.time()
+
+    # -B, the layer is read-only in Lambda so bytecode is never written
+    # there: only what was precompiled into it is used.
+    process_handler = subprocess.Popen(
+        [
+            sys.executable,
+            "-B",
+            "-c",
+            _MEASURE_SCRIPT
+        ],
+        stdout=subprocess.PIPE,
+        env=environment,
+        cwd=_get_runtime_root()
+    )
+    output = process_handler.communicate()[0]
+
+    if process_handler.returncode != 0:
+        raise Exception("The runtime failed to import, exit code " + str(process_handler.returncode))
+
+    measurement = json.loads(output)
+    measurement["process_ms"] = (time.time() - start_time) * 1000
+    return measurement
+
+
+def _get_package_times(module_times):
+    """
+    Module times rolled up by top level package, slowest first.
+    """
+    package_times = {}
+
+    for module_name, module_ms in module_times.items():
+        package_name = module_name.split(".")[0]
+        package_times[package_name] = package_times.get(package_name, 0.0) + module_ms
+
+    return sorted(
+        package_times.items(),
+        key=lambda package_time: package_time[1],
+        reverse=True
+    )
+
+
+def measure_cold_start(argv):
+    parser = argparse.ArgumentParser(
+        prog="bootstrap --measure-cold-start",
+        description="Measures the imports of the runtime in a fresh interpreter")
+    parser.add_argument("--measure-cold-start", action="store_true")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Fresh interpreters to start, the median run is reported")
+    parser.add_argument("--top", type=int, default=15,
+                        help="Number of packages and modules to list")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Exit with an error if importing the runtime takes longer than this")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    measurements = sorted(
+        [_run_fresh_interpreter() for i in range(0, max(1, args.runs))],
+        key=lambda measurement: measurement["import_ms"]
+    )
+    measurement = measurements[len(measurements) // 2]
+
+    eagerly_imported = [
+        module_name for module_name in _DEFERRED_MODULES
+        if module_name in measurement["loaded"]
+    ]
+
+    over_budget = args.budget_ms is not None and measurement["import_ms"] > args.budget_ms
+
+    if args.json:
+        print(json.dumps({
+            "process_ms": round(measurement["process_ms"], 2),
+            "import_ms": round(measurement["import_ms"], 2),
+            "packages": [
+                {"package": package_name, "ms": round(package_ms, 2)}
+                for package_name, package_ms in _get_package_times(measurement["modules"])
+            ],
+            "eagerly_imported": eagerly_imported,
+            "budget_ms": args.budget_ms,
+            "over_budget": over_budget,
+        }, indent=4, sort_keys=True))
+    else:
+        print("Cold start (median of " + str(len(measurements)) + " run(s)): " +
+              str(round(measurement["process_ms"], 1)) + "ms for the interpreter, " +
+              str(round(measurement["import_ms"], 1)) + "ms importing the runtime")
+
+        print("\nBy package:")
+        for package_name, package_ms in _get_package_times(measurement["modules"])[:args.top]:
+            print("  %-30s %8.1fms" % (package_name, package_ms))
+
+        print("\nSlowest modules:")
+        slowest_modules = sorted(
+            measurement["modules"].items(),
+            key=lambda module_time: module_time[1],
+            reverse=True
+        )
+        for module_name, module_ms in slowest_modules[:args.top]:
+            print("  %-50s %8.1fms" % (module_name, module_ms))
+
+        if eagerly_imported:
+            print("\nImported at startup but should be deferred until used: " + ", ".join(eagerly_imported))
+
+        if over_budget:
+            print("\nOver the budget of " + str(args.budget_ms) + "ms!")
+
+    if eagerly_imported or over_budget:
+        return 1
+
+    return 0
@@ -13,15 +13,18 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-import boto3
 import urllib3
+import uuid
 
 
 from os import environ
 from os.path import dirname, realpath, join
 
 
-from .memory import RefineryMemory
+from .memory import RefineryMemory, PayloadCodec
+from .invoker import InvocationEngine, LazyClient
+from .logs import PipelineLogWriter
+from .cache import FileCache
 
 
 # For requests to AWS custom runtime API
@@ -30,6 +33,9 @@ http = urllib3.PoolManager()
 
 _VERSION = "1.0.0"
 
+# Identifies this container, e.g. to count the containers a warmup reached
+CONTAINER_ID = str(uuid.uuid4())
+
 RUNTIME_DIR = join(dirname(dirname(realpath(__file__))), "runtime")
 
 # Make global to enable caching of redis connection
@@ -37,9 +43,51 @@ gmemory = RefineryMemory(
     environ["REDIS_HOSTNAME"],
     environ["REDIS_PASSWORD"],
     environ["REDIS_PORT"],
+    codec=PayloadCodec(
+        compression_threshold=int(
+            environ.get("REDIS_COMPRESSION_THRESHOLD", 1024 * 4)
+        ),
+        use_msgpack=(environ.get("REDIS_PAYLOAD_FRAMING") == "msgpack"),
+    ),
+    unix_socket_path=environ.get("REDIS_UNIX_SOCKET_PATH"),
+    use_tls=(environ.get("REDIS_TLS") == "True"),
 )
 
+# Worker pool and shared AWS clients for all outgoing invocations,
+# kept alive for as long as the container stays warm.
+INVOCATION_ENGINE = InvocationEngine(
+    max_workers=50
+)
 
-S3_CLIENT = boto3.client(
+# Built on first use, importing boto3 and building a client is a
+# large part of a cold start and a lot of blocks never touch S3.
+S3_CLIENT = LazyClient(
+    INVOCATION_ENGINE,
     "s3"
 )
+
+# Pipeline logs are uploaded in the background with the shared S3 client
+PIPELINE_LOG_WRITER = PipelineLogWriter(
+    S3_CLIENT,
+    coalesce=(environ.get("PIPELINE_LOG_COALESCING") == "True"),
+)
+
+# Inline code, shared files and binaries for inline executions, kept
+# for as long as the container stays warm.
+INLINE_FILE_CACHE = FileCache(
+    "/tmp/.refinery_cache",
+    max_bytes=int(
+        environ.get("INLINE_FILE_CACHE_MAX_BYTES", 1024 * 1024 * 256)
+    )
+)
+
+SHARED_FILES_DIR = "/tmp/shared_files/"
+
+# How long queue inserts should take, this sets the number of SQS workers
+SQS_INSERT_TARGET_SECONDS = int(
+    environ.get("SQS_INSERT_TARGET_SECONDS", 60)
+)
+
+SQS_MAX_WORKERS = int(
+    environ.get("SQS_MAX_WORKERS", 20)
+)
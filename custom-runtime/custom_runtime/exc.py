@@ -24,3 +24,9 @@ class InvokeQueueEmptyException(Exception):
     def __init__(self, message="We've exhausted all of the invocations we have to do!"):
         # Call the base class constructor with the parameters it needs
         super(InvokeQueueEmptyException, self).__init__(message)
+
+
+class ResponseTimeoutException(Exception):
+    def __init__(self, message="No HTTP response was returned before the request timed out!"):
+        # Call the base class constructor with the parameters it needs
+        super(ResponseTimeoutException, self).__init__(message)
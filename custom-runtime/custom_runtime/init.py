@@ -13,10 +13,8 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-from websocket import create_connection
 import subprocess
 import traceback
-import boto3
 import time
 import json
 import uuid
@@ -25,17 +23,23 @@ import sys
 import os
 
 
-from .constants import gmemory, _VERSION, RUNTIME_DIR
+from .constants import gmemory, _VERSION, RUNTIME_DIR, INLINE_FILE_CACHE
 from .clock import _start_clock, _stop_clock
 from .exc import AlreadyInvokedException
+from .output import OutputDemultiplexer
+from .live_debug import LiveDebugStreamer
+from .payload import TransitionPayload
 from .parallel_invoke import _parallel_invoke
+from .rate import get_default_invoke_rate
 from .sqs import _sqs_worker
+from .worker import supports_warm_worker, get_warm_worker
+from .worker import WorkerTimeoutException, WorkerCrashedException
 from .utils import _setup_inline_execution_shared_files, _write_pipeline_logs
 from .utils import _api_endpoint, _write_inline_code, _write_s3_binary
-from .utils import _warmup_concurrency_self_invoke, _spawner
-from .utils import _stream_execution_output_to_websocket, _clear_temporary_files
+from .utils import _warmup_concurrency_tree, _spawner
+from .utils import _get_live_debug_line_handler, _clear_temporary_files
 from .utils import _transition_type_in_transitions, _write_temporary_execution_results
-from .utils import _improve_api_endpoint_request_data
+from .utils import _improve_api_endpoint_request_data, _get_fan_out_invocations
 
 
 def _init(custom_runtime, request_id, lambda_input, context, execution_details):
@@ -49,16 +53,6 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
     s3_log_bucket = os.environ["LOG_BUCKET_NAME"]
     execution_pipeline_logging_level = os.environ["PIPELINE_LOGGING_LEVEL"]
 
-    # If pipeline logging is enabled
-    # We initialize the S3 client to prevent threading bugs
-    if execution_pipeline_logging_level != "LOG_NONE":
-        _start_clock("S3 Boto Client Initialization")
-        # Bug fix test
-        s3_client = boto3.client(
-            "s3"
-        )
-        _stop_clock("S3 Boto Client Initialization")
-
     # Indicate a special execution condition
     # For example, an API Gateway Lambda
     execution_mode = os.environ["EXECUTION_MODE"]
@@ -195,17 +189,20 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                     "base_code": lambda_input["_refinery"]["inline_code"]["base_code"]
                 }
 
-            # Set up files for inline execution, returns executable path
+            # Cache hits and misses are reported per invocation
+            INLINE_FILE_CACHE.start_invocation()
+
+            # Set up files for inline execution
             _setup_inline_execution_shared_files(
                 lambda_input["_refinery"]["inline_code"]["shared_files"]
             )
 
-            # Base code path
+            # Base code path, the code is written to (or already
+            # in) the inline file cache and run from there.
             executable_path = "/tmp/" + str(uuid.uuid4())
             if "base_code" in lambda_input["_refinery"]["inline_code"]:
-                _write_inline_code(
-                    lambda_input["_refinery"]["inline_code"]["base_code"],
-                    executable_path
+                executable_path = _write_inline_code(
+                    lambda_input["_refinery"]["inline_code"]["base_code"]
                 )
 
             # Pull in a remote file and execute it. This is used for things like
@@ -213,15 +210,20 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             # the binary in as input would exceed the max size we pass the S3 path
             # in and then pull it down at runtime.
             if "s3_path" in lambda_input["_refinery"]["inline_code"]:
-                # Write binary to disk
-                _write_s3_binary(
-                    lambda_input["_refinery"]["inline_code"]["s3_path"],
-                    executable_path
+                # Write binary to disk (if it isn't cached already)
+                executable_path = _write_s3_binary(
+                    lambda_input["_refinery"]["inline_code"]["s3_path"]
                 )
 
                 # Mark as executable
                 os.chmod(executable_path, 0o775)
 
+            inline_file_cache_stats = INLINE_FILE_CACHE.get_stats()
+            print(
+                "[ INFO ] Inline file cache: " + str(inline_file_cache_stats["hits"]) +
+                " hit(s), " + str(inline_file_cache_stats["misses"]) + " miss(es)."
+            )
+
         """
 		For doing live debugging/streaming of the Lambda execution.
 
@@ -234,24 +236,35 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
 		}
 		"""
         if "live_debug" in lambda_input["_refinery"]:
+            from websocket import create_connection
+
             live_debug = lambda_input["_refinery"]["live_debug"]
             live_debug["websocket"] = create_connection(
                 live_debug["websocket_uri"]
             )
 
+            # Output is coalesced and sent from a background thread so
+            # the block never waits on the WebSocket.
+            live_debug["streamer"] = LiveDebugStreamer(
+                live_debug["websocket"],
+                live_debug["debug_id"]
+            )
+            live_debug["streamer"].start()
+
         # Check if it's just a warmup request
         if "warmup" in lambda_input["_refinery"]:
-            decrement_counter = lambda_input["_refinery"]["warmup"]
-            _warmup_concurrency_self_invoke(
+            warmup_result = _warmup_concurrency_tree(
                 context.invoked_function_arn,
-                decrement_counter
+                int(lambda_input["_refinery"]["warmup"])
             )
-            print("Lambda warming event received, quitting out.")
+            print("Lambda warming event received, " + str(warmup_result["warmed"]) + " of " +
+                  str(warmup_result["requested"]) + " container(s) warmed, quitting out.")
             sys.stdout.flush()
 
+            # Parents (and the deployment) count the containers which warmed
             custom_runtime.send_response(
                 request_id,
-                ""
+                warmup_result
             )
             return
 
@@ -317,6 +330,22 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                     )
                     return
                 _side_loaded = True
+            # Input data is stored in redis for every subscriber of an SNS topic
+            elif lambda_input["_refinery"]["indirect"]["type"] == "redis_shared":
+                try:
+                    stored_input = gmemory._get_shared_input_data(
+                        lambda_input["_refinery"]["indirect"]["key"]
+                    )
+                    lambda_input = stored_input["input_data"]
+                    backpack = stored_input["backpack"]
+                except AlreadyInvokedException as e:
+                    print("The input data for this Lambda has expired. For this reason we are quitting out (shared indirect return data).")
+                    custom_runtime.send_response(
+                        request_id,
+                        ""
+                    )
+                    return
+                _side_loaded = True
             # Input data is stored in redis as a list from a fan-in
             elif lambda_input["_refinery"]["indirect"]["type"] == "redis_fan_in":
                 try:
@@ -336,11 +365,13 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
 
         # If there's an "invoke" key it means we're doing a self-invocation fan-out
         if is_spawner_invocation:
+            _start_clock("Fan-out Spawner")
             _spawner(
                 branch_ids,
                 invocation_id,
                 context
             )
+            _stop_clock("Fan-out Spawner")
             custom_runtime.send_response(
                 request_id,
                 ""
@@ -372,68 +403,107 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
 
         print(RUNTIME_DIR, executable_path)
 
-        process_handler = subprocess.Popen(
-            [
-                RUNTIME_DIR,
-                executable_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            stdin=subprocess.PIPE,
-            shell=False,
-            universal_newlines=True,
-            cwd=os.getenv("LAMBDA_TASK_ROOT") + "/",
+        # Warm workers are opt-in, and aren't used for live debugging
+        # (output is only returned at the end) or inline executions
+        # (the code changes from run to run).
+        use_warm_worker = (
+            os.getenv("WARM_WORKER_MODE", False) == "True" and
+            not live_debug and
+            not is_inline_execution and
+            supports_warm_worker(executable_path)
         )
 
-        # Write input data
-        process_handler.stdin.write(json.dumps({
-            "lambda_input": lambda_input,
-            "backpack": backpack
-        }))
-        process_handler.stdin.close()
-
-        return_data = ""
-
-        for line in iter(process_handler.stdout.readline, ""):
-            # If we're live streaming the output data, then pump it into
-            # the WebSocket connection
-            if live_debug and not line.startswith("<REFINERY_"):
-                _stream_execution_output_to_websocket(
-                    live_debug["websocket"],
-                    live_debug["debug_id"],
-                    line
-                )
+        # Splits the program output from the returned/error payloads as
+        # the output comes in, pumping program output lines into the
+        # WebSocket connection if we're live streaming.
+        output_demultiplexer = OutputDemultiplexer(
+            on_program_output_line=_get_live_debug_line_handler(live_debug)
+        )
 
-            return_data += line
+        if use_warm_worker:
+            warm_worker = get_warm_worker(
+                RUNTIME_DIR,
+                executable_path,
+                os.getenv("LAMBDA_TASK_ROOT") + "/"
+            )
+
+            # Leave ourselves a second to log and do transitions
+            worker_timeout_seconds = max(
+                1,
+                (context.get_remaining_time_in_millis() / 1000.0) - 1
+            )
+
+            try:
+                worker_response = warm_worker.invoke(
+                    lambda_input,
+                    backpack,
+                    worker_timeout_seconds
+                )
+                output_demultiplexer.feed(
+                    worker_response["output"].encode("utf8")
+                )
+                process_returncode = worker_response["exit_code"]
+            except (WorkerTimeoutException, WorkerCrashedException) as e:
+                output_demultiplexer.feed(str(e))
+                process_returncode = -1
 
-        while process_handler.returncode is None:
-            process_handler.poll()
+            output_demultiplexer.close()
+        else:
+            _start_clock("Starting Block Process")
+            process_handler = subprocess.Popen(
+                [
+                    RUNTIME_DIR,
+                    executable_path
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.PIPE,
+                shell=False,
+                cwd=os.getenv("LAMBDA_TASK_ROOT") + "/",
+            )
 
-        return_data = return_data.strip()
+            # Write input data
+            process_handler.stdin.write(json.dumps({
+                "lambda_input": lambda_input,
+                "backpack": backpack
+            }))
+            process_handler.stdin.close()
+            _stop_clock("Starting Block Process")
+
+            # Reads until EOF, then we block (without spinning) on the exit
+            output_demultiplexer.read_from_fd(
+                process_handler.stdout.fileno()
+            )
+            process_returncode = process_handler.wait()
 
-        # Close the WebSocket connection now that we're finished
+        # Send what's left and close the WebSocket now that we're finished
         if live_debug:
-            live_debug["websocket"].close()
+            live_debug["streamer"].close()
+
+            live_debug_stats = live_debug["streamer"].get_stats()
+            print(
+                "[ INFO ] Live debug: " + str(live_debug_stats["lines"]) + " line(s) in " +
+                str(live_debug_stats["frames"]) + " frame(s), " + str(live_debug_stats["elided"]) +
+                " line(s) elided."
+            )
 
-        # If it's an inline execution we need to delete the file we just
-        # executed so that it doesn't fill up the disk each run.
+        # If it's an inline execution we need to clean up whatever the
+        # block left in /tmp so that it doesn't fill up the disk each run.
+        # The inline file cache is capped and kept.
         if is_inline_execution:
             _clear_temporary_files()
 
         _stop_clock("Executing Lambda")
 
-        if process_handler.returncode == 0:
-            # We now look for the markers to indicate data is being returned.
-            start_marker = "<REFINERY_OUTPUT_CUSTOM_RUNTIME_START_MARKER>"
-            end_marker = "<REFINERY_OUTPUT_CUSTOM_RUNTIME_END_MARKER>"
+        if process_returncode == 0:
             program_output = ""
 
-            # If we have the marker, pull it out.
-            if start_marker in return_data and end_marker in return_data:
-                return_data_parts = return_data.split(start_marker)
-                program_output = return_data_parts[0]
-                return_data_sub_parts = return_data_parts[1].split(end_marker)
-                return_data_string = return_data_sub_parts[0]
+            # If we have the markers, the demultiplexer pulled the
+            # returned data out.
+            if output_demultiplexer.has_return_payload():
+                program_output = output_demultiplexer.program_output.getvalue().lstrip()
+                return_data_string = output_demultiplexer.return_payload.getvalue()
+                output_demultiplexer.cleanup()
                 try:
                     return_data = json.loads(
                         return_data_string
@@ -448,26 +518,23 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                 sys.stdout.flush()
             else:
                 # Write the output for logging
-                sys.stdout.write(return_data)
+                output_demultiplexer.program_output.write_to(sys.stdout)
                 sys.stdout.flush()
+                output_demultiplexer.cleanup()
                 # If there's no marker we're not returning anything.
                 # Just return nothing
                 return_data = ""
         else:
-            error_output = return_data
-
-            error_start_marker = "<REFINERY_ERROR_OUTPUT_CUSTOM_RUNTIME_START_MARKER>"
-            error_end_marker = "<REFINERY_ERROR_OUTPUT_CUSTOM_RUNTIME_END_MARKER>"
+            error_output = output_demultiplexer.program_output.getvalue().lstrip()
 
-            if error_start_marker in str(error_output) and error_end_marker in str(error_output):
-                exception_parts = error_output.split(error_start_marker)
-                error_output = exception_parts[0]
-                exception_data_sub_parts = exception_parts[1].split(
-                    error_end_marker)
-                exception_string = exception_data_sub_parts[0]
+            if output_demultiplexer.has_error_payload():
+                exception_string = output_demultiplexer.error_payload.getvalue()
             else:
+                error_output = error_output.rstrip()
                 exception_string = ""
 
+            output_demultiplexer.cleanup()
+
             try:
                 output_data = json.loads(
                     exception_string
@@ -501,6 +568,13 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                         ""
                     )
 
+                # Encoded once, shared by every exception transition
+                exception_payload = TransitionPayload({
+                    "version": _VERSION,
+                    "exception_text": exception_string,
+                    "input_data": lambda_input
+                }, backpack)
+
                 for exception_transition_data in transitions["exception"]:
                     invocation_input_list.append({
                         "execution_id": execution_id,
@@ -508,15 +582,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                         "type": exception_transition_data["type"],
                         "arn": exception_transition_data["arn"],
                         "backpack": backpack,
-                        "input_data": {
-                            "version": _VERSION,
-                            "exception_text": exception_string,
-                            "input_data": json.loads(
-                                json.dumps(
-                                    lambda_input
-                                )
-                            )
-                        }
+                        "input_data": exception_payload.input_data,
+                        "payload": exception_payload
                     })
             elif execution_pipeline_logging_level == "LOG_ERRORS" or execution_pipeline_logging_level == "LOG_ALL":
                 _write_pipeline_logs(
@@ -575,6 +642,9 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                     }
                 }
 
+                if is_inline_execution:
+                    return_data["_refinery"]["inline_file_cache"] = INLINE_FILE_CACHE.get_stats()
+
             # We only want to do this if we've been asked to fully throw exceptions
             if throw_exceptions_fully:
                 custom_runtime.send_error(
@@ -621,6 +691,9 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             }
         }
 
+        if is_inline_execution:
+            return_data["_refinery"]["inline_file_cache"] = INLINE_FILE_CACHE.get_stats()
+
         custom_runtime.send_response(
             request_id,
             return_data
@@ -674,32 +747,24 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             fan_out_id
         )
 
-        # Create a list of invocation inputs
-        invocation_list = []
-
-        # Iterate over each item in the return list
-        for return_item_data in return_data:
-            # Create an invocation for it
-            # Convert into JSON so it can be stored in redis
-            invocation_list.append(
-                json.dumps({
-                    "backpack": backpack,
-                    "execution_id": execution_id,
-                    "fan_out_ids": new_fan_out_ids,
-                    "type": "fan_out_execution",
-                            "arn": fan_out_transition_data["arn"],
-                            "input_data": json.loads(
-                                json.dumps(
-                                    return_item_data
-                                )
-                            )
-                })
-            )
-
-        # Sets up atomic counter for fan-in
+        # Sets up atomic counter for fan-in, the invocation inputs
+        # are generated as they're pushed to redis.
         invocation_id = gmemory._set_fan_in_data(
             fan_out_id,
-            invocation_list
+            _get_fan_out_invocations(
+                return_data,
+                backpack,
+                execution_id,
+                new_fan_out_ids,
+                fan_out_transition_data["arn"]
+            )
+        )
+
+        print(
+            "[ INFO ] Fan-out queued " + str(gmemory.fan_out_stats["items"]) +
+            " invocation(s) in " + str(gmemory.fan_out_stats["chunks"]) +
+            " chunk(s), peak of " + str(gmemory.fan_out_stats["peak_buffered_bytes"]) +
+            " bytes buffered."
         )
 
         """
@@ -708,7 +773,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
 
 		There are three factors for this:
 		* Remaining execution time (to invoke the spawners).
-		* Execution memory (affects how invocating can be done)
+		* Invoke rate of a spawner (learned by previous fan-outs,
+		  estimated from the execution memory otherwise)
 		* Number of invocations to perform
 
 		The remaining execution time is used as the ceiling
@@ -723,22 +789,27 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             )
         )
 
-        # Conservative estimates of how many lambdas can
-        # be executed per second for each memory range.
-        # These are pretty low balls but better safe than sorry!
-        if int(context.memory_limit_in_mb) <= 256:
-            lambdas_per_second = 2
-        elif int(context.memory_limit_in_mb) <= 576:
-            lambdas_per_second = 10
-        elif int(context.memory_limit_in_mb) > 576:
-            lambdas_per_second = 13
+        # Use the per-spawner invoke rate learned by the last fan-out
+        # of this function. If there isn't one we fall back to conservative
+        # estimates of how many lambdas can be executed per second for
+        # each memory range.
+        learned_invoke_rate = gmemory._get_fan_out_rate(
+            context.invoked_function_arn
+        )
+
+        if learned_invoke_rate == None:
+            lambdas_per_second = get_default_invoke_rate(
+                context.memory_limit_in_mb
+            )
+        else:
+            lambdas_per_second = max(1, int(learned_invoke_rate))
 
         # Calculate max number of Lambdas we //could// execute
         max_lambda_invocations_possible = (
             lambdas_per_second * remaining_seconds)
 
         # Number of invocations we actually have to execute
-        number_of_executions_to_perform = len(invocation_list)
+        number_of_executions_to_perform = len(return_data)
 
         # Number of invocations a fresh-started Lambda could do
         # Minus one for the initialization cost that may be incurred
@@ -839,6 +910,13 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                 "fan_out_id": fan_out_id
             })
 
+    # The return data and backpack are encoded once here and shared
+    # by every transition, however many of them there are.
+    transition_payload = TransitionPayload(
+        return_data,
+        backpack
+    )
+
     # If it's just a then, just invoke the next Lambda
     for then_transition_data in transitions["then"]:
         invocation_input_list.append({
@@ -848,11 +926,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             "type": then_transition_data["type"],
             "arn": then_transition_data["arn"],
             "context": context,
-            "input_data": json.loads(
-                json.dumps(
-                    return_data
-                )
-            )
+            "input_data": return_data,
+            "payload": transition_payload
         })
 
     # For merge transitions
@@ -865,11 +940,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
             "fan_out_ids": fan_out_ids,
             "type": "merge",
             "arn": merge_transition_data["arn"],
-            "input_data": json.loads(
-                json.dumps(
-                    return_data
-                )
-            )
+            "input_data": return_data,
+            "payload": transition_payload
         })
 
     # If it's an API gateway Lambda we can end it here.
@@ -928,11 +1000,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                 "type": if_statement_data["type"],
                 "arn": if_statement_data["arn"],
                 "context": context,
-                "input_data": json.loads(
-                    json.dumps(
-                        return_data
-                    )
-                )
+                "input_data": return_data,
+                "payload": transition_payload
             })
 
             true_if_evaluation_occured = True
@@ -946,11 +1015,8 @@ def _init(custom_runtime, request_id, lambda_input, context, execution_details):
                 "fan_out_ids": fan_out_ids,
                 "type": else_transition_data["type"],
                 "arn": else_transition_data["arn"],
-                "input_data": json.loads(
-                    json.dumps(
-                        return_data
-                    )
-                )
+                "input_data": return_data,
+                "payload": transition_payload
             })
 
     # Now we invoke all the queued Lambdas!
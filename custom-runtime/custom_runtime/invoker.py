@@ -0,0 +1,166 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import traceback
+import threading
+import Queue
+import sys
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _run_job(handler, args):
+    try:
+        return handler(*args)
+    except Exception:
+        # Keep the old behavior of uncaught thread exceptions: the
+        # traceback ends up in the logs but the invocation carries on.
+        sys.stderr.write(traceback.format_exc())
+        sys.stderr.flush()
+        raise
+
+
+class InvocationEngine:
+    """
+    A long-lived pool of invocation workers which is shared by every
+    invocation a warm container processes.
+
+    Previously every transition spun up a brand new thread which built
+    its own boto3 client (and a sleep wedge was needed to work around
+    https://github.com/boto/botocore/issues/1246). Now the worker threads
+    stay alive between invocations and each AWS client is built exactly
+    once, under a lock, and then shared. boto3 clients are thread-safe
+    after construction so this is all we need.
+
+    Jobs are submitted through a CompletionQueue, see completion_queue().
+    """
+
+    def __init__(self, max_workers=50):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers
+        )
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+    def get_client(self, service_name):
+        client = self.clients.get(service_name)
+
+        if client is not None:
+            return client
+
+        with self.clients_lock:
+            if service_name not in self.clients:
+                # boto3 is only imported once a client is needed, it's
+                # the slowest import of a cold start.
+                import boto3
+                from botocore.config import Config
+
+                self.clients[service_name] = boto3.client(
+                    service_name,
+                    # One pooled connection per worker thread
+                    config=Config(
+                        max_pool_connections=self.max_workers
+                    )
+                )
+
+            return self.clients[service_name]
+
+    def completion_queue(self, max_pending=None):
+        return CompletionQueue(
+            self,
+            max_pending
+        )
+
+
+class LazyClient:
+    """
+    Stands in for engine.get_client(service_name), the client is only
+    built when one of its methods is first used.
+    """
+
+    def __init__(self, engine, service_name):
+        self.engine = engine
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(
+            self.engine.get_client(self.service_name),
+            name
+        )
+
+
+class CompletionQueue:
+    """
+    Tracks a batch of jobs submitted to the InvocationEngine and hands
+    back their futures in the order they complete.
+
+    If max_pending is set then submit() blocks (reaping finished jobs)
+    once that many jobs are in flight, which keeps a producer from
+    queueing up more work than the pool can keep up with.
+    """
+
+    def __init__(self, engine, max_pending=None):
+        self.engine = engine
+        self.max_pending = max_pending
+        self.completed = Queue.Queue()
+        self.pending = 0
+        self.failures = 0
+
+    def submit(self, handler, *args):
+        while self.max_pending and self.pending >= self.max_pending:
+            self.get()
+
+        future = self.engine.executor.submit(
+            _run_job,
+            handler,
+            args
+        )
+        self.pending += 1
+        future.add_done_callback(
+            self.completed.put
+        )
+
+        return future
+
+    def get(self, timeout=None):
+        """
+        Blocks until the next job finishes and returns its future.
+        """
+        future = self.completed.get(
+            True,
+            timeout
+        )
+        self.pending -= 1
+
+        if future.exception() is not None:
+            self.failures += 1
+
+        return future
+
+    def __iter__(self):
+        while self.pending > 0:
+            yield self.get()
+
+    def join(self):
+        """
+        Waits for every submitted job to finish.
+
+        Returns the number of jobs which raised an exception.
+        """
+        for future in self:
+            pass
+
+        return self.failures
@@ -0,0 +1,197 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import collections
+import threading
+import json
+import time
+
+
+# Lines are held for at most this long before they're sent
+_FLUSH_INTERVAL_SECONDS = 0.05
+
+# A frame is sent early once this much output has built up
+_MAX_FRAME_BYTES = (1024 * 32)
+
+# Output buffered while the WebSocket is behind, past this lines are elided
+_MAX_BUFFERED_BYTES = (1024 * 1024)
+
+# How long close() waits for buffered output to be sent
+_CLOSE_TIMEOUT_SECONDS = 2.0
+
+
+def _stream_execution_output_to_websocket(websocket, debug_id, output):
+    websocket.send(json.dumps({
+        "version": "1.0.0",
+        "debug_id": debug_id,
+        "action": "OUTPUT",
+        "source": "LAMBDA",
+        "body": output,
+        "timestamp": int(time.time())
+    }))
+
+
+def _get_elided_marker(line_count):
+    return "[ " + str(line_count) + " line(s) elided, live output could not keep up ]\n"
+
+
+class LiveDebugStreamer:
+    """
+    Streams program output lines to the live debugging WebSocket from a
+    background thread, so a block which prints a lot is never held up by
+    WebSocket round trips.
+
+    Lines are coalesced into OUTPUT frames, one frame per flush interval
+    (or sooner, once max_frame_bytes has built up). The front end appends
+    each frame's body to the output, so a frame of several lines looks the
+    same as several frames of one line. If the WebSocket falls behind by
+    more than max_buffered_bytes, new lines are dropped and an
+    "N line(s) elided" marker is sent in their place.
+    """
+
+    def __init__(self, websocket, debug_id, flush_interval=_FLUSH_INTERVAL_SECONDS,
+                 max_frame_bytes=_MAX_FRAME_BYTES, max_buffered_bytes=_MAX_BUFFERED_BYTES):
+        self.websocket = websocket
+        self.debug_id = debug_id
+        self.flush_interval = flush_interval
+        self.max_frame_bytes = max_frame_bytes
+        self.max_buffered_bytes = max_buffered_bytes
+
+        # Lines waiting to be sent, or the number of lines which were
+        # elided at that point in the output.
+        self.entries = collections.deque()
+        self.buffered_bytes = 0
+
+        self.closing = False
+        self.failed = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(
+            target=self._run
+        )
+        self.thread.daemon = True
+
+        self.lines_sent = 0
+        self.lines_elided = 0
+        self.frames_sent = 0
+
+    def start(self):
+        self.thread.start()
+
+    def get_stats(self):
+        return {
+            "lines": self.lines_sent,
+            "elided": self.lines_elided,
+            "frames": self.frames_sent,
+        }
+
+    def write_line(self, line):
+        """
+        Queues a line to be sent, never blocks on the WebSocket.
+        """
+        with self.condition:
+            if self.closing or self.failed:
+                return
+
+            if self.buffered_bytes + len(line) > self.max_buffered_bytes:
+                self.lines_elided += 1
+
+                if self.entries and isinstance(self.entries[-1], int):
+                    self.entries[-1] += 1
+                else:
+                    self.entries.append(1)
+                return
+
+            self.entries.append(line)
+            self.buffered_bytes += len(line)
+
+            if self.buffered_bytes >= self.max_frame_bytes:
+                self.condition.notify()
+
+    def close(self, timeout=_CLOSE_TIMEOUT_SECONDS):
+        """
+        Sends whatever is still buffered (waiting up to timeout seconds)
+        and closes the WebSocket.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+        self.websocket.close()
+
+    def _get_next_frame(self):
+        """
+        Waits for output and returns the body of the next frame, or None
+        once we're closing and everything has been sent.
+        """
+        with self.condition:
+            while not self.entries and not self.closing:
+                self.condition.wait()
+
+            # Give the rest of the frame a chance to arrive
+            flush_time = time.time() + self.flush_interval
+            while not self.closing and self.buffered_bytes < self.max_frame_bytes:
+                remaining_seconds = flush_time - time.time()
+
+                if remaining_seconds <= 0:
+                    break
+
+                self.condition.wait(remaining_seconds)
+
+            if not self.entries:
+                return None
+
+            frame_lines = []
+            frame_bytes = 0
+
+            while self.entries and (not frame_lines or frame_bytes < self.max_frame_bytes):
+                entry = self.entries.popleft()
+
+                if isinstance(entry, int):
+                    frame_lines.append(_get_elided_marker(entry))
+                    continue
+
+                self.buffered_bytes -= len(entry)
+                self.lines_sent += 1
+                frame_lines.append(entry)
+                frame_bytes += len(entry)
+
+            return "".join(frame_lines)
+
+    def _run(self):
+        while True:
+            frame_body = self._get_next_frame()
+
+            if frame_body is None:
+                return
+
+            try:
+                _stream_execution_output_to_websocket(
+                    self.websocket,
+                    self.debug_id,
+                    frame_body
+                )
+                self.frames_sent += 1
+            except Exception as e:
+                # The block keeps running, there's just no one to stream to
+                print("[ WARNING ] Live debug output stopped, WebSocket send failed: " + repr(e))
+
+                with self.condition:
+                    self.failed = True
+                    self.entries.clear()
+                    self.buffered_bytes = 0
+                return
@@ -0,0 +1,256 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import traceback
+import threading
+import datetime
+import Queue
+import json
+import time
+import uuid
+import sys
+
+
+from .clock import _get_trace
+
+
+# Queued by flush() to have the writer thread write out the coalesced groups
+_FLUSH_GROUPS = object()
+
+
+def get_nearest_five_minutes():
+    round_to = (60 * 5)
+    dt = datetime.datetime.now()
+    seconds = (dt.replace(tzinfo=None) - dt.min).seconds
+    rounding = (
+        seconds + round_to / 2
+    ) // round_to * round_to
+    return dt + datetime.timedelta(0, rounding - seconds, - dt.microsecond)
+
+
+def get_date_shard_string():
+    return "dt=" + get_nearest_five_minutes().strftime("%Y-%m-%d-%H-%M")
+
+
+class PipelineLogWriter:
+    """
+    Writes pipeline execution logs to S3 from a background thread with one
+    shared S3 client, so the invocation carries on (doing transitions, etc)
+    while the logs upload. flush() is called before the runtime asks for
+    the next event, since Lambda freezes the container once it does.
+
+    Logs are stored at the following S3 key:
+
+    {{PROJECT_ID}}/dt={{DATE_SHARD}}/{{EXECUTION_ID}}/{{TYPE}}~{{NAME}}~{{LOG_ID}}~{{TIMESTAMP}}
+
+    When coalescing is enabled, logs of the same type for the same execution
+    and date shard (e.g. the runs of a fan-out which land on this container)
+    are grouped into a single newline-delimited JSON object, with the number
+    of logs it holds appended to the key:
+
+    {{PROJECT_ID}}/dt={{DATE_SHARD}}/{{EXECUTION_ID}}/{{TYPE}}~{{NAME}}~{{LOG_ID}}~{{TIMESTAMP}}~{{COUNT}}
+
+    Athena's JSON SerDe already reads one record per line, and the API
+    takes the count from the key when parsing the listing.
+
+    Groups stay open across invocations until they're full or their date
+    shard has passed. Since nothing can be left buffered while the container
+    is frozen, every flush() writes out the groups which have grown since
+    the last one. The group's object is written again under its new count
+    and the previous one is deleted, so each group is a single object in S3.
+    """
+
+    def __init__(self, s3_client, coalesce=False, max_coalesced_logs=100):
+        self.s3_client = s3_client
+        self.coalesce = coalesce
+        self.max_coalesced_logs = max_coalesced_logs
+
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+        # Open coalesced log groups, only touched by the writer thread
+        self.groups = {}
+
+    def write(self, s3_log_bucket, project_id, lambda_arn, lambda_name, execution_pipeline_id, log_type, execution_details, program_output, backpack, input_data, return_data):
+        """
+        Queues the log to be written, returns immediately.
+        """
+        log_id = str(uuid.uuid4())
+        timestamp = int(time.time())
+
+        date_shard_string = get_date_shard_string()
+
+        s3_data = {
+            "id": log_id,
+            "execution_pipeline_id": execution_pipeline_id,
+            "project_id": project_id,
+            "arn": lambda_arn,
+            "name": lambda_name,
+            "type": log_type,  # INPUT, EXCEPTION, COMPLETE
+            "timestamp": timestamp,
+            "program_output": program_output,
+            "backpack": backpack,
+            "input_data": input_data,
+            "return_data": return_data,
+        }
+
+        # Merge in execution_details
+        for key, value in execution_details.iteritems():
+            s3_data[key] = value
+
+        # Phase timings of the invocation up to this point
+        trace = _get_trace()
+        if trace is not None:
+            s3_data["trace"] = trace
+
+        self._ensure_thread()
+
+        self.queue.put({
+            "s3_bucket": s3_log_bucket,
+            "s3_prefix": project_id + "/" + date_shard_string + "/" + execution_pipeline_id + "/",
+            "date_shard": date_shard_string,
+            "type": log_type,
+            "name": lambda_name,
+            "id": log_id,
+            "timestamp": timestamp,
+            "body": json.dumps(
+                s3_data,
+                sort_keys=True
+            )
+        })
+
+    def flush(self):
+        """
+        Blocks until every queued log has been written.
+        """
+        if self.thread is None:
+            return
+
+        if self.coalesce:
+            self.queue.put(_FLUSH_GROUPS)
+
+        self.queue.join()
+
+    def _ensure_thread(self):
+        if self.thread is not None:
+            return
+
+        with self.thread_lock:
+            if self.thread is None:
+                thread = threading.Thread(
+                    target=self._run
+                )
+                thread.daemon = True
+                thread.start()
+                self.thread = thread
+
+    def _run(self):
+        while True:
+            log = self.queue.get()
+
+            try:
+                if log is _FLUSH_GROUPS:
+                    self._write_groups()
+                elif self.coalesce:
+                    self._add_to_group(log)
+                else:
+                    self._write_single(log)
+            except Exception:
+                # A failed log write shouldn't stop the ones after it
+                sys.stderr.write(traceback.format_exc())
+                sys.stderr.flush()
+            finally:
+                self.queue.task_done()
+
+    def _write_single(self, log):
+        self.s3_client.put_object(
+            Bucket=log["s3_bucket"],
+            Key=log["s3_prefix"] + log["type"] + "~" + log["name"] + "~" +
+            log["id"] + "~" + str(log["timestamp"]),
+            Body=log["body"]
+        )
+
+    def _add_to_group(self, log):
+        group_key = (
+            log["s3_bucket"],
+            log["s3_prefix"],
+            log["type"],
+            log["name"]
+        )
+
+        group = self.groups.get(group_key)
+
+        if group is None:
+            group = {
+                "s3_bucket": log["s3_bucket"],
+                "s3_prefix": log["s3_prefix"],
+                "date_shard": log["date_shard"],
+                "type": log["type"],
+                "name": log["name"],
+                "id": log["id"],
+                "timestamp": log["timestamp"],
+                "bodies": [],
+                # Key the group was last written under
+                "s3_key": None,
+                "written_count": 0,
+            }
+            self.groups[group_key] = group
+
+        group["bodies"].append(log["body"])
+
+        if len(group["bodies"]) >= self.max_coalesced_logs:
+            self._write_group(group)
+            del self.groups[group_key]
+
+    def _write_groups(self):
+        date_shard_string = get_date_shard_string()
+
+        for group_key, group in self.groups.items():
+            try:
+                self._write_group(group)
+            except Exception:
+                # A failed group write shouldn't stop the ones after it,
+                # the group is written again on the next flush.
+                sys.stderr.write(traceback.format_exc())
+                sys.stderr.flush()
+                continue
+
+            # No more logs will land in the group once its shard has passed
+            if group["date_shard"] != date_shard_string:
+                del self.groups[group_key]
+
+    def _write_group(self, group):
+        if group["written_count"] == len(group["bodies"]):
+            return
+
+        s3_key = group["s3_prefix"] + group["type"] + "~" + group["name"] + "~" + \
+            group["id"] + "~" + str(group["timestamp"]) + "~" + str(len(group["bodies"]))
+
+        self.s3_client.put_object(
+            Bucket=group["s3_bucket"],
+            Key=s3_key,
+            Body="\n".join(group["bodies"])
+        )
+
+        previous_s3_key = group["s3_key"]
+        group["s3_key"] = s3_key
+        group["written_count"] = len(group["bodies"])
+
+        # Superseded by the object we just wrote
+        if previous_s3_key is not None:
+            self.s3_client.delete_object(
+                Bucket=group["s3_bucket"],
+                Key=previous_s3_key
+            )
@@ -13,14 +13,213 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-import redis
+import threading
+import time
 import json
 import uuid
+import zlib
 from .exc import AlreadyInvokedException, InvokeQueueEmptyException
+from .exc import ResponseTimeoutException
+from .redis_connection import RedisConnectionManager
+
+
+# Optional codecs, these are used if they've been installed into the layer
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 _QUEUE_METADATA_EXPIRATION = (60 * 60 * 24)
 
+# Limits of each chunk of fan-out invocations pushed to redis
+_FAN_OUT_CHUNK_ITEMS = 1000
+_FAN_OUT_CHUNK_BYTES = (1024 * 1024)
+
+
+"""
+Pushes a branch's result onto the fan-in results list and decrements
+the fan-in counter in a single atomic step. The counter is deleted once
+it reaches zero. Returns the remaining counter value.
+
+KEYS[1] = FAN_IN_RESULTS_{{FAN_OUT_ID}}
+KEYS[2] = FAN_IN_COUNTER_{{FAN_OUT_ID}}
+ARGV[1] = Encoded return data and backpack
+ARGV[2] = Expiration of the results list
+"""
+_FAN_IN_PUSH_SCRIPT = """
+redis.call("LPUSH", KEYS[1], ARGV[1])
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+local remaining = redis.call("DECR", KEYS[2])
+if remaining == 0 then
+    redis.call("DEL", KEYS[2])
+end
+return remaining
+"""
+
+"""
+Stores a branch's result in its merge slot and returns the number of
+filled slots (HLEN) so the caller never has to pull the keys back.
+
+KEYS[1] = Merge HASH name
+ARGV[1] = Current Lambda ARN (the slot)
+ARGV[2] = Encoded return data, backpack and branch IDs
+ARGV[3] = Expiration of the HASH
+"""
+_MERGE_STORE_SCRIPT = """
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+return redis.call("HLEN", KEYS[1])
+"""
+
+
+"""
+Values written through the PayloadCodec start with a single header byte:
+
+    0001 F CC
+
+The high nibble is the codec version, F is set for msgpack framing (JSON
+otherwise) and CC is the compression (0 = none, 1 = zlib, 2 = zstd).
+
+Plain JSON values (everything written before the codec existed) can never
+start with a byte in the 0x10-0x1F range, so they're decoded as before.
+"""
+_CODEC_VERSION = 0x10
+_CODEC_VERSION_MASK = 0xF0
+_CODEC_MSGPACK_FLAG = 0x04
+_CODEC_COMPRESSION_MASK = 0x03
+
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZLIB = 1
+_COMPRESSION_ZSTD = 2
+
+
+class PayloadCodec:
+    """
+    Encodes values stored in the customer's redis instance.
+
+    Values larger than compression_threshold bytes (after serialization)
+    are compressed with zstd if it's available, zlib otherwise. If
+    use_msgpack is set (and msgpack is installed) values are framed with
+    msgpack instead of JSON.
+
+    Byte counts are kept so that the savings can be reported, see
+    get_stats() and get_stats_line().
+    """
+
+    def __init__(self, compression_threshold=(1024 * 4), use_msgpack=False):
+        self.compression_threshold = compression_threshold
+        self.use_msgpack = use_msgpack and msgpack is not None
+
+        self.compression = _COMPRESSION_ZLIB
+        if zstandard is not None:
+            self.compression = _COMPRESSION_ZSTD
+
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {
+                "values": 0,
+                "compressed_values": 0,
+                "serialized_bytes": 0,
+                "stored_bytes": 0,
+            }
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+
+        stats["compression_ratio"] = 1.0
+        if stats["stored_bytes"] > 0:
+            stats["compression_ratio"] = (
+                float(stats["serialized_bytes"]) / float(stats["stored_bytes"])
+            )
+
+        return stats
+
+    def get_stats_line(self):
+        stats = self.get_stats()
+
+        return "[ INFO ] Redis payload codec stored " + str(stats["values"]) + \
+            " value(s), " + str(stats["compressed_values"]) + " compressed, " + \
+            str(stats["serialized_bytes"]) + " -> " + str(stats["stored_bytes"]) + \
+            " bytes (" + ("%.2f" % stats["compression_ratio"]) + "x)."
+
+    def encode(self, value):
+        if self.use_msgpack:
+            return self._pack(
+                msgpack.packb(value, use_bin_type=True),
+                _CODEC_MSGPACK_FLAG
+            )
+
+        return self._pack(
+            json.dumps(value),
+            0
+        )
+
+    def encode_json(self, json_string):
+        """
+        Same as encode() but for a value which is already JSON-encoded.
+        """
+        return self._pack(
+            json_string,
+            0
+        )
+
+    def _pack(self, serialized, framing):
+        compression = _COMPRESSION_NONE
+        body = serialized
+
+        if len(serialized) >= self.compression_threshold:
+            compression = self.compression
+
+            if compression == _COMPRESSION_ZSTD:
+                body = zstandard.ZstdCompressor().compress(serialized)
+            else:
+                body = zlib.compress(serialized)
+
+        with self.stats_lock:
+            self.stats["values"] += 1
+            self.stats["serialized_bytes"] += len(serialized)
+            self.stats["stored_bytes"] += len(body) + 1
+            if compression != _COMPRESSION_NONE:
+                self.stats["compressed_values"] += 1
+
+        return chr(_CODEC_VERSION | framing | compression) + body
+
+    def decode(self, stored):
+        """
+        Decodes a stored value, raises ValueError if it isn't decodable
+        (just like json.loads() would for legacy values).
+        """
+        if not stored or (ord(stored[0]) & _CODEC_VERSION_MASK) != _CODEC_VERSION:
+            return json.loads(stored)
+
+        header = ord(stored[0])
+        body = stored[1:]
+        compression = header & _CODEC_COMPRESSION_MASK
+
+        if compression == _COMPRESSION_ZLIB:
+            body = zlib.decompress(body)
+        elif compression == _COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("Value is zstd-compressed but zstandard is not installed!")
+            body = zstandard.ZstdDecompressor().decompress(body)
+
+        if header & _CODEC_MSGPACK_FLAG:
+            if msgpack is None:
+                raise ValueError("Value is msgpack-encoded but msgpack is not installed!")
+            return msgpack.unpackb(body, raw=False)
+
+        return json.loads(body)
+
 
 class RefineryMemory:
     # 6 hours is the timeout here because it's the max retry
@@ -44,21 +243,55 @@ class RefineryMemory:
         bool,
     ]
 
-    def __init__(self, in_hostname, in_password, in_port):
+    def __init__(self, in_hostname, in_password, in_port, codec=None, unix_socket_path=None, use_tls=False):
         self.redis_client = False
         self.hostname = in_hostname
         self.password = in_password
         self.port = in_port
 
+        self.connection_manager = RedisConnectionManager(
+            in_hostname,
+            in_password,
+            in_port,
+            unix_socket_path=unix_socket_path,
+            use_tls=use_tls
+        )
+
+        self.codec = codec
+        if self.codec is None:
+            self.codec = PayloadCodec()
+
+        # Stats from the last _set_fan_in_data() call
+        self.fan_out_stats = None
+
+    def start_invocation(self):
+        """
+        Resets the per-invocation stats. If the container was frozen for a
+        while, the next command first checks that the connection survived.
+        """
+        self.codec.reset_stats()
+        self.connection_manager.stats.reset()
+
+        if self.connection_manager.is_thawed():
+            self.redis_client = False
+
+    def get_stats_line(self):
+        return self.connection_manager.stats.get_stats_line()
+
     def connect(self):
-        self.redis_client = redis.StrictRedis(
-            host=self.hostname,
-            port=self.port,
-            db=0,
-            socket_timeout=5,
-            password=self.password,
+        redis_client = self.connection_manager.get_client()
+
+        # Scripts are run with EVALSHA and only sent over in full
+        # if the redis server doesn't have them cached yet.
+        self.fan_in_push_script = redis_client.register_script(
+            _FAN_IN_PUSH_SCRIPT
+        )
+        self.merge_store_script = redis_client.register_script(
+            _MERGE_STORE_SCRIPT
         )
 
+        self.redis_client = redis_client
+
     def _get_input_data_from_redis(self, key, **kwargs):
         if not self.redis_client:
             self.connect()
@@ -74,7 +307,7 @@ class RefineryMemory:
             raise AlreadyInvokedException()
 
         try:
-            return json.loads(returned_data[0])
+            return self.codec.decode(returned_data[0])
         except:
             pass
 
@@ -89,45 +322,175 @@ class RefineryMemory:
         self.redis_client.setex(
             new_key,
             self.return_data_timeout,
-            json.dumps(
+            self.codec.encode(
                 return_data
             )
         )
 
         return new_key
 
+    def _store_shared_input_data(self, payload):
+        """
+        Stores a TransitionPayload's input data and backpack for any number
+        of readers (e.g. every subscriber of an SNS topic), unlike
+        _bulk_store_input_data the stored value isn't deleted when it's read.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        new_key = str(uuid.uuid4())
+
+        self.redis_client.setex(
+            new_key,
+            self.return_data_timeout,
+            payload.get_redis_value(
+                self.codec
+            )
+        )
+
+        return new_key
+
+    def _get_shared_input_data(self, key):
+        if not self.redis_client:
+            self.connect()
+
+        stored_input_data = self.redis_client.get(
+            key
+        )
+
+        # The input data expired
+        if stored_input_data == None:
+            raise AlreadyInvokedException()
+
+        return self.codec.decode(
+            stored_input_data
+        )
+
+    def _push_api_gateway_response(self, execution_id, response):
+        """
+        Pushes the HTTP response for an API endpoint execution onto its
+        response list, waking up the API endpoint Lambda BLPOP'ing on it.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        response_list_key = "API_GATEWAY_RESPONSE_" + execution_id
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(
+            response_list_key,
+            self.codec.encode(
+                response
+            )
+        )
+        pipeline.expire(
+            response_list_key,
+            self.return_data_timeout
+        )
+        pipeline.execute()
+
+    def _wait_for_api_gateway_response(self, execution_id, timeout_seconds):
+        """
+        Blocks until the HTTP response for the execution is pushed, raises
+        ResponseTimeoutException if the timeout passes first.
+
+        The BLPOP is done in slices shorter than the client socket timeout
+        so a long wait doesn't get cut off as a dead connection.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        response_list_key = "API_GATEWAY_RESPONSE_" + execution_id
+        deadline = time.time() + timeout_seconds
+
+        while True:
+            # BLPOP only takes whole seconds
+            blpop_timeout = min(
+                4,
+                int(deadline - time.time())
+            )
+
+            if blpop_timeout < 1:
+                raise ResponseTimeoutException()
+
+            popped_item = self.redis_client.blpop(
+                [response_list_key],
+                blpop_timeout
+            )
+
+            if popped_item is not None:
+                return self.codec.decode(
+                    popped_item[1]
+                )
+
     def _get_queue_input_from_redis(self, queue_insert_id, pop_number):
         """
         Pull pop_number of items off of the redis list to be thrown onto SQS.
+
+        The items are read and trimmed off of the list in a single MULTI/EXEC
+        transaction, so concurrent SQS workers never get the same item.
         """
         if not self.redis_client:
             self.connect()
 
+        queue_storage_id = "SQS_QUEUE_DATA_" + queue_insert_id
+
         # List of items pulled from redis
         return_items = []
 
-        # Do a redis pipeline transaction
         pipeline = self.redis_client.pipeline()
-
-        for i in range(0, pop_number):
-            pipeline.lpop("SQS_QUEUE_DATA_" + queue_insert_id)
-
-        returned_data_list = pipeline.execute()
+        pipeline.lrange(
+            queue_storage_id,
+            0,
+            pop_number - 1
+        )
+        pipeline.ltrim(
+            queue_storage_id,
+            pop_number,
+            -1
+        )
+        returned_data_list = pipeline.execute()[0]
 
         for return_data in returned_data_list:
-            if return_data != None:
-                try:
-                    return_data = json.loads(
-                        return_data
-                    )
-                except:
-                    pass
-                return_items.append(
+            try:
+                return_data = self.codec.decode(
                     return_data
                 )
+            except:
+                pass
+            return_items.append(
+                return_data
+            )
 
         return return_items
 
+    def _return_queue_input_to_redis(self, queue_insert_id, queue_items):
+        """
+        Puts queue items which couldn't be loaded into SQS back on the redis
+        list, for the SQS workers to pick up again.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        queue_storage_id = "SQS_QUEUE_DATA_" + queue_insert_id
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(
+            queue_storage_id,
+            *[
+                self.codec.encode(queue_item)
+                for queue_item in queue_items
+            ]
+        )
+
+        # The list is gone if it was drained, so its expiration is too
+        pipeline.expire(
+            queue_storage_id,
+            _QUEUE_METADATA_EXPIRATION,  # 1-Day expiration
+        )
+
+        pipeline.execute()
+
     def _get_queue_url(self, queue_insert_id):
         if not self.redis_client:
             self.connect()
@@ -140,7 +503,7 @@ class RefineryMemory:
         if not self.redis_client:
             self.connect()
 
-        return json.loads(
+        return self.codec.decode(
             self.redis_client.get(
                 "SQS_BACKPACK_DATA_" + queue_insert_id
             )
@@ -165,12 +528,6 @@ class RefineryMemory:
         # Do a redis pipeline transaction
         pipeline = self.redis_client.pipeline()
 
-        # JSON-encode queue items
-        for i in range(0, len(queue_items)):
-            queue_items[i] = json.dumps(
-                queue_items[i]
-            )
-
         # Set the queue URL
         pipeline.setex(
             sqs_target_queue_url,
@@ -182,7 +539,7 @@ class RefineryMemory:
         pipeline.setex(
             sqs_backpack_key,
             _QUEUE_METADATA_EXPIRATION,  # 1-Day expiration
-            json.dumps(
+            self.codec.encode(
                 backpack
             )
         )
@@ -200,13 +557,15 @@ class RefineryMemory:
         SQS_BATCH_SIZE = (1000 * 10)
 
         # We have to batch these up so that we can process
-        # extremely large return data.
-        while len(queue_items) > 0:
+        # extremely large return data. Items are encoded a batch at a
+        # time, the list itself is left alone since it's shared with
+        # the block's other transitions.
+        for batch_start in range(0, len(queue_items), SQS_BATCH_SIZE):
             # Current batch of items to be put in redis
-            queue_current_item_batch = queue_items[:SQS_BATCH_SIZE]
-
-            # Remove the items from the queue items
-            queue_items = queue_items[SQS_BATCH_SIZE:]
+            queue_current_item_batch = [
+                self.codec.encode(queue_item)
+                for queue_item in queue_items[batch_start:batch_start + SQS_BATCH_SIZE]
+            ]
 
             # Do a redis pipeline transaction
             pipeline = self.redis_client.pipeline()
@@ -221,38 +580,92 @@ class RefineryMemory:
 
         return queue_insert_id
 
-    def _set_fan_in_data(self, fan_out_id, invocation_list, **kwargs):
+    def _set_fan_in_data(self, fan_out_id, invocations, **kwargs):
+        """
+        Stores the (JSON-encoded) fan-out invocations in a redis list and sets
+        up the fan-in counter for them.
+
+        invocations can be any iterable, it's consumed as it's pushed: items
+        are encoded and pushed in chunks of at most _FAN_OUT_CHUNK_ITEMS items
+        and about _FAN_OUT_CHUNK_BYTES bytes. This keeps memory bounded for
+        huge fan-outs and keeps each command small enough that it doesn't
+        block the redis instance for other executions. The counter is only
+        set once the last chunk is stored. Stats for the last call are kept
+        in fan_out_stats.
+        """
         if not self.redis_client:
             self.connect()
 
         # Generate an invocation array ID
         invocation_array_id = "INVOCATION_QUEUE_" + str(uuid.uuid4())
 
-        # Do a redis pipeline transaction
-        pipeline = self.redis_client.pipeline()
+        fan_out_stats = {
+            "items": 0,
+            "chunks": 0,
+            "peak_buffered_bytes": 0,
+        }
 
-        # Set up the counter for fan-in
-        pipeline.setex(
+        chunk = []
+        chunk_bytes = 0
+
+        for invocation in invocations:
+            encoded_invocation = self.codec.encode_json(invocation)
+
+            chunk.append(encoded_invocation)
+            chunk_bytes += len(encoded_invocation)
+
+            if len(chunk) >= _FAN_OUT_CHUNK_ITEMS or chunk_bytes >= _FAN_OUT_CHUNK_BYTES:
+                self._push_fan_out_chunk(invocation_array_id, chunk)
+
+                fan_out_stats["items"] += len(chunk)
+                fan_out_stats["chunks"] += 1
+                fan_out_stats["peak_buffered_bytes"] = max(
+                    fan_out_stats["peak_buffered_bytes"],
+                    chunk_bytes
+                )
+
+                chunk = []
+                chunk_bytes = 0
+
+        if len(chunk) > 0:
+            self._push_fan_out_chunk(invocation_array_id, chunk)
+
+            fan_out_stats["items"] += len(chunk)
+            fan_out_stats["chunks"] += 1
+            fan_out_stats["peak_buffered_bytes"] = max(
+                fan_out_stats["peak_buffered_bytes"],
+                chunk_bytes
+            )
+
+        # Set up the counter for fan-in, now that every invocation is stored
+        self.redis_client.setex(
             "FAN_IN_COUNTER_" + fan_out_id,
             self.return_data_timeout,
-            len(invocation_list)
+            fan_out_stats["items"]
         )
 
-        # Store all invocation data in redis in a list
+        self.fan_out_stats = fan_out_stats
+
+        return invocation_array_id
+
+    def _push_fan_out_chunk(self, invocation_array_id, encoded_invocations):
+        # Do a redis pipeline transaction
+        pipeline = self.redis_client.pipeline()
+
+        # Store the chunk of invocation data at the end of the list
         pipeline.rpush(
             invocation_array_id,
-            *invocation_list
+            *encoded_invocations
         )
 
-        # Set expiration of items
+        # Set expiration of items, so a fan-out which fails part of
+        # the way through doesn't leave a list behind forever
         pipeline.expire(
             invocation_array_id,
             _QUEUE_METADATA_EXPIRATION,  # 1-Day expiration
         )
 
-        returned_data = pipeline.execute()
-
-        return invocation_array_id
+        pipeline.execute()
 
     def _get_invocation_input_from_queue(self, invocation_id):
         """
@@ -273,7 +686,77 @@ class RefineryMemory:
         if returned_data[0] == None:
             raise InvokeQueueEmptyException()
 
-        return json.loads(returned_data[0])
+        return self.codec.decode(returned_data[0])
+
+    def _return_invocation_inputs_to_queue(self, invocation_id, invocation_inputs):
+        """
+        Pushes invocation inputs back onto the front of the array, for
+        example when their invokes were throttled and need to be retried.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        if len(invocation_inputs) == 0:
+            return
+
+        self.redis_client.lpush(
+            invocation_id,
+            *[self.codec.encode(invocation_input) for invocation_input in invocation_inputs]
+        )
+
+    def _get_fan_out_rate(self, function_arn):
+        """
+        Returns the invoke rate (per spawner, per second) learned by the
+        last fan-out of the given function, or None if there isn't one.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        fan_out_rate = self.redis_client.get(
+            "FAN_OUT_RATE_" + function_arn
+        )
+
+        if fan_out_rate == None:
+            return None
+
+        return float(fan_out_rate)
+
+    def _set_fan_out_rate(self, function_arn, fan_out_rate):
+        if not self.redis_client:
+            self.connect()
+
+        self.redis_client.setex(
+            "FAN_OUT_RATE_" + function_arn,
+            _QUEUE_METADATA_EXPIRATION,  # 1-Day expiration
+            fan_out_rate
+        )
+
+    def _get_sqs_insert_rate(self, queue_url):
+        """
+        Returns the insert rate (per SQS worker, per second) measured by the
+        last SQS worker which loaded the given queue, or None if there isn't one.
+        """
+        if not self.redis_client:
+            self.connect()
+
+        sqs_insert_rate = self.redis_client.get(
+            "SQS_INSERT_RATE_" + queue_url
+        )
+
+        if sqs_insert_rate == None:
+            return None
+
+        return float(sqs_insert_rate)
+
+    def _set_sqs_insert_rate(self, queue_url, sqs_insert_rate):
+        if not self.redis_client:
+            self.connect()
+
+        self.redis_client.setex(
+            "SQS_INSERT_RATE_" + queue_url,
+            _QUEUE_METADATA_EXPIRATION,  # 1-Day expiration
+            sqs_insert_rate
+        )
 
     def _fan_in_get_results_data(self, fan_out_id, **kwargs):
         """
@@ -312,7 +795,7 @@ class RefineryMemory:
         combined_backpack = {}
 
         for returned_data_segment in returned_data[0]:
-            returned_data_dict = json.loads(
+            returned_data_dict = self.codec.decode(
                 returned_data_segment
             )
 
@@ -339,51 +822,24 @@ class RefineryMemory:
         if not self.redis_client:
             self.connect()
 
-        # Do a redis pipeline transaction
-        pipeline = self.redis_client.pipeline()
-
-        # Push return data into redis
-        pipeline.lpush(
-            "FAN_IN_RESULTS_" + fan_out_id,
-            json.dumps({
-                "backpack": backpack,
-                "output": return_data
-            })
-        )
-
-        # Update expiration
-        pipeline.expire(
-            "FAN_IN_RESULTS_" + fan_out_id,
-            self.return_data_timeout,
-        )
-
-        # Decrement fan-in counter
-        pipeline.decr(
-            "FAN_IN_COUNTER_" + fan_out_id
-        )
-
-        # Get fan-in counter latest value
-        pipeline.get(
-            "FAN_IN_COUNTER_" + fan_out_id
+        # Push our return data and decrement the counter in one round-trip
+        fan_in_counter_result = self.fan_in_push_script(
+            keys=[
+                "FAN_IN_RESULTS_" + fan_out_id,
+                "FAN_IN_COUNTER_" + fan_out_id,
+            ],
+            args=[
+                self.codec.encode({
+                    "backpack": backpack,
+                    "output": return_data
+                }),
+                self.return_data_timeout,
+            ]
         )
 
-        returned_data = pipeline.execute()
-
         # Check fan-in counter value
         # If it's zero, we must move to invoke the next function
-        fan_in_counter_result = int(returned_data[3])
-
-        if fan_in_counter_result == 0:
-            # Clean up previous data
-            pipeline = self.redis_client.pipeline()
-
-            # Delete fan-in counter
-            pipeline.delete(
-                "FAN_IN_COUNTER_" + fan_out_id
-            )
-
-            returned_data = pipeline.execute()
-
+        if int(fan_in_counter_result) == 0:
             return "FAN_IN_RESULTS_" + fan_out_id
 
         return False
@@ -403,16 +859,25 @@ class RefineryMemory:
         for i in range(0, len(lambda_invocation_list)):
             new_input_data_key = str(uuid.uuid4())
 
-            pipeline.setex(
-                new_input_data_key,
-                self.return_data_timeout,
-                json.dumps({
+            # Invocations sharing a TransitionPayload share one encoded value
+            if "payload" in lambda_invocation_list[i]:
+                stored_input_data = lambda_invocation_list[i]["payload"].get_redis_value(
+                    self.codec
+                )
+            else:
+                stored_input_data = self.codec.encode({
                     "input_data": lambda_invocation_list[i]["input_data"],
                     "backpack": lambda_invocation_list[i]["backpack"]
                 })
+
+            pipeline.setex(
+                new_input_data_key,
+                self.return_data_timeout,
+                stored_input_data
             )
 
             del lambda_invocation_list[i]["input_data"]
+            lambda_invocation_list[i].pop("payload", None)
             lambda_invocation_list[i]["input_data_key"] = new_input_data_key
 
         # Execute in one quick transaction
@@ -421,41 +886,27 @@ class RefineryMemory:
         return lambda_invocation_list
 
     def _store_and_check_if_merge(self, hset_name, branch_ids, current_lambda_arn, merge_lambda_arns, backpack, return_data):
-        # Do a redis pipeline transaction
-        pipeline = self.redis_client.pipeline()
-
-        # Store return data in HASH
-        pipeline.hset(
-            hset_name,
-            current_lambda_arn,
-            json.dumps({
-                "backpack": backpack,
-                "return_data": return_data,
-                "branch_ids": branch_ids,
-            })
-        )
-
-        # Set expiration for the HASH
-        pipeline.expire(
-            hset_name,
-            _QUEUE_METADATA_EXPIRATION
-        )
-
-        # Get the keys of the HASH after our HSET to see if we're the final
-        # Lambda in the merge set.
-        pipeline.hkeys(
-            hset_name
+        # Store return data in the HASH and get the number of filled
+        # slots back in a single atomic call.
+        merge_slot_count = self.merge_store_script(
+            keys=[
+                hset_name
+            ],
+            args=[
+                current_lambda_arn,
+                self.codec.encode({
+                    "backpack": backpack,
+                    "return_data": return_data,
+                    "branch_ids": branch_ids,
+                }),
+                _QUEUE_METADATA_EXPIRATION
+            ]
         )
 
-        # Execute in one quick transaction
-        hset_returned_data = pipeline.execute()
-
         # Determine if we've the last Lambda in the merge
         # by the number of merge Lambdas and comparing it to the number of
-        # HASH keys returned from HKEYS
-        lambda_return_values_list = hset_returned_data[2]
-
-        return len(lambda_return_values_list) == len(merge_lambda_arns)
+        # filled slots in the HASH
+        return int(merge_slot_count) == len(merge_lambda_arns)
 
     def _get_merge_data(self, hset_name, branch_ids):
         # Since we're the last Lambda in the merge we'll pull it all out.
@@ -474,7 +925,7 @@ class RefineryMemory:
         combined_backpack = {}
 
         for lambda_return_metadata in lambda_return_metadata_list:
-            returned_data_dict = json.loads(
+            returned_data_dict = self.codec.decode(
                 lambda_return_metadata
             )
 
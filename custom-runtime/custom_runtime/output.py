@@ -0,0 +1,312 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import tempfile
+import os
+
+
+RETURN_START_MARKER = "<REFINERY_OUTPUT_CUSTOM_RUNTIME_START_MARKER>"
+RETURN_END_MARKER = "<REFINERY_OUTPUT_CUSTOM_RUNTIME_END_MARKER>"
+ERROR_START_MARKER = "<REFINERY_ERROR_OUTPUT_CUSTOM_RUNTIME_START_MARKER>"
+ERROR_END_MARKER = "<REFINERY_ERROR_OUTPUT_CUSTOM_RUNTIME_END_MARKER>"
+
+# Output sections
+_PROGRAM_OUTPUT = "program_output"
+_RETURN_PAYLOAD = "return_payload"
+_ERROR_PAYLOAD = "error_payload"
+
+_START_MARKERS = {
+    _RETURN_PAYLOAD: RETURN_START_MARKER,
+    _ERROR_PAYLOAD: ERROR_START_MARKER,
+}
+
+_END_MARKERS = {
+    _RETURN_PAYLOAD: RETURN_END_MARKER,
+    _ERROR_PAYLOAD: ERROR_END_MARKER,
+}
+
+# Bytes kept in memory per buffer before it spills to disk
+_SPILL_THRESHOLD = (1024 * 1024 * 8)
+
+_READ_SIZE = (1024 * 64)
+
+
+def _partial_marker_length(data, markers):
+    """
+    Returns the length of the longest suffix of data which could be the
+    start of one of the markers (and so has to wait for more data).
+    """
+    longest_marker_length = max([len(marker) for marker in markers])
+    index = data.find("<", max(0, len(data) - longest_marker_length + 1))
+
+    while index != -1:
+        tail = data[index:]
+
+        for marker in markers:
+            if marker.startswith(tail):
+                return len(tail)
+
+        index = data.find("<", index + 1)
+
+    return 0
+
+
+class SpillBuffer:
+    """
+    Append-only string buffer which moves its contents into a temporary
+    file in /tmp once it grows past spill_threshold bytes.
+    """
+
+    def __init__(self, spill_threshold=_SPILL_THRESHOLD):
+        self.spill_threshold = spill_threshold
+        self.chunks = []
+        self.size = 0
+        self.spill_file = None
+
+    def write(self, data):
+        if not data:
+            return
+
+        if self.spill_file is None and (self.size + len(data)) > self.spill_threshold:
+            self.spill_file = tempfile.TemporaryFile(
+                dir="/tmp"
+            )
+            self.spill_file.write("".join(self.chunks))
+            self.chunks = []
+
+        if self.spill_file is None:
+            self.chunks.append(data)
+        else:
+            self.spill_file.write(data)
+
+        self.size += len(data)
+
+    def getvalue(self):
+        if self.spill_file is None:
+            self.chunks = ["".join(self.chunks)]
+            return self.chunks[0]
+
+        self.spill_file.seek(0)
+        value = self.spill_file.read()
+        self.spill_file.seek(0, os.SEEK_END)
+
+        return value
+
+    def write_to(self, stream):
+        if self.spill_file is None:
+            for chunk in self.chunks:
+                stream.write(chunk)
+            return
+
+        self.spill_file.seek(0)
+        while True:
+            chunk = self.spill_file.read(_READ_SIZE)
+            if not chunk:
+                break
+            stream.write(chunk)
+        self.spill_file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.chunks = []
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+class OutputDemultiplexer:
+    """
+    Splits a block's output into its program output, its return payload
+    (between the RETURN markers) and its error payload (between the ERROR
+    markers) as the output arrives.
+
+    This is a small state machine that finds markers as the data comes in,
+    including markers split across reads, so the work stays linear in the
+    size of the output. Every section goes into its own SpillBuffer. The
+    rest of the line after an end marker is dropped. A section that never
+    gets its end marker is folded back into the program output.
+
+    If on_program_output_line is set, each complete line of program output
+    is passed to it as soon as the line arrives (e.g. for live debugging).
+    """
+
+    def __init__(self, on_program_output_line=None, spill_threshold=_SPILL_THRESHOLD):
+        self.on_program_output_line = on_program_output_line
+
+        self.buffers = {
+            _PROGRAM_OUTPUT: SpillBuffer(spill_threshold),
+            _RETURN_PAYLOAD: SpillBuffer(spill_threshold),
+            _ERROR_PAYLOAD: SpillBuffer(spill_threshold),
+        }
+
+        self.completed_sections = set()
+        self.section = _PROGRAM_OUTPUT
+        self.pending = ""
+        self.partial_line = []
+        self.discarding_line = False
+
+    @property
+    def program_output(self):
+        return self.buffers[_PROGRAM_OUTPUT]
+
+    @property
+    def return_payload(self):
+        return self.buffers[_RETURN_PAYLOAD]
+
+    @property
+    def error_payload(self):
+        return self.buffers[_ERROR_PAYLOAD]
+
+    def has_return_payload(self):
+        return _RETURN_PAYLOAD in self.completed_sections
+
+    def has_error_payload(self):
+        return _ERROR_PAYLOAD in self.completed_sections
+
+    def read_from_fd(self, fd):
+        """
+        Feeds everything read from the file descriptor until EOF.
+        """
+        while True:
+            chunk = os.read(fd, _READ_SIZE)
+
+            if not chunk:
+                break
+
+            self.feed(chunk)
+
+        self.close()
+
+    def feed(self, data):
+        data = self.pending + data
+        self.pending = ""
+
+        while data:
+            if self.discarding_line:
+                newline_index = data.find("\n")
+                if newline_index == -1:
+                    return
+                data = data[newline_index + 1:]
+                self.discarding_line = False
+                continue
+
+            if self.section == _PROGRAM_OUTPUT:
+                data = self._feed_program_output(data)
+            else:
+                data = self._feed_payload(data)
+
+    def _feed_program_output(self, data):
+        start_markers = [
+            (section, marker) for section, marker in _START_MARKERS.items()
+            if section not in self.completed_sections
+        ]
+
+        marker_section = None
+        marker_index = -1
+        marker_length = 0
+
+        for section, marker in start_markers:
+            index = data.find(marker)
+            if index != -1 and (marker_index == -1 or index < marker_index):
+                marker_section = section
+                marker_index = index
+                marker_length = len(marker)
+
+        if marker_section is not None:
+            self._write_program_output(data[:marker_index])
+            self.section = marker_section
+            return data[marker_index + marker_length:]
+
+        pending_length = 0
+        if start_markers:
+            pending_length = _partial_marker_length(
+                data,
+                [marker for section, marker in start_markers]
+            )
+
+        self._write_program_output(data[:len(data) - pending_length])
+        self.pending = data[len(data) - pending_length:]
+
+        return ""
+
+    def _feed_payload(self, data):
+        end_marker = _END_MARKERS[self.section]
+        index = data.find(end_marker)
+
+        if index != -1:
+            self.buffers[self.section].write(data[:index])
+            self.completed_sections.add(self.section)
+            self.section = _PROGRAM_OUTPUT
+            self.discarding_line = True
+            return data[index + len(end_marker):]
+
+        pending_length = _partial_marker_length(
+            data,
+            [end_marker]
+        )
+
+        self.buffers[self.section].write(data[:len(data) - pending_length])
+        self.pending = data[len(data) - pending_length:]
+
+        return ""
+
+    def _write_program_output(self, data):
+        if not data:
+            return
+
+        self.program_output.write(data)
+
+        if self.on_program_output_line is None:
+            return
+
+        # Hold on to partial lines until their newline shows up
+        if "\n" not in data:
+            self.partial_line.append(data)
+            return
+
+        self.partial_line.append(data)
+        lines = "".join(self.partial_line).split("\n")
+        self.partial_line = [lines.pop()]
+
+        for line in lines:
+            self.on_program_output_line(line + "\n")
+
+    def close(self):
+        """
+        Called once all of the output has been fed.
+        """
+        if self.section == _PROGRAM_OUTPUT:
+            self._write_program_output(self.pending)
+        else:
+            # Section was never closed, it was just program output after all
+            unfinished_payload = self.buffers[self.section]
+            self._write_program_output(_START_MARKERS[self.section])
+            self._write_program_output(unfinished_payload.getvalue())
+            self._write_program_output(self.pending)
+            unfinished_payload.close()
+            self.buffers[self.section] = SpillBuffer(
+                unfinished_payload.spill_threshold
+            )
+            self.section = _PROGRAM_OUTPUT
+
+        self.pending = ""
+
+        partial_line = "".join(self.partial_line)
+        self.partial_line = []
+
+        if self.on_program_output_line is not None and partial_line:
+            self.on_program_output_line(partial_line)
+
+    def cleanup(self):
+        for output_buffer in self.buffers.values():
+            output_buffer.close()
@@ -13,15 +13,17 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-import threading
-import boto3
-import time
 import json
 import uuid
-import math
 
 
-from .constants import gmemory
+from .constants import gmemory, INVOCATION_ENGINE
+from .constants import SQS_INSERT_TARGET_SECONDS, SQS_MAX_WORKERS
+from .rate import is_throttling_error, get_sqs_worker_count
+from .rate import DEFAULT_SQS_INSERT_RATE
+from .clock import _start_clock, _stop_clock
+from .payload import TransitionPayload
+from .sns import sns_topic_publish_worker, _get_sns_topic_messages
 
 
 def get_branch_id_from_invoke_queue(invoke_queue):
@@ -85,374 +87,286 @@ def get_merge_invoke_data(new_invoke_data):
         "fan_out_ids": new_invoke_data["fan_out_ids"],
         "type": "merge",
         "arn": new_invoke_data["arn"],
-        "input_data": json.loads(
-            json.dumps(
-                merge_result["return_data"]
-            )
-        )
+        "input_data": merge_result["return_data"]
     }
 
     return new_invoke_data
 
 
-def _parallel_invoke(branch_ids, invoke_queue):
-    # List of active threads
-    active_threads = []
 
-    # Maximum number of threads
-    max_threads = 50
+def _invoke_lambda_async(arn, return_wrapper_data):
+    return _invoke_lambda_async_json(
+        arn,
+        json.dumps(
+            return_wrapper_data
+        )
+    )
 
-    # Invokes a Lambda directly with input_data asynchronously
-    def lambda_invoker_worker_direct_input(execution_id, branch_ids, fan_out_ids, arn, input_data):
-        return_wrapper_data = {
-            "_refinery": {
-                "branch_ids": branch_ids,
-                "input_data": input_data,
-                "parallel": False,
-                "execution_id": execution_id,
-                "fan_out_ids": fan_out_ids,
-            }
-        }
 
-        lambda_client = boto3.client(
-            "lambda"
-        )
+def _invoke_lambda_async_json(arn, return_wrapper_json):
+    lambda_client = INVOCATION_ENGINE.get_client(
+        "lambda"
+    )
 
-        response = lambda_client.invoke(
-            FunctionName=arn,
-            InvocationType="Event",
-            LogType="None",
-            Payload=json.dumps(
-                return_wrapper_data
-            )
-        )
+    return lambda_client.invoke(
+        FunctionName=arn,
+        InvocationType="Event",
+        LogType="None",
+        Payload=return_wrapper_json
+    )
 
-        raise SystemExit
 
-    # Invokes a Lambda asynchronously
-    def lambda_invoker_worker_redis(execution_id, branch_ids, fan_out_ids, arn, return_key):
-        return_wrapper_data = {
-            "_refinery": {
-                "branch_ids": branch_ids,
-                "indirect": {
-                    "type": "redis",
-                            "key": return_key,
-                },
-                "parallel": False,
-                "execution_id": execution_id,
-                "fan_out_ids": fan_out_ids,
-            }
-        }
+def _get_transition_payload(new_invoke_data):
+    """
+    The TransitionPayload shared by all of a block's transitions, or a new
+    one for invocations which were built without one (e.g. merges).
+    """
+    if "payload" in new_invoke_data:
+        return new_invoke_data["payload"]
 
-        lambda_client = boto3.client(
-            "lambda"
-        )
+    return TransitionPayload(
+        new_invoke_data["input_data"],
+        new_invoke_data.get("backpack", {})
+    )
 
-        response = lambda_client.invoke(
-            FunctionName=arn,
-            InvocationType="Event",
-            LogType="None",
-            Payload=json.dumps(
-                return_wrapper_data
-            )
-        )
 
-        raise SystemExit
+# Invokes a Lambda directly with the payload's input_data asynchronously
+def lambda_invoker_worker_direct_input(execution_id, branch_ids, fan_out_ids, arn, payload):
+    return _invoke_lambda_async_json(
+        arn,
+        payload.get_envelope_json({
+            "branch_ids": branch_ids,
+            "parallel": False,
+            "execution_id": execution_id,
+            "fan_out_ids": fan_out_ids,
+        })
+    )
 
-    # Self-invocation for a fan-out transition
-    def lambda_invoker_fan_out(arn, return_key, invocation_id, branch_ids):
-        return_wrapper_data = {
-            "_refinery": {
-                "branch_ids": branch_ids,
-                "invoke": invocation_id,
-                "indirect": {
-                    "type": "redis",
-                            "key": return_key,
-                },
-                "parallel": False
-            }
-        }
 
-        lambda_client = boto3.client(
-            "lambda"
-        )
+# Invokes a Lambda asynchronously
+def lambda_invoker_worker_redis(execution_id, branch_ids, fan_out_ids, arn, return_key):
+    return_wrapper_data = {
+        "_refinery": {
+            "branch_ids": branch_ids,
+            "indirect": {
+                "type": "redis",
+                "key": return_key,
+            },
+            "parallel": False,
+            "execution_id": execution_id,
+            "fan_out_ids": fan_out_ids,
+        }
+    }
 
-        response = lambda_client.invoke(
-            FunctionName=arn,
-            InvocationType="Event",
-            LogType="None",
-            Payload=json.dumps(
-                return_wrapper_data
-            )
-        )
+    return _invoke_lambda_async(
+        arn,
+        return_wrapper_data
+    )
 
-        raise SystemExit
 
-    # Invokes a Lambda asynchronously with fan-in results as input
-    def lambda_invoker_worker_fan_in(execution_id, branch_ids, fan_out_ids, arn, fan_out_id):
-        return_wrapper_data = {
-            "_refinery": {
-                "branch_ids": branch_ids,
-                "indirect": {
-                    "type": "redis_fan_in",
-                            "key": fan_out_id,
-                },
-                "parallel": False,
-                "execution_id": execution_id,
-                "fan_out_ids": fan_out_ids,
-            }
+# Self-invocation for a fan-out transition
+def lambda_invoker_fan_out(arn, return_key, invocation_id, branch_ids):
+    return_wrapper_data = {
+        "_refinery": {
+            "branch_ids": branch_ids,
+            "invoke": invocation_id,
+            "indirect": {
+                "type": "redis",
+                "key": return_key,
+            },
+            "parallel": False
         }
+    }
 
-        lambda_client = boto3.client(
-            "lambda"
-        )
+    return _invoke_lambda_async(
+        arn,
+        return_wrapper_data
+    )
 
-        response = lambda_client.invoke(
-            FunctionName=arn,
-            InvocationType="Event",
-            LogType="None",
-            Payload=json.dumps(
-                return_wrapper_data
-            )
-        )
 
-        raise SystemExit
+# Invokes a Lambda asynchronously with fan-in results as input
+def lambda_invoker_worker_fan_in(execution_id, branch_ids, fan_out_ids, arn, fan_out_id):
+    return_wrapper_data = {
+        "_refinery": {
+            "branch_ids": branch_ids,
+            "indirect": {
+                "type": "redis_fan_in",
+                "key": fan_out_id,
+            },
+            "parallel": False,
+            "execution_id": execution_id,
+            "fan_out_ids": fan_out_ids,
+        }
+    }
 
-    # Mass-inserts return data into SQS queue
-    def sqs_insert_data(execution_id, branch_ids, fan_out_ids, arn, input_data, backpack, context):
-        # Generate queue URL from SQS ARN
-        arn_parts = arn.split(":")
-        queue_url = "https://sqs." + \
-            arn_parts[3] + ".amazonaws.com/" + \
-            arn_parts[4] + "/" + arn_parts[5]
+    return _invoke_lambda_async(
+        arn,
+        return_wrapper_data
+    )
 
-        queue_items = input_data
 
-        if type(input_data) != list:
-            queue_items = [
-                input_data
-            ]
+# Mass-inserts return data into SQS queue
+def sqs_insert_data(execution_id, branch_ids, fan_out_ids, arn, input_data, backpack, context):
+    # Generate queue URL from SQS ARN
+    arn_parts = arn.split(":")
+    queue_url = "https://sqs." + \
+        arn_parts[3] + ".amazonaws.com/" + \
+        arn_parts[4] + "/" + arn_parts[5]
 
-        # Insert all the data into redis as a temporary holding zone
-        queue_insert_id = gmemory._set_queue_data(
-            queue_url,
-            queue_items,
-            backpack
-        )
+    queue_items = input_data
 
-        # We calculate the number of workers to spin up by
-        # having a target of 1 minute of time to fill up the SQS
-        # queue with the messages previously stored in redis.
-        # This is to balance the additional invoke and compute
-        # cost with the speed of insertion into SQS.
-        # A multi-threaded SQS worker generally can insert at a
-        # rate of 400 messages per second.
-
-        number_of_workers = len(queue_items) / \
-            (400 * 60)  # 400/sec for 60 seconds
-        number_of_workers = int(math.ceil(number_of_workers))
-
-        # We cap the number of workers at 20 just to make the cost
-        # reasonable
-        if number_of_workers > 20:
-            number_of_workers = 20
-
-        # If the float is to small it will occassionally be brought
-        # down to zero so we set a minimum of one worker
-        if number_of_workers < 1:
-            number_of_workers = 1
-
-        lambda_client = boto3.client(
-            "lambda"
-        )
+    if type(input_data) != list:
+        queue_items = [
+            input_data
+        ]
 
-        # Invoke data for the self-invokes to spawn SQS workers
-        for i in range(0, number_of_workers):
-            lambda_invoke_data = {
-                "_refinery": {
-                    "sqs_worker": {
-                        "branch_ids": branch_ids,
-                        "queue_insert_id": queue_insert_id,
-                        "execution_id": execution_id,
-                        "fan_out_ids": fan_out_ids,
-                    }
-                }
-            }
+    queue_item_count = len(queue_items)
 
-            response = lambda_client.invoke(
-                FunctionName=context.invoked_function_arn,
-                InvocationType="Event",
-                LogType="None",
-                Payload=json.dumps(
-                    lambda_invoke_data
-                )
-            )
+    # Insert all the data into redis as a temporary holding zone
+    queue_insert_id = gmemory._set_queue_data(
+        queue_url,
+        queue_items,
+        backpack
+    )
 
-            # Check how much runway we have. If it's less than five seconds
-            # we'll dip out and it'll just have to be a slower drip into SQS.
-            # This is after the first-invoke intentionally so that we always
-            # have at least one going.
-            if context.get_remaining_time_in_millis() <= (5 * 1000):
-                break
+    # Spin up enough SQS workers to fill the queue in the target time, at
+    # the rate the last SQS worker for this queue measured (if there was one).
+    sqs_insert_rate = gmemory._get_sqs_insert_rate(
+        queue_url
+    )
 
-        raise SystemExit
+    if sqs_insert_rate == None:
+        sqs_insert_rate = DEFAULT_SQS_INSERT_RATE
 
-    # Publishes to an SNS topic
-    def sns_topic_publish_worker(execution_id, branch_ids, fan_out_ids, arn, input_data, backpack):
-        # Handle large data that won't fit in the 256K SNS max size
-        sns_client = boto3.client(
-            "sns"
-        )
+    number_of_workers = get_sqs_worker_count(
+        queue_item_count,
+        sqs_insert_rate,
+        SQS_INSERT_TARGET_SECONDS,
+        SQS_MAX_WORKERS
+    )
 
-        return_wrapper_data = {
+    # Invoke data for the self-invokes to spawn SQS workers
+    for i in range(0, number_of_workers):
+        lambda_invoke_data = {
             "_refinery": {
-                "branch_ids": branch_ids,
-                "indirect": False,
-                "parallel": False,
-                "execution_id": execution_id,
-                "fan_out_ids": fan_out_ids,
-                "input_data": input_data,
-                "backpack": backpack
+                "sqs_worker": {
+                    "branch_ids": branch_ids,
+                    "queue_insert_id": queue_insert_id,
+                    "execution_id": execution_id,
+                    "fan_out_ids": fan_out_ids,
+                }
             }
         }
 
-        response = sns_client.publish(
-            TopicArn=arn,
-            Message=json.dumps(
-                return_wrapper_data
-            )
+        _invoke_lambda_async(
+            context.invoked_function_arn,
+            lambda_invoke_data
         )
 
-        raise SystemExit
+        # Check how much runway we have. If it's less than five seconds
+        # we'll dip out and it'll just have to be a slower drip into SQS.
+        # This is after the first-invoke intentionally so that we always
+        # have at least one going.
+        if context.get_remaining_time_in_millis() <= (5 * 1000):
+            break
 
-    # Publishes to redis to be picked up by a polling API Gateway Lambda
-    def api_gateway_response(execution_id, input_data):
-        if input_data == False:
-            input_data = "<FIX_REDIS_FALSE_BOOL_PASSING_ISSUE>"
 
-        # Store with expiration in redis
-        gmemory.redis_client.setex(
-            execution_id,
-            gmemory.return_data_timeout,
-            json.dumps(
-                input_data
-            )
-        )
+# Publishes to redis to be picked up by a polling API Gateway Lambda
+def api_gateway_response(execution_id, input_data):
+    if input_data == False:
+        input_data = "<FIX_REDIS_FALSE_BOOL_PASSING_ISSUE>"
 
-        raise SystemExit
+    # Wakes up the API endpoint Lambda waiting on this execution
+    gmemory._push_api_gateway_response(
+        execution_id,
+        input_data
+    )
 
-    # Spawns a new worked and adds it to active_threads
-    def spawn_new_worker():
-        # Types that equate to just a "lambda" type execution
-        lambda_equivalent_types = [
-            "lambda",
-            "merge",
-            "fan_out_execution"
-        ]
 
-        new_invoke_data = invoke_queue.pop()
+# Types that equate to just a "lambda" type execution
+_LAMBDA_EQUIVALENT_TYPES = [
+    "lambda",
+    "merge",
+    "fan_out_execution"
+]
 
-        # Check type and invoke appropriately
-        if (new_invoke_data["type"] in lambda_equivalent_types) and "input_data_key" in new_invoke_data:
-            new_thread = threading.Thread(
-                target=lambda_invoker_worker_redis,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["branch_ids"],
-                    new_invoke_data["fan_out_ids"],
-                    new_invoke_data["arn"],
-                    new_invoke_data["input_data_key"]
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        elif (new_invoke_data["type"] in lambda_equivalent_types) and "input_data" in new_invoke_data:
-            new_thread = threading.Thread(
-                target=lambda_invoker_worker_direct_input,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["branch_ids"],
-                    new_invoke_data["fan_out_ids"],
-                    new_invoke_data["arn"],
-                    new_invoke_data["input_data"]
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        elif new_invoke_data["type"] == "lambda_fan_out":
-            new_thread = threading.Thread(
-                target=lambda_invoker_fan_out,
-                args=(
-                    new_invoke_data["arn"],
-                    new_invoke_data["input_data_key"],
-                    new_invoke_data["invocation_id"],
-                    new_invoke_data["branch_ids"],
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        elif new_invoke_data["type"] == "lambda_fan_in":
-            new_thread = threading.Thread(
-                target=lambda_invoker_worker_fan_in,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["branch_ids"],
-                    new_invoke_data["fan_out_ids"],
-                    new_invoke_data["arn"],
-                    new_invoke_data["fan_out_id"]
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        elif new_invoke_data["type"] == "sns_topic":
-            new_thread = threading.Thread(
-                target=sns_topic_publish_worker,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["branch_ids"],
-                    new_invoke_data["fan_out_ids"],
-                    new_invoke_data["arn"],
-                    new_invoke_data["input_data"],
-                    new_invoke_data["backpack"]
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        elif new_invoke_data["type"] == "api_gateway_response":
-            new_thread = threading.Thread(
-                target=api_gateway_response,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["input_data"]
-                )
-            )
-            new_thread.start()
-        elif new_invoke_data["type"] == "sqs_queue":
-            new_thread = threading.Thread(
-                target=sqs_insert_data,
-                args=(
-                    new_invoke_data["execution_id"],
-                    new_invoke_data["branch_ids"],
-                    new_invoke_data["fan_out_ids"],
-                    new_invoke_data["arn"],
-                    new_invoke_data["input_data"],
-                    new_invoke_data["backpack"],
-                    new_invoke_data["context"],
-                )
-            )
-            new_thread.start()
-            time.sleep(0.05)  # Annoying wedge due to boto3 bug
-        else:
-            raise Exception("No known handler for invocation: " +
-                            json.dumps(new_invoke_data))
 
-        return new_thread
+def _submit_invocation(completion_queue, new_invoke_data):
+    """
+    Submits the job matching the invocation type to the invocation engine.
+    """
+    invoke_type = new_invoke_data["type"]
+
+    if (invoke_type in _LAMBDA_EQUIVALENT_TYPES) and "input_data_key" in new_invoke_data:
+        return completion_queue.submit(
+            lambda_invoker_worker_redis,
+            new_invoke_data["execution_id"],
+            new_invoke_data["branch_ids"],
+            new_invoke_data["fan_out_ids"],
+            new_invoke_data["arn"],
+            new_invoke_data["input_data_key"]
+        )
+    elif (invoke_type in _LAMBDA_EQUIVALENT_TYPES) and "input_data" in new_invoke_data:
+        return completion_queue.submit(
+            lambda_invoker_worker_direct_input,
+            new_invoke_data["execution_id"],
+            new_invoke_data["branch_ids"],
+            new_invoke_data["fan_out_ids"],
+            new_invoke_data["arn"],
+            _get_transition_payload(new_invoke_data)
+        )
+    elif invoke_type == "lambda_fan_out":
+        return completion_queue.submit(
+            lambda_invoker_fan_out,
+            new_invoke_data["arn"],
+            new_invoke_data["input_data_key"],
+            new_invoke_data["invocation_id"],
+            new_invoke_data["branch_ids"],
+        )
+    elif invoke_type == "lambda_fan_in":
+        return completion_queue.submit(
+            lambda_invoker_worker_fan_in,
+            new_invoke_data["execution_id"],
+            new_invoke_data["branch_ids"],
+            new_invoke_data["fan_out_ids"],
+            new_invoke_data["arn"],
+            new_invoke_data["fan_out_id"]
+        )
+    elif invoke_type == "api_gateway_response":
+        return completion_queue.submit(
+            api_gateway_response,
+            new_invoke_data["execution_id"],
+            new_invoke_data["input_data"]
+        )
+    elif invoke_type == "sqs_queue":
+        return completion_queue.submit(
+            sqs_insert_data,
+            new_invoke_data["execution_id"],
+            new_invoke_data["branch_ids"],
+            new_invoke_data["fan_out_ids"],
+            new_invoke_data["arn"],
+            new_invoke_data["input_data"],
+            new_invoke_data["backpack"],
+            new_invoke_data["context"],
+        )
+
+    raise Exception("No known handler for invocation: " +
+                    json.dumps(new_invoke_data))
 
-    # Bug fix
-    lambda_client = boto3.client(
-        "lambda"
-    )
 
+def _parallel_invoke(branch_ids, invoke_queue):
+    """
+    Performs all of the invocations in the invoke_queue and returns a
+    summary of them:
+
+    {
+            "invoked": {{NUMBER_OF_SUCCESSFUL_INVOCATIONS}},
+            "failed": {{NUMBER_OF_FAILED_INVOCATIONS}},
+            "throttled": [{{INVOKE_DATA_OF_THROTTLED_INVOCATIONS}}],
+    }
+
+    Throttled invocations are not retried here, that's up to the caller.
+    """
     # First iterate over all the invocations and load the input data
     # into redis in a single transaction/pipeline to speed it up.
     new_invoke_queue = []
@@ -460,6 +374,9 @@ def _parallel_invoke(branch_ids, invoke_queue):
     # Create a special list for Lambdas to load the input data at once
     lambda_invoke_list = []
 
+    # SNS messages are published in batches, per topic
+    sns_invoke_list = []
+
     # If it's necessary, get the new branch ID
     new_branch_id = get_branch_id_from_invoke_queue(
         invoke_queue
@@ -469,10 +386,8 @@ def _parallel_invoke(branch_ids, invoke_queue):
         new_invoke_data = invoke_queue.pop()
 
         # Copy in the branch IDs
-        new_invoke_data["branch_ids"] = json.loads(
-            json.dumps(
-                branch_ids
-            )
+        new_invoke_data["branch_ids"] = list(
+            branch_ids
         )
 
         # If we have a new branch ID, add it to the list of branch IDs
@@ -496,6 +411,13 @@ def _parallel_invoke(branch_ids, invoke_queue):
             lambda_invoke_list.append(
                 new_invoke_data
             )
+        elif new_invoke_data["type"] == "sns_topic":
+            new_invoke_data["payload"] = _get_transition_payload(
+                new_invoke_data
+            )
+            sns_invoke_list.append(
+                new_invoke_data
+            )
         else:
             new_invoke_queue.append(
                 new_invoke_data
@@ -503,42 +425,68 @@ def _parallel_invoke(branch_ids, invoke_queue):
 
     # Process the Lambda's input_data
     # input_data is replaced with return_key
+    _start_clock("Storing Transition Input Data")
     lambda_invoke_list = gmemory._bulk_store_input_data(
         lambda_invoke_list
     )
+    _stop_clock("Storing Transition Input Data")
 
     # Combine resulting lists
     invoke_queue = new_invoke_queue + lambda_invoke_list
 
-    # Keep looping while there's still Lambdas to invoke
+    _start_clock("Invoking Transitions")
+
+    completion_queue = INVOCATION_ENGINE.completion_queue()
+
+    # Invoke data for the invocation(s) performed by each submitted job
+    submitted_invocations = {}
+
+    # One job per SNS topic, publishing all of its messages
+    topic_messages = _get_sns_topic_messages(
+        sns_invoke_list
+    )
+
+    for topic_arn, messages in topic_messages.iteritems():
+        future = completion_queue.submit(
+            sns_topic_publish_worker,
+            topic_arn,
+            messages
+        )
+        submitted_invocations[future] = [
+            sns_invocation for sns_invocation in sns_invoke_list
+            if sns_invocation["arn"] == topic_arn
+        ]
+
+    # Hand every other invocation to the engine's worker pool,
+    # in the same (last-in first-out) order as always.
     while len(invoke_queue) > 0:
-        # If we've not maxing out acive threads then spawn new ones
-        if len(active_threads) < max_threads:
-            active_threads.append(
-                spawn_new_worker()
-            )
-        else:
-            # Iterate over our active threads and remove finished
-            new_active_thread_list = []
-            already_spawned = False
-
-            # Check if any threads are finished
-            for active_thread in active_threads:
-                if active_thread.is_alive():
-                    new_active_thread_list.append(active_thread)
-                elif already_spawned == False:
-                    new_active_thread_list.append(
-                        spawn_new_worker()
-                    )
-                    already_spawned = True
-
-            active_threads = new_active_thread_list
-
-    # Wait until all threads finish
-    for thread in active_threads:
-        thread.join()
+        new_invoke_data = invoke_queue.pop()
+        future = _submit_invocation(
+            completion_queue,
+            new_invoke_data
+        )
+        submitted_invocations[future] = [
+            new_invoke_data
+        ]
 
-    # We're all done
-    return
+    invoked_count = 0
+    failed_count = 0
+    throttled_invocations = []
+
+    # Wait until all invocations finish
+    for future in completion_queue:
+        if future.exception() is None:
+            invoked_count += len(submitted_invocations[future])
+        elif is_throttling_error(future.exception()):
+            throttled_invocations += submitted_invocations[future]
+        else:
+            failed_count += len(submitted_invocations[future])
 
+    _stop_clock("Invoking Transitions")
 
+    # We're all done
+    return {
+        "invoked": invoked_count,
+        "failed": failed_count,
+        "throttled": throttled_invocations,
+    }
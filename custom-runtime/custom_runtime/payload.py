@@ -0,0 +1,115 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import threading
+import json
+
+
+def splice_json(value, raw_members):
+    """
+    Same as json.dumps(value) for a dict, but with the already JSON-encoded
+    members in raw_members ([(name, json_string), ...]) added to it.
+    """
+    encoded_value = json.dumps(value)
+
+    encoded_members = ", ".join([
+        json.dumps(name) + ": " + raw_json
+        for name, raw_json in raw_members
+    ])
+
+    if len(raw_members) == 0:
+        return encoded_value
+
+    if encoded_value == "{}":
+        return "{" + encoded_members + "}"
+
+    return encoded_value[:-1] + ", " + encoded_members + "}"
+
+
+class TransitionPayload:
+    """
+    The input data and backpack passed along a block's transitions,
+    JSON-encoded exactly once no matter how many transitions there are.
+
+    Every outgoing edge shares the same TransitionPayload: invoke payloads,
+    SNS messages and redis values splice the encoded JSON into their own
+    envelopes instead of copying and re-serializing the (possibly huge)
+    return data for each target. input_data and backpack are the original
+    values, for the transition types which need them decoded (SQS inserts,
+    merges), and must not be modified.
+    """
+
+    def __init__(self, input_data, backpack):
+        self.input_data = input_data
+        self.backpack = backpack
+
+        # Encoded the first time they're needed, then never again
+        self.encoded = None
+        self.redis_value = None
+        self.lock = threading.Lock()
+
+    def get_encoded(self):
+        """
+        Returns (input_data JSON, backpack JSON).
+        """
+        if self.encoded is not None:
+            return self.encoded
+
+        with self.lock:
+            if self.encoded is None:
+                self.encoded = (
+                    json.dumps(self.input_data),
+                    json.dumps(self.backpack)
+                )
+
+            return self.encoded
+
+    def get_redis_value(self, codec):
+        """
+        The payload as stored in redis for an indirect invoke:
+        {"input_data": ..., "backpack": ...} encoded with the given codec.
+        """
+        if self.redis_value is not None:
+            return self.redis_value
+
+        input_data_json, backpack_json = self.get_encoded()
+
+        with self.lock:
+            if self.redis_value is None:
+                self.redis_value = codec.encode_json(
+                    splice_json({}, [
+                        ("input_data", input_data_json),
+                        ("backpack", backpack_json),
+                    ])
+                )
+
+            return self.redis_value
+
+    def get_envelope_json(self, refinery_data, include_backpack=False):
+        """
+        {"_refinery": refinery_data} as JSON, with the input data (and
+        optionally the backpack) spliced into refinery_data.
+        """
+        input_data_json, backpack_json = self.get_encoded()
+
+        raw_members = [
+            ("input_data", input_data_json)
+        ]
+
+        if include_backpack:
+            raw_members.append(
+                ("backpack", backpack_json)
+            )
+
+        return "{\"_refinery\": " + splice_json(refinery_data, raw_members) + "}"
@@ -0,0 +1,127 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import math
+import time
+
+
+def get_default_invoke_rate(memory_limit_in_mb):
+    """
+    Conservative estimates of how many lambdas can be executed
+    per second for each memory range. These are only used until
+    a fan-out has learned the real rate for a given function.
+    """
+    if int(memory_limit_in_mb) <= 256:
+        return 2
+    elif int(memory_limit_in_mb) <= 576:
+        return 10
+
+    return 13
+
+
+# Inserts per second for a single SQS worker, only used until a worker
+# has measured the real rate for a given queue.
+DEFAULT_SQS_INSERT_RATE = 400
+
+
+def get_sqs_worker_count(item_count, insert_rate, target_seconds, max_workers=20):
+    """
+    The number of SQS workers needed to load item_count items in about
+    target_seconds, at insert_rate items per second per worker. This is
+    to balance the additional invoke and compute cost with the speed of
+    insertion into SQS. Always at least one worker.
+    """
+    number_of_workers = int(math.ceil(
+        float(item_count) / (max(1.0, insert_rate) * max(1, target_seconds))
+    ))
+
+    return max(1, min(max_workers, number_of_workers))
+
+
+def is_throttling_error(exception):
+    # Checks for a botocore ClientError without importing botocore
+    error_response = getattr(exception, "response", None)
+
+    if not isinstance(error_response, dict):
+        return False
+
+    return error_response.get("Error", {}).get("Code") == "TooManyRequestsException"
+
+
+class InvokeRateController:
+    """
+    AIMD (additive increase, multiplicative decrease) controller for the
+    number of invokes a spawner performs per second.
+
+    The spawner asks for a batch size, invokes the batch and then reports
+    back how long it took and how many invokes were throttled. Until the
+    first throttle the rate doubles after every batch which kept up with
+    its target (like TCP slow start), after that it grows additively. A
+    throttle halves the rate. If a batch couldn't keep up with its target
+    because of invoke latency then the rate drops to what was achieved.
+    """
+
+    def __init__(self, initial_rate, min_rate=1.0, max_rate=1000.0, additive_increase=5.0, interval=1.0):
+        self.rate = float(max(min_rate, min(max_rate, initial_rate)))
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.additive_increase = float(additive_increase)
+        self.interval = float(interval)
+
+        self.slow_start = True
+        self.average_batch_latency = None
+        self.total_invokes = 0
+        self.total_throttles = 0
+
+    def get_batch_size(self):
+        return max(1, int(math.ceil(self.rate * self.interval)))
+
+    def record_batch(self, invoke_count, elapsed_seconds, throttled_count):
+        self.total_invokes += invoke_count
+        self.total_throttles += throttled_count
+
+        if self.average_batch_latency is None:
+            self.average_batch_latency = elapsed_seconds
+        else:
+            self.average_batch_latency = (
+                0.8 * self.average_batch_latency) + (0.2 * elapsed_seconds)
+
+        if throttled_count > 0:
+            self.slow_start = False
+            self.rate = max(self.min_rate, self.rate / 2)
+            return
+
+        # Latency bound, we can't go any faster than we just did.
+        if elapsed_seconds > self.interval:
+            achieved_rate = float(invoke_count) / elapsed_seconds
+            self.rate = max(self.min_rate, min(self.rate, achieved_rate))
+            return
+
+        # A partial batch (end of the queue) tells us nothing new
+        if invoke_count < self.get_batch_size():
+            return
+
+        if self.slow_start:
+            self.rate = min(self.max_rate, self.rate * 2)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.additive_increase)
+
+    def pace(self, batch_start_time):
+        """
+        Sleeps out the remainder of the current batch interval.
+        """
+        remaining_seconds = self.interval - (time.time() - batch_start_time)
+
+        if remaining_seconds > 0:
+            time.sleep(remaining_seconds)
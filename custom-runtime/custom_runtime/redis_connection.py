@@ -0,0 +1,348 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import threading
+import random
+import socket
+import time
+import sys
+
+
+# A gap this long between invocations means the container was probably
+# frozen, and its connections may have been dropped in the meantime.
+_THAW_SECONDS = 10.0
+
+# Attempts at getting a working connection before giving up
+_MAX_CONNECT_ATTEMPTS = 3
+
+_CONNECT_TIMEOUT_SECONDS = 2
+_SOCKET_TIMEOUT_SECONDS = 5
+
+# A connection which doesn't answer a health check PING this quickly is
+# treated as dead, instead of waiting out the whole socket timeout.
+_HEALTH_CHECK_TIMEOUT_SECONDS = 0.5
+
+# Idle seconds before the first keepalive probe, seconds between probes
+# and unanswered probes before the connection is considered dead.
+_KEEPALIVE_OPTIONS = [
+    ("TCP_KEEPIDLE", 30),
+    ("TCP_KEEPINTVL", 10),
+    ("TCP_KEEPCNT", 3),
+]
+
+
+class RedisStats:
+    """
+    Redis round trips, bytes and latency for the current invocation. The
+    latency of a round trip is the time from sending a command (or a whole
+    pipeline) to its first reply.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.reconnects = 0
+
+    def add_bytes_sent(self, byte_count):
+        with self.lock:
+            self.bytes_sent += byte_count
+
+    def add_bytes_received(self, byte_count):
+        with self.lock:
+            self.bytes_received += byte_count
+
+    def add_round_trip(self, latency):
+        with self.lock:
+            self.round_trips += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def add_reconnect(self):
+        with self.lock:
+            self.reconnects += 1
+
+    def get_stats(self):
+        average_latency = 0.0
+        if self.round_trips > 0:
+            average_latency = self.total_latency / self.round_trips
+
+        return {
+            "round_trips": self.round_trips,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "average_latency_ms": round(average_latency * 1000, 2),
+            "max_latency_ms": round(self.max_latency * 1000, 2),
+            "reconnects": self.reconnects,
+        }
+
+    def get_stats_line(self):
+        stats = self.get_stats()
+        return (
+            "[ INFO ] Redis: " + str(stats["round_trips"]) + " round trip(s), " +
+            str(stats["bytes_sent"]) + " byte(s) sent, " +
+            str(stats["bytes_received"]) + " byte(s) received, " +
+            str(stats["average_latency_ms"]) + "ms average and " +
+            str(stats["max_latency_ms"]) + "ms max latency, " +
+            str(stats["reconnects"]) + " reconnect(s)."
+        )
+
+
+class _CountingSocket(object):
+    """
+    Wraps a connection's socket to count the bytes going through it.
+    """
+
+    def __init__(self, sock, stats):
+        self._sock = sock
+        self._stats = stats
+
+    def sendall(self, data):
+        self._sock.sendall(data)
+        self._stats.add_bytes_sent(len(data))
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        self._stats.add_bytes_received(len(data))
+        return data
+
+    def recv_into(self, *args):
+        byte_count = self._sock.recv_into(*args)
+        self._stats.add_bytes_received(byte_count)
+        return byte_count
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class _InstrumentedConnection(object):
+    """
+    Mixed into the redis connection class to record the RedisStats (and
+    the last use) of its RedisConnectionManager.
+    """
+    manager = None
+
+    def _connect(self):
+        return _CountingSocket(
+            super(_InstrumentedConnection, self)._connect(),
+            self.manager.stats
+        )
+
+    def send_packed_command(self, command):
+        self._round_trip_start = time.time()
+        return super(_InstrumentedConnection, self).send_packed_command(command)
+
+    def read_response(self):
+        response = super(_InstrumentedConnection, self).read_response()
+
+        # Only the first reply after sending ends the round trip
+        round_trip_start = getattr(self, "_round_trip_start", None)
+        if round_trip_start is not None:
+            self._round_trip_start = None
+            self.manager.last_used = time.time()
+            self.manager.stats.add_round_trip(
+                self.manager.last_used - round_trip_start
+            )
+
+        return response
+
+
+def _get_keepalive_options():
+    # Not every platform has every option (e.g. macOS has no TCP_KEEPIDLE)
+    return dict([
+        (getattr(socket, option_name), option_value)
+        for option_name, option_value in _KEEPALIVE_OPTIONS
+        if hasattr(socket, option_name)
+    ])
+
+
+def _get_retry_delay(attempt):
+    # Exponential backoff with full jitter, capped at one second
+    return random.uniform(0, min(1.0, 0.05 * (2 ** attempt)))
+
+
+class RedisConnectionManager:
+    """
+    Owns the redis client of a container for as long as it stays warm.
+
+    Lambda freezes the container between invocations, and while it's
+    frozen the server (or anything in between) can drop its connections.
+    A dropped connection otherwise only shows up as a timeout on the first
+    command after the thaw. So when a client hasn't been used for a while
+    get_client() first PINGs its pooled connections, dropping the ones
+    which don't answer and reconnecting (with backoff, a bounded number of
+    times) if none do. While the container is running TCP keepalive detects dead
+    connections.
+
+    Connects over TCP by default, or a unix socket (unix_socket_path) or
+    TLS (use_tls) instead. Round trips, bytes and latency are recorded in
+    stats, see RedisStats.
+    """
+
+    def __init__(self, hostname, password, port, unix_socket_path=None, use_tls=False,
+                 thaw_seconds=_THAW_SECONDS, max_connect_attempts=_MAX_CONNECT_ATTEMPTS):
+        self.hostname = hostname
+        self.password = password
+        self.port = port
+        self.unix_socket_path = unix_socket_path
+        self.use_tls = use_tls
+        self.thaw_seconds = thaw_seconds
+        self.max_connect_attempts = max_connect_attempts
+
+        self.stats = RedisStats()
+        self.client = None
+        self.client_lock = threading.Lock()
+
+        # When the last reply was received
+        self.last_used = None
+
+    def is_thawed(self):
+        """
+        True if the client hasn't been used for long enough that its
+        connections have to be checked before they're used again.
+        """
+        return self.last_used is not None and (time.time() - self.last_used) > self.thaw_seconds
+
+    def get_client(self):
+        with self.client_lock:
+            if self.client is None:
+                client = self._create_client()
+                self._check_connection(client)
+                self.client = client
+            elif self.is_thawed():
+                self._check_connection(self.client)
+
+            return self.client
+
+    def _create_client(self):
+        # Only imported once redis is needed, to keep it out of cold starts
+        import redis
+
+        # No retry_on_timeout: a command which timed out has usually already
+        # run on the server, and sending it again would run the fan-in push
+        # script or the queue pop pipeline twice.
+        connection_kwargs = {
+            "db": 0,
+            "password": self.password,
+            "socket_timeout": _SOCKET_TIMEOUT_SECONDS,
+        }
+
+        if self.unix_socket_path:
+            base_connection_class = redis.UnixDomainSocketConnection
+            connection_kwargs["path"] = self.unix_socket_path
+        else:
+            base_connection_class = redis.Connection
+            if self.use_tls:
+                base_connection_class = redis.SSLConnection
+
+            connection_kwargs.update({
+                "host": self.hostname,
+                "port": int(self.port),
+                "socket_connect_timeout": _CONNECT_TIMEOUT_SECONDS,
+                "socket_keepalive": True,
+                "socket_keepalive_options": _get_keepalive_options(),
+            })
+
+        connection_class = type(
+            "Instrumented" + base_connection_class.__name__,
+            (_InstrumentedConnection, base_connection_class),
+            {"manager": self}
+        )
+
+        return redis.StrictRedis(
+            connection_pool=redis.ConnectionPool(
+                connection_class=connection_class,
+                **connection_kwargs
+            )
+        )
+
+    def _ping_idle_connections(self, client):
+        """
+        PINGs every idle connection in the pool (or a new one if there are
+        none) with a short timeout, disconnecting those which don't answer.
+        All of the PINGs are sent before any reply is read, so this takes
+        a single round trip however many connections there are.
+
+        Returns the number of connections which answered, and the last
+        error if any didn't.
+        """
+        connection_pool = client.connection_pool
+        connections = [
+            connection_pool.get_connection("PING")
+            for i in range(0, max(1, len(connection_pool._available_connections)))
+        ]
+        sent_connections = []
+        answered_count = 0
+        last_error = None
+
+        try:
+            for connection in connections:
+                try:
+                    connection.send_command("PING")
+                    sent_connections.append(connection)
+                except Exception as e:
+                    connection.disconnect()
+                    last_error = e
+
+            # One deadline for all of the replies
+            reply_deadline = time.time() + _HEALTH_CHECK_TIMEOUT_SECONDS
+
+            for connection in sent_connections:
+                try:
+                    connection._sock.settimeout(
+                        max(0.01, reply_deadline - time.time())
+                    )
+                    connection.read_response()
+                    connection._sock.settimeout(connection.socket_timeout)
+                    answered_count += 1
+                except Exception as e:
+                    connection.disconnect()
+                    last_error = e
+        finally:
+            for connection in connections:
+                connection_pool.release(connection)
+
+        return answered_count, last_error
+
+    def _check_connection(self, client):
+        """
+        Checks the pooled connections, reconnecting until the server answers
+        or we run out of attempts (in which case the last error is raised).
+        """
+        for attempt in range(1, self.max_connect_attempts + 1):
+            answered_count, last_error = self._ping_idle_connections(
+                client
+            )
+
+            if answered_count > 0:
+                return
+
+            # Every pooled connection is as stale as these were
+            client.connection_pool.disconnect()
+            self.stats.add_reconnect()
+
+            if attempt == self.max_connect_attempts:
+                raise last_error
+
+            sys.stderr.write(
+                "Redis connection check failed (attempt " + str(attempt) + " of " +
+                str(self.max_connect_attempts) + "), reconnecting: " + repr(last_error) + "\n"
+            )
+            time.sleep(_get_retry_delay(attempt))
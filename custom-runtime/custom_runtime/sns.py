@@ -0,0 +1,243 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import collections
+import time
+import json
+import sys
+
+
+from .constants import gmemory, INVOCATION_ENGINE
+from .sqs import _get_retry_delay
+
+
+# Limits of a single PublishBatch request
+_SNS_MAX_BATCH_ENTRIES = 10
+_SNS_MAX_BATCH_BYTES = (256 * 1024)
+
+# Messages over this size are stored in redis and passed by key instead
+_SNS_MAX_MESSAGE_BYTES = (256 * 1024)
+
+# Attempts at publishing a message before it's given up on
+_SNS_MAX_PUBLISH_ATTEMPTS = 6
+
+
+def _is_retryable_sns_error(exception):
+    error_code = exception.response.get("Error", {}).get("Code", "")
+    status_code = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+
+    return error_code in ("Throttling", "ThrottlingException", "ThrottledException") or status_code >= 500
+
+
+def _get_sns_topic_messages(sns_invocations):
+    """
+    Groups the messages for the sns_topic invocations by topic ARN:
+
+    {
+        "{{TOPIC_ARN}}": [{{MESSAGE_JSON}}, ...]
+    }
+
+    A message too large for SNS carries a redis key for its input data
+    instead. Topics can have more than one subscriber, so the stored input
+    data is shared (it's not deleted on read, it just expires) and every
+    invocation with the same payload shares one stored copy.
+    """
+    topic_messages = collections.OrderedDict()
+    shared_input_data_keys = {}
+
+    for invocation in sns_invocations:
+        payload = invocation["payload"]
+
+        refinery_data = {
+            "branch_ids": invocation["branch_ids"],
+            "indirect": False,
+            "parallel": False,
+            "execution_id": invocation["execution_id"],
+            "fan_out_ids": invocation["fan_out_ids"],
+        }
+
+        message = payload.get_envelope_json(
+            refinery_data,
+            include_backpack=True
+        )
+
+        if len(message) > _SNS_MAX_MESSAGE_BYTES:
+            if id(payload) not in shared_input_data_keys:
+                shared_input_data_keys[id(payload)] = gmemory._store_shared_input_data(
+                    payload
+                )
+
+            refinery_data["indirect"] = {
+                "type": "redis_shared",
+                "key": shared_input_data_keys[id(payload)],
+            }
+
+            message = json.dumps({
+                "_refinery": refinery_data
+            })
+
+        if invocation["arn"] not in topic_messages:
+            topic_messages[invocation["arn"]] = []
+
+        topic_messages[invocation["arn"]].append(message)
+
+    return topic_messages
+
+
+def _pack_sns_batches(messages):
+    """
+    Packs messages into batches which stay under both the entry and the
+    total size limit of a PublishBatch request.
+    """
+    batch = []
+    batch_bytes = 0
+
+    for message in messages:
+        if len(batch) > 0 and (len(batch) >= _SNS_MAX_BATCH_ENTRIES or batch_bytes + len(message) > _SNS_MAX_BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+
+        batch.append(message)
+        batch_bytes += len(message)
+
+    if len(batch) > 0:
+        yield batch
+
+
+def _publish_sns_batch(sns_client, topic_arn, messages):
+    """
+    Publishes a batch of messages, republishing the entries SNS reports as
+    failed (and the whole batch on throttling or server errors) with backoff.
+
+    Returns the number of messages which were published.
+    """
+    # botocore is already loaded by now (we have a client), importing it
+    # up front would only slow down cold starts which never use SNS.
+    from botocore.exceptions import ClientError
+
+    pending_entries = [
+        {
+            "Id": str(i),
+            "Message": message
+        } for i, message in enumerate(messages)
+    ]
+    published_count = 0
+
+    for attempt in range(1, _SNS_MAX_PUBLISH_ATTEMPTS + 1):
+        try:
+            response = sns_client.publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=pending_entries
+            )
+        except ClientError as e:
+            if not _is_retryable_sns_error(e):
+                raise
+
+            time.sleep(_get_retry_delay(attempt))
+            continue
+
+        failed_entries = response.get("Failed", [])
+        published_count += len(pending_entries) - len(failed_entries)
+
+        # Sender faults (e.g. an invalid message) will fail every time
+        retry_ids = set()
+        for failed_entry in failed_entries:
+            if failed_entry.get("SenderFault"):
+                sys.stderr.write(
+                    "Couldn't publish a message to SNS: " + failed_entry.get("Code", "") +
+                    " " + failed_entry.get("Message", "") + "\n"
+                )
+            else:
+                retry_ids.add(failed_entry["Id"])
+
+        pending_entries = [
+            pending_entry for pending_entry in pending_entries
+            if pending_entry["Id"] in retry_ids
+        ]
+
+        if len(pending_entries) == 0:
+            return published_count
+
+        time.sleep(_get_retry_delay(attempt))
+
+    sys.stderr.write(
+        "Gave up publishing " + str(len(pending_entries)) + " message(s) to SNS after " +
+        str(_SNS_MAX_PUBLISH_ATTEMPTS) + " attempts\n"
+    )
+    sys.stderr.flush()
+
+    return published_count
+
+
+def _publish_sns_message(sns_client, topic_arn, message):
+    from botocore.exceptions import ClientError
+
+    for attempt in range(1, _SNS_MAX_PUBLISH_ATTEMPTS + 1):
+        try:
+            sns_client.publish(
+                TopicArn=topic_arn,
+                Message=message
+            )
+            return 1
+        except ClientError as e:
+            if not _is_retryable_sns_error(e) or attempt == _SNS_MAX_PUBLISH_ATTEMPTS:
+                raise
+
+            time.sleep(_get_retry_delay(attempt))
+
+
+# Publishes to an SNS topic
+def sns_topic_publish_worker(topic_arn, messages):
+    """
+    Publishes all of a transition's messages for one topic with the shared
+    SNS client, ten to a PublishBatch request. Older SDKs without
+    PublishBatch publish the messages one at a time instead.
+
+    Returns the number of messages which were published.
+    """
+    sns_client = INVOCATION_ENGINE.get_client(
+        "sns"
+    )
+
+    start_time = time.time()
+    published_count = 0
+    request_count = 0
+
+    if hasattr(sns_client, "publish_batch"):
+        for batch in _pack_sns_batches(messages):
+            published_count += _publish_sns_batch(
+                sns_client,
+                topic_arn,
+                batch
+            )
+            request_count += 1
+    else:
+        for message in messages:
+            published_count += _publish_sns_message(
+                sns_client,
+                topic_arn,
+                message
+            )
+            request_count += 1
+
+    elapsed_seconds = max(0.001, time.time() - start_time)
+
+    print(
+        "[ INFO ] Published " + str(published_count) + " message(s) to " + topic_arn +
+        " in " + str(request_count) + " request(s), " +
+        str(round(published_count / elapsed_seconds, 2)) + " message(s)/second."
+    )
+
+    return published_count
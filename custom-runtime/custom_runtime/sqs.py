@@ -13,75 +13,144 @@ is strictly forbidden unless prior written permission is obtained
 from Refinery Labs Inc.
 """
 
-import threading
-import boto3
+import traceback
+import random
 import time
 import json
-import uuid
 import sys
 
 
-from .constants import gmemory
+from .constants import gmemory, INVOCATION_ENGINE
+from .rate import is_throttling_error
 
 
-def _send_sqs_message_in_batches(sqs_url, sqs_message_list):
-    sqs_message_list = sqs_message_list
-    new_sqs_client = boto3.client("sqs")
+# Limits of a single SendMessageBatch request
+_SQS_MAX_BATCH_ENTRIES = 10
+_SQS_MAX_BATCH_BYTES = (256 * 1024)
 
-    while True:
-        # Pull last ten messages off the list
-        message_batch = sqs_message_list[-10:]
+# Number of batches being sent at once, sharing one SQS client
+_SQS_SENDER_COUNT = 15
 
-        # Remove them from the original messages
-        sqs_message_list = sqs_message_list[:-10]
+# Number of queue items drained from redis at a time
+_SQS_DRAIN_SIZE = 1000
 
-        if len(message_batch) == 0:
-            break
+# Attempts at sending an entry before it's given up on
+_SQS_MAX_SEND_ATTEMPTS = 6
 
-        _send_sqs_messages(
-            new_sqs_client,
-            sqs_url,
-            message_batch
-        )
 
-        if len(sqs_message_list) == 0:
-            break
+def _pack_sqs_batches(message_bodies):
+    """
+    Packs message bodies into batches which stay under both the entry and
+    the total size limit of a SendMessageBatch request.
+    """
+    batch = []
+    batch_bytes = 0
+
+    for message_body in message_bodies:
+        message_bytes = len(message_body)
+
+        if len(batch) > 0 and (len(batch) >= _SQS_MAX_BATCH_ENTRIES or batch_bytes + message_bytes > _SQS_MAX_BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
 
-    raise SystemExit
+        batch.append(message_body)
+        batch_bytes += message_bytes
 
+    if len(batch) > 0:
+        yield batch
 
-def _send_sqs_messages(sqs_client, sqs_url, sqs_message_list):
-    sqs_entries = []
 
-    # Generate SQS entries
-    for sqs_message in sqs_message_list:
-        sqs_entries.append({
-            "Id": str(uuid.uuid4()),
-            "MessageBody": json.dumps(
-                sqs_message
+def _is_retryable_sqs_error(exception):
+    if is_throttling_error(exception):
+        return True
+
+    error_code = exception.response.get("Error", {}).get("Code", "")
+    status_code = exception.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+
+    return error_code in ("RequestThrottled", "ThrottlingException", "AWS.SimpleQueueService.RequestThrottled") or status_code >= 500
+
+
+def _get_retry_delay(attempt):
+    # Exponential backoff with full jitter, capped at two seconds
+    return random.uniform(0, min(2.0, 0.05 * (2 ** attempt)))
+
+
+def _send_sqs_batch(sqs_client, sqs_url, message_bodies):
+    """
+    Sends a batch of messages, resending the entries SQS reports as failed
+    (and the whole batch on throttling or server errors) with backoff.
+
+    Returns the number of messages which were sent and the bodies of the
+    ones which couldn't be, which are put back in redis by the SQS worker.
+    """
+    # botocore is already loaded by now (we have a client), importing it
+    # up front would only slow down cold starts which never use SQS.
+    from botocore.exceptions import ClientError
+
+    pending_entries = [
+        {
+            "Id": str(i),
+            "MessageBody": message_body
+        } for i, message_body in enumerate(message_bodies)
+    ]
+    sent_count = 0
+
+    for attempt in range(1, _SQS_MAX_SEND_ATTEMPTS + 1):
+        try:
+            response = sqs_client.send_message_batch(
+                QueueUrl=sqs_url,
+                Entries=pending_entries
             )
-        })
+        except ClientError as e:
+            if not _is_retryable_sqs_error(e):
+                sys.stderr.write(traceback.format_exc())
+                break
+
+            time.sleep(_get_retry_delay(attempt))
+            continue
+
+        failed_entries = response.get("Failed", [])
+        sent_count += len(pending_entries) - len(failed_entries)
+
+        # Sender faults (e.g. an invalid message) will fail every time
+        retry_ids = set()
+        for failed_entry in failed_entries:
+            if failed_entry.get("SenderFault"):
+                sys.stderr.write(
+                    "Couldn't insert a message into SQS: " + failed_entry.get("Code", "") +
+                    " " + failed_entry.get("Message", "") + "\n"
+                )
+            else:
+                retry_ids.add(failed_entry["Id"])
 
-    response = sqs_client.send_message_batch(
-        QueueUrl=sqs_url,
-        Entries=sqs_entries
-    )
+        pending_entries = [
+            pending_entry for pending_entry in pending_entries
+            if pending_entry["Id"] in retry_ids
+        ]
 
+        if len(pending_entries) == 0:
+            return sent_count, []
 
-def _spawn_off_sqs_worker(queue_url, queue_insert_id, execution_id, branch_ids, fan_out_ids):
-    exhausted_queue = False
-    new_thread = False
+        time.sleep(_get_retry_delay(attempt))
 
-    queue_items = gmemory._get_queue_input_from_redis(
-        queue_insert_id,
-        100
+    sys.stderr.write(
+        "Gave up inserting " + str(len(pending_entries)) + " message(s) into SQS\n"
     )
+    sys.stderr.flush()
+
+    return sent_count, [
+        pending_entry["MessageBody"]
+        for pending_entry in pending_entries
+    ]
 
-    enriched_queue_items = []
+
+def _get_sqs_message_bodies(queue_items, queue_insert_id, execution_id, branch_ids, fan_out_ids):
+    message_bodies = []
 
     # Add metadata to queue items
     for queue_item in queue_items:
-        enriched_queue_items.append({
+        message_body = json.dumps({
             "_refinery": {
                 "queue_insert_id": queue_insert_id,
                 "execution_id": execution_id,
@@ -91,26 +160,17 @@ def _spawn_off_sqs_worker(queue_url, queue_insert_id, execution_id, branch_ids,
             }
         })
 
-    if len(enriched_queue_items) == 0:
-        exhausted_queue = True
-    else:
-        new_thread = threading.Thread(
-            target=_send_sqs_message_in_batches,
-            args=(
-                queue_url,
-                enriched_queue_items
+        # A single message over the limit can never be sent
+        if len(message_body) > _SQS_MAX_BATCH_BYTES:
+            sys.stderr.write(
+                "Skipping a queue item which is over the SQS message size limit (" +
+                str(len(message_body)) + " bytes)\n"
             )
-        )
-
-        new_thread.start()
+            continue
 
-        # Wedge for Boto3 bug: https://github.com/boto/botocore/issues/1246
-        time.sleep(0.2)
+        message_bodies.append(message_body)
 
-    return {
-        "thread": new_thread,
-        "exhausted_queue": exhausted_queue
-    }
+    return message_bodies
 
 
 def _sqs_worker(queue_insert_id, execution_id, branch_ids, fan_out_ids, context):
@@ -120,30 +180,29 @@ def _sqs_worker(queue_insert_id, execution_id, branch_ids, fan_out_ids, context)
     return a large number of items (e.g. 100K, 1M) from a code block and have
     them all be loaded into SQS without any additional code. Of course, this is
     not quite so simple to do in implementation. SQS allows a maximum of 10 messages
-    to be stored in the queue per API request. While the throughput is unlimited, it
-    would almost certainly take longer than the max-timeout of a given Lambda to store
-    all of this data in SQS. So instead we opt for loading all of the data into redis
-    first (very fast) and then self-invoke the Lambda in the SQS Worker mode. The SQS
-    Worker mode just pulls things off of the redis queue and loads them into SQS 10
-    messages at a time. If the timeout for the function is close at hand the SQS worker
-    will automatically finish it's current load and then invoke itself again to extend
-    the work infinitely until it is done.
+    (and 256KB) to be stored in the queue per API request. While the throughput is
+    unlimited, it would almost certainly take longer than the max-timeout of a given
+    Lambda to store all of this data in SQS. So instead we opt for loading all of the
+    data into redis first (very fast) and then self-invoke the Lambda in the SQS Worker
+    mode. The SQS Worker mode just drains the redis list and loads it into SQS. If the
+    timeout for the function is close at hand the SQS worker will automatically finish
+    it's current load and then invoke itself again to extend the work infinitely until
+    it is done.
 
     Basically the steps are the following:
     * A Code Block returns a large array of values to be stored in SQS.
     * The custom runtime receives this array and stores it in redis as a list (fast).
-    * The custom runtime self-invokes as many SQS workers as calculated to be necessary.
-    * The SQS workers pull 10 messages a time out (multi-threaded) of redis and insert them into SQS
+    * The custom runtime self-invokes as many SQS workers as needed to hit the target
+      insert time (SQS_INSERT_TARGET_SECONDS) at the last measured insert rate.
+    * The SQS workers drain items out of redis in bulk, pack them into batches and
+      send them from a fixed pool of senders sharing one SQS client.
+    * Entries which SQS reports as failed are resent with backoff, those which
+      still can't be sent are put back in redis to be picked up again.
     * Upon getting close to their timeout the SQS workers finish up and then invoke themselves
     * This continues until the redis list has been exhaused.
 
-    Each SQS worker can do 10 messages at a time, and this is multi-threaded.
-    Performance measurements show the ideal thread number to be 15. Using this
-    we can achieve about 1K SQS inserts per 2.5 seconds (for every worker instance).
-
-    Assuming ~400 inserts a second, that's 24K a minute (and 360K in 15 minutes).
-    5 SQS workers is 120K a minute
-    10 SQS works is 240K a minute
+    Each worker records the insert rate it achieved so that the next insert
+    into the same queue spins up the right number of workers.
     """
 
     print("I'm an SQS worker spawned with queue_insert_id of: " + queue_insert_id)
@@ -158,66 +217,129 @@ def _sqs_worker(queue_insert_id, execution_id, branch_ids, fan_out_ids, context)
         queue_insert_id
     )
 
-    # 15 is about the golden number of effective threads
-    max_threads = 15
+    sqs_client = INVOCATION_ENGINE.get_client(
+        "sqs"
+    )
 
-    while True:
-        active_threads = []
-        exhausted_queue = False
-
-        # Spawn up threads to put things on SQS
-        for i in range(0, max_threads):
-            if exhausted_queue == False:
-                worker_spawn_data = _spawn_off_sqs_worker(
-                    queue_url,
-                    queue_insert_id,
-                    execution_id,
-                    branch_ids,
-                    fan_out_ids
-                )
+    # Blocks once every sender is busy, so we only drain
+    # redis as fast as we can load SQS.
+    completion_queue = INVOCATION_ENGINE.completion_queue(
+        max_pending=_SQS_SENDER_COUNT
+    )
+
+    sent_counts = []
+
+    # Bodies of the messages which couldn't be sent
+    unsent_message_bodies = []
+
+    def send_batch(message_bodies):
+        try:
+            sent_count, batch_unsent_message_bodies = _send_sqs_batch(
+                sqs_client,
+                queue_url,
+                message_bodies
+            )
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            sent_count, batch_unsent_message_bodies = 0, message_bodies
 
-                if worker_spawn_data["thread"]:
-                    active_threads.append(
-                        worker_spawn_data["thread"]
-                    )
+        sent_counts.append(sent_count)
+        unsent_message_bodies.extend(batch_unsent_message_bodies)
 
-                if worker_spawn_data["exhausted_queue"]:
-                    exhausted_queue = True
+    start_time = time.time()
+    exhausted_queue = False
 
-        # Wait until all threads finish
-        for thread in active_threads:
-            thread.join()
+    while True:
+        queue_items = gmemory._get_queue_input_from_redis(
+            queue_insert_id,
+            _SQS_DRAIN_SIZE
+        )
 
-        # If we've finished up our queue we should quit out
-        if exhausted_queue:
+        if len(queue_items) == 0:
+            exhausted_queue = True
             break
 
+        message_bodies = _get_sqs_message_bodies(
+            queue_items,
+            queue_insert_id,
+            execution_id,
+            branch_ids,
+            fan_out_ids
+        )
+
+        for message_batch in _pack_sqs_batches(message_bodies):
+            completion_queue.submit(
+                send_batch,
+                message_batch
+            )
+
         # Now check how much time we have left before timeout
         remaining_milliseconds = context.get_remaining_time_in_millis()
         if remaining_milliseconds <= remaining_time_limit:
-            # Self invoke and quit
-            lambda_client = boto3.client(
-                "lambda"
+            break
+
+    # Wait until everything has been sent
+    completion_queue.join()
+
+    elapsed_seconds = time.time() - start_time
+    sent_count = sum(sent_counts)
+
+    # They've already been trimmed off of the redis list, so they're put
+    # back on it to be sent again instead of being dropped.
+    if len(unsent_message_bodies) > 0:
+        gmemory._return_queue_input_to_redis(
+            queue_insert_id,
+            [
+                json.loads(message_body)["_refinery"]["input_data"]
+                for message_body in unsent_message_bodies
+            ]
+        )
+
+    # Too short a run to say much about the rate
+    if sent_count >= (_SQS_DRAIN_SIZE * 2) and elapsed_seconds > 1:
+        try:
+            gmemory._set_sqs_insert_rate(
+                queue_url,
+                sent_count / elapsed_seconds
             )
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+
+    if exhausted_queue and len(unsent_message_bodies) == 0:
+        return
+
+    # SQS isn't taking any messages (e.g. the queue was deleted), so we
+    # stop rather than self-invoking forever. The items stay in redis until
+    # they expire.
+    if sent_count == 0 and len(unsent_message_bodies) > 0:
+        sys.stderr.write(
+            "Couldn't insert any messages into SQS, leaving " + str(len(unsent_message_bodies)) +
+            " queue item(s) in redis\n"
+        )
+        sys.stderr.flush()
+        return
+
+    # Self invoke and quit
+    lambda_client = INVOCATION_ENGINE.get_client(
+        "lambda"
+    )
 
-            lambda_invoke_data = {
-                "_refinery": {
-                    "sqs_worker": {
-                        "branch_ids": branch_ids,
-                        "queue_insert_id": queue_insert_id,
-                        "execution_id": execution_id,
-                        "fan_out_ids": fan_out_ids,
-                    }
-                }
+    lambda_invoke_data = {
+        "_refinery": {
+            "sqs_worker": {
+                "branch_ids": branch_ids,
+                "queue_insert_id": queue_insert_id,
+                "execution_id": execution_id,
+                "fan_out_ids": fan_out_ids,
             }
+        }
+    }
 
-            response = lambda_client.invoke(
-                FunctionName=context.invoked_function_arn,
-                InvocationType="Event",
-                LogType="None",
-                Payload=json.dumps(
-                    lambda_invoke_data
-                )
-            )
-            break
-    return
+    response = lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        LogType="None",
+        Payload=json.dumps(
+            lambda_invoke_data
+        )
+    )
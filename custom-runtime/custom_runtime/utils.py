@@ -15,11 +15,9 @@ from Refinery Labs Inc.
 
 
 import base64
-import boto3
-import datetime
 import json
-import subprocess
 import os
+import shutil
 import sys
 import time
 import uuid
@@ -28,38 +26,41 @@ import uuid
 from urlparse import parse_qs
 
 
-from .exc import AlreadyInvokedException, InvokeQueueEmptyException
-from .constants import gmemory, S3_CLIENT
+from .exc import InvokeQueueEmptyException, ResponseTimeoutException
+from .constants import gmemory, S3_CLIENT, PIPELINE_LOG_WRITER
+from .constants import INVOCATION_ENGINE, CONTAINER_ID
+from .constants import INLINE_FILE_CACHE, SHARED_FILES_DIR
 from .parallel_invoke import _parallel_invoke
+from .rate import InvokeRateController, get_default_invoke_rate
 
 
-def _api_endpoint(lambda_input, execution_id, context):
-    # This will spin and continually query redis until either
-    # we time out without getting our HTTP response OR we return
-    # our response to the client.
+# Number of children each container in a warmup tree invokes
+_WARMUP_BRANCHING_FACTOR = 4
 
-    # Continually loop until we have only two seconds left
-    # Max execution time is 30 seconds, so that's 28 seconds
-    timed_out = True
+# Minimum time a container is kept busy for during a warmup
+_WARMUP_MIN_HOLD_SECONDS = 1.0
 
-    # As long as we have ~2 seconds of runway left continue
-    # to query redis for our HTTP response data.
-    while context.get_remaining_time_in_millis() > (2 * 1000):
-        try:
-            http_response = gmemory._get_input_data_from_redis(
-                execution_id
-            )
-        except AlreadyInvokedException as e:
-            http_response = False
 
-        # When we have a non-False http_response we can
-        # break out of the loop and declare we've not timed out.
-        if http_response != False:
-            timed_out = False
-            break
+def _api_endpoint(lambda_input, execution_id, context):
+    # This will block on redis until either we time out without
+    # getting our HTTP response OR we return our response to the client.
+
+    # Wait until we have only two seconds left
+    # Max execution time is 30 seconds, so that's 28 seconds
+    wait_seconds = (context.get_remaining_time_in_millis() - (2 * 1000)) / 1000.0
 
-        # Wait a moment before checking again
-        time.sleep(0.01)
+    # The api_gateway_response transition pushes the response onto a list
+    # for this execution, so we sleep in a BLPOP until it shows up instead
+    # of polling.
+    try:
+        http_response = gmemory._wait_for_api_gateway_response(
+            execution_id,
+            wait_seconds
+        )
+        timed_out = False
+    except ResponseTimeoutException as e:
+        http_response = False
+        timed_out = True
 
     # If it matches our magic value, replace the response
     # with "False" instead. This is to get around an issue with
@@ -144,54 +145,36 @@ def _write_temporary_execution_results(s3_log_bucket, program_output, return_dat
 
 
 def _write_pipeline_logs(s3_log_bucket, project_id, lambda_arn, lambda_name, execution_pipeline_id, log_type, execution_details, program_output, backpack, input_data, return_data):
-    def get_nearest_five_minutes():
-        round_to = (60 * 5)
-        dt = datetime.datetime.now()
-        seconds = (dt.replace(tzinfo=None) - dt.min).seconds
-        rounding = (
-            seconds + round_to / 2
-        ) // round_to * round_to
-        return dt + datetime.timedelta(0, rounding - seconds, - dt.microsecond)
-
-    s3_client = boto3.client(
-        "s3"
+    # Written in the background, flushed before the next event is pulled
+    PIPELINE_LOG_WRITER.write(
+        s3_log_bucket,
+        project_id,
+        lambda_arn,
+        lambda_name,
+        execution_pipeline_id,
+        log_type,
+        execution_details,
+        program_output,
+        backpack,
+        input_data,
+        return_data
     )
 
-    log_id = str(uuid.uuid4())
-
-    nearest_minute = get_nearest_five_minutes()
-    date_shard_string = "dt=" + nearest_minute.strftime("%Y-%m-%d-%H-%M")
-
-    s3_path = project_id + "/" + date_shard_string + "/" + execution_pipeline_id + \
-        "/" + log_type + "~" + lambda_name + "~" + \
-        log_id + "~" + str(int(time.time()))
 
-    s3_data = {
-        "id": log_id,
-        "execution_pipeline_id": execution_pipeline_id,
-        "project_id": project_id,
-        "arn": lambda_arn,
-        "name": lambda_name,
-        "type": log_type,  # INPUT, EXCEPTION, COMPLETE
-        "timestamp": int(time.time()),
-        "program_output": program_output,
-        "backpack": backpack,
-        "input_data": input_data,
-        "return_data": return_data,
-    }
-
-    # Merge in execution_details
-    for key, value in execution_details.iteritems():
-        s3_data[key] = value
-
-    response = s3_client.put_object(
-        Bucket=s3_log_bucket,
-        Key=s3_path,
-        Body=json.dumps(
-            s3_data,
-            sort_keys=True
-        )
-    )
+def _get_fan_out_invocations(return_data, backpack, execution_id, fan_out_ids, arn):
+    """
+    Generates the JSON-encoded invocation input for each item of a fan-out,
+    one at a time so they never all have to be held in memory at once.
+    """
+    for return_item_data in return_data:
+        yield json.dumps({
+            "backpack": backpack,
+            "execution_id": execution_id,
+            "fan_out_ids": fan_out_ids,
+            "type": "fan_out_execution",
+            "arn": arn,
+            "input_data": return_item_data
+        })
 
 
 def _spawner(branch_ids, invocation_id, context):
@@ -228,23 +211,58 @@ def _spawner(branch_ids, invocation_id, context):
     that varies is the speed at which this will occur. It could be at
     the speed of 10 Lambdas invoking at ~18 invokes a second, or it could
     be at 100 Lambdas at ~18 invokes a second.
+
+    The number of invokes each spawner does per second is picked at run
+    time by an InvokeRateController, based on how long each batch of
+    invokes took and whether any of them were throttled. Throttled invokes
+    are retried. The rate a spawner ends up at is stored in redis for the
+    function's ARN, so the next fan-out sizes itself with it and starts at
+    that speed.
     """
     print("I am a spawner lambda who's spawned with an invocation ID of " + invocation_id)
     sys.stdout.flush()
 
     remaining_time_limit = (1000 * 10)
-    parallel_invocation_number = 15
     queue_exhausted = False
 
-    while queue_exhausted == False:
-        # Reset list of Lambdas to invoke
-        lambdas_to_invoke = []
+    # Start at the rate the last fan-out of this function settled on
+    initial_invoke_rate = gmemory._get_fan_out_rate(
+        context.invoked_function_arn
+    )
+
+    if initial_invoke_rate == None:
+        initial_invoke_rate = get_default_invoke_rate(
+            context.memory_limit_in_mb
+        )
+
+    rate_controller = InvokeRateController(
+        initial_invoke_rate
+    )
+
+    # Invocations which were throttled and have to be retried
+    retry_invocations = []
+
+    while queue_exhausted == False or len(retry_invocations) > 0:
+        # Start with any invocations we have to retry
+        lambdas_to_invoke = retry_invocations
+        retry_invocations = []
 
         # Check if we're close to a timeout, if we are we should invoke ourselfs
         # and then dip out of performing more invocations.
         remaining_milliseconds = context.get_remaining_time_in_millis()
         if remaining_milliseconds <= remaining_time_limit:
-            lambdas_to_invoke.append({
+            # Leave the retries for the next spawner
+            gmemory._return_invocation_inputs_to_queue(
+                invocation_id,
+                lambdas_to_invoke
+            )
+
+            gmemory._set_fan_out_rate(
+                context.invoked_function_arn,
+                rate_controller.rate
+            )
+
+            lambdas_to_invoke = [{
                 "type": "lambda_fan_out",
                 "arn": context.invoked_function_arn,
                 "invocation_id": invocation_id,
@@ -252,13 +270,12 @@ def _spawner(branch_ids, invocation_id, context):
                 "input_data": {
                         "why": "idempotency"
                 }
-            })
-            start_time = time.time()
+            }]
             _parallel_invoke(branch_ids, lambdas_to_invoke)
             return
 
-        # Pull at least parallel_invocation_number number of inputs of the queue
-        for i in range(0, parallel_invocation_number):
+        # Pull inputs off the queue until we have a full batch for our current rate
+        while queue_exhausted == False and len(lambdas_to_invoke) < rate_controller.get_batch_size():
             try:
                 lambdas_to_invoke.append(
                     gmemory._get_invocation_input_from_queue(
@@ -267,11 +284,25 @@ def _spawner(branch_ids, invocation_id, context):
                 )
             except InvokeQueueEmptyException as e:
                 queue_exhausted = True
-                # Break out of immediate for loop
-                break
 
-        start_time = time.time()
-        _parallel_invoke(branch_ids, lambdas_to_invoke)
+        invoke_count = len(lambdas_to_invoke)
+        batch_start_time = time.time()
+        invoke_results = _parallel_invoke(branch_ids, lambdas_to_invoke)
+        retry_invocations = invoke_results["throttled"]
+
+        rate_controller.record_batch(
+            invoke_count,
+            time.time() - batch_start_time,
+            len(retry_invocations)
+        )
+
+        if queue_exhausted == False or len(retry_invocations) > 0:
+            rate_controller.pace(batch_start_time)
+
+    gmemory._set_fan_out_rate(
+        context.invoked_function_arn,
+        rate_controller.rate
+    )
 
     return
 
@@ -293,33 +324,98 @@ def _transition_type_in_transitions(transitions, transition_type):
     return False
 
 
-def _warmup_concurrency_self_invoke(arn, decrement_counter):
-    # Decrement concurrency counter
-    decrement_counter = decrement_counter - 1
+def _split_warmup_count(warmup_count, branching_factor):
+    """
+    Splits the containers left to warm (all but the current one) as evenly
+    as possible across at most branching_factor children.
+    """
+    remaining_count = max(0, int(warmup_count) - 1)
+    child_count = min(branching_factor, remaining_count)
+
+    return [
+        (remaining_count // child_count) + (1 if i < (remaining_count % child_count) else 0)
+        for i in range(0, child_count)
+    ]
+
+
+def _warmup_child(arn, warmup_count):
+    lambda_client = INVOCATION_ENGINE.get_client(
+        "lambda"
+    )
+
+    response = lambda_client.invoke(
+        FunctionName=arn,
+        InvocationType="RequestResponse",
+        LogType="None",
+        Payload=json.dumps({
+            "_refinery": {
+                "warmup": warmup_count
+            },
+        })
+    )
+
+    return json.loads(
+        response["Payload"].read()
+    )
+
+
+def _warmup_concurrency_tree(arn, warmup_count):
+    """
+    Warms up warmup_count containers (including this one) as a tree: the
+    remaining count is split across up to _WARMUP_BRANCHING_FACTOR children
+    which are invoked in parallel, and each of them does the same with its
+    share. This container is kept busy until all of its children return so
+    that none of them can land on it, which makes the depth (and the time it
+    takes) logarithmic in warmup_count. A failed child only loses its own
+    subtree.
+
+    Returns the number of distinct containers which reported back as warmed.
+    """
+    start_time = time.time()
+    container_ids = set([CONTAINER_ID])
+
+    child_warmup_counts = _split_warmup_count(
+        warmup_count,
+        _WARMUP_BRANCHING_FACTOR
+    )
 
-    if decrement_counter > 0:
-        print("We have a higher level of concurrency to meet (" + str(decrement_counter) +
-              " remaining), kicking off another layer of concurrency...")
+    if len(child_warmup_counts) > 0:
+        print("We have a higher level of concurrency to meet (" + str(warmup_count - 1) +
+              " remaining), warming " + str(len(child_warmup_counts)) + " subtree(s) in parallel...")
         sys.stdout.flush()
 
-        lambda_client = boto3.client(
-            "lambda"
-        )
+    completion_queue = INVOCATION_ENGINE.completion_queue()
 
-        response = lambda_client.invoke(
-            FunctionName=arn,
-            InvocationType="RequestResponse",
-            LogType="Tail",
-            Payload=json.dumps({
-                "_refinery": {
-                    "warmup": decrement_counter
-                },
-            })
+    for child_warmup_count in child_warmup_counts:
+        completion_queue.submit(
+            _warmup_child,
+            arn,
+            child_warmup_count
         )
-        return
 
-    print("We have no further concurrency to meet, this is the last one in the chain.")
-    sys.stdout.flush()
+    for future in completion_queue:
+        if future.exception() is not None:
+            continue
+
+        child_result = future.result()
+
+        # Older runtimes don't report anything back
+        if isinstance(child_result, dict):
+            container_ids.update(
+                child_result.get("container_ids", [])
+            )
+
+    # Leaves hold on for a moment too, so a sibling which is
+    # invoked slightly later doesn't get handed this container.
+    remaining_hold_seconds = _WARMUP_MIN_HOLD_SECONDS - (time.time() - start_time)
+    if remaining_hold_seconds > 0:
+        time.sleep(remaining_hold_seconds)
+
+    return {
+        "requested": warmup_count,
+        "warmed": len(container_ids),
+        "container_ids": list(container_ids),
+    }
 
 
 def _improve_api_endpoint_request_data(lambda_input):
@@ -357,63 +453,91 @@ def _improve_api_endpoint_request_data(lambda_input):
     return lambda_input
 
 
-def _write_inline_code(inline_code, path):
-    with open(path, "w") as file_handler:
-        file_handler.write(inline_code.encode("utf8"))
-    return path
+def _write_inline_code(inline_code):
+    """
+    Returns the path of a file holding inline_code, from the inline file
+    cache so the same code is only written once per container.
+    """
+    return INLINE_FILE_CACHE.put_text(
+        inline_code
+    )
 
 
-def _write_s3_binary(s3_path, local_path):
-    s3_response = S3_CLIENT.get_object(
-        Bucket=os.environ["PACKAGES_BUCKET_NAME"],
-        Key=s3_path
+def _write_s3_binary(s3_path):
+    """
+    Returns the path of a file holding the given object from the packages
+    bucket, only downloading it if the same contents aren't cached already.
+    """
+    return INLINE_FILE_CACHE.put_s3_object(
+        S3_CLIENT,
+        os.environ["PACKAGES_BUCKET_NAME"],
+        s3_path
     )
 
-    with open(local_path, "w") as file_handler:
-        file_handler.write(
-            s3_response["Body"].read()
-        )
-
 
 def _setup_inline_execution_shared_files(inline_file_list):
-    shared_files_base_folder = "/tmp/shared_files/"
-
-    if os.path.exists(shared_files_base_folder):
-        _clear_temporary_files()
-
-    # Make shared files directory
-    os.mkdir(shared_files_base_folder)
+    """
+    Makes /tmp/shared_files/ hold exactly the given shared files. Files which
+    are already there with the right contents are left alone.
+    """
+    shared_file_paths = set()
 
     # Write all of the shared files
     for shared_file_metadata in inline_file_list:
-        shared_file_path = shared_files_base_folder + \
+        shared_file_path = SHARED_FILES_DIR + \
             shared_file_metadata["name"]
-        _write_inline_code(
-            shared_file_metadata["body"],
-            shared_file_path,
+        INLINE_FILE_CACHE.materialize(
+            _write_inline_code(
+                shared_file_metadata["body"]
+            ),
+            shared_file_path
         )
+        shared_file_paths.add(shared_file_path)
+
+    if not os.path.exists(SHARED_FILES_DIR):
+        os.mkdir(SHARED_FILES_DIR)
+
+    # Remove shared files from previous runs which are gone now
+    for directory_path, directory_names, file_names in os.walk(SHARED_FILES_DIR):
+        for file_name in file_names:
+            file_path = os.path.join(directory_path, file_name)
+
+            if file_path not in shared_file_paths:
+                INLINE_FILE_CACHE.forget_materialized(file_path)
+                os.remove(file_path)
 
 
 def _clear_temporary_files():
-    try:
-        tmp_handler = subprocess.Popen(
-            ["/bin/rm -rf /tmp/*"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            shell=True
-        )
-        tmp_handler.communicate()
-    except Exception as e:
-        pass
-
-
-def _stream_execution_output_to_websocket(websocket, debug_id, output):
-    websocket.send(json.dumps({
-        "version": "1.0.0",
-        "debug_id": debug_id,
-        "action": "OUTPUT",
-        "source": "LAMBDA",
-        "body": output,
-        "timestamp": int(time.time())
-    }))
+    """
+    Clears out everything the block left in /tmp, except for the inline
+    file cache and the shared files (which are kept up to date separately).
+    """
+    kept_paths = [
+        INLINE_FILE_CACHE.cache_dir,
+        SHARED_FILES_DIR.rstrip("/"),
+    ]
+
+    for file_name in os.listdir("/tmp"):
+        file_path = os.path.join("/tmp", file_name)
+
+        if file_path in kept_paths:
+            continue
+
+        try:
+            if os.path.isdir(file_path) and not os.path.islink(file_path):
+                shutil.rmtree(file_path)
+            else:
+                os.remove(file_path)
+        except Exception as e:
+            pass
+
+
+def _get_live_debug_line_handler(live_debug):
+    """
+    Returns a handler which queues each line of program output on the
+    live debugging streamer, or None if we're not live debugging.
+    """
+    if not live_debug:
+        return None
+
+    return live_debug["streamer"].write_line
@@ -0,0 +1,218 @@
+"""
+Copyright (C) Refinery Labs Inc. - All Rights Reserved
+
+NOTICE: All information contained herein is, and remains
+the property of Refinery Labs Inc. and its suppliers,
+if any. The intellectual and technical concepts contained
+herein are proprietary to Refinery Labs Inc.
+and its suppliers and may be covered by U.S. and Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+Dissemination of this information or reproduction of this material
+is strictly forbidden unless prior written permission is obtained
+from Refinery Labs Inc.
+"""
+
+import subprocess
+import select
+import struct
+import json
+import time
+import os
+
+
+"""
+Language wrappers which can run as a warm worker include this marker,
+the runtime checks for it before starting one.
+"""
+WARM_WORKER_PROTOCOL_MARKER = "<REFINERY_WARM_WORKER_PROTOCOL_V1>"
+
+# Cache of which executables support the warm worker protocol
+_WARM_WORKER_SUPPORT = {}
+
+# Warm workers kept alive between invocations, keyed by executable path
+_WARM_WORKERS = {}
+
+
+def supports_warm_worker(executable_path):
+    if executable_path not in _WARM_WORKER_SUPPORT:
+        try:
+            with open(executable_path, "r") as file_handler:
+                _WARM_WORKER_SUPPORT[executable_path] = (
+                    WARM_WORKER_PROTOCOL_MARKER in file_handler.read()
+                )
+        except IOError:
+            _WARM_WORKER_SUPPORT[executable_path] = False
+
+    return _WARM_WORKER_SUPPORT[executable_path]
+
+
+def get_warm_worker(runtime_path, executable_path, cwd):
+    if executable_path not in _WARM_WORKERS:
+        _WARM_WORKERS[executable_path] = LanguageWorker(
+            runtime_path,
+            executable_path,
+            cwd
+        )
+
+    return _WARM_WORKERS[executable_path]
+
+
+class WorkerTimeoutException(Exception):
+    def __init__(self, message="The block did not return before the invocation timed out!"):
+        # Call the base class constructor with the parameters it needs
+        super(WorkerTimeoutException, self).__init__(message)
+
+
+class WorkerCrashedException(Exception):
+    def __init__(self, message="The block's worker process exited unexpectedly!"):
+        # Call the base class constructor with the parameters it needs
+        super(WorkerCrashedException, self).__init__(message)
+
+
+class LanguageWorker:
+    """
+    A language runtime process which stays alive between invocations of a
+    warm container, so the interpreter start-up and the import of the
+    block's libraries are only paid once.
+
+    Requests and responses are exchanged as frames over the worker's stdin
+    and stdout. A frame is a 4-byte big-endian length followed by that many
+    bytes of JSON. A request is the same input the block gets on stdin when
+    run cold:
+
+    {
+            "lambda_input": {{INPUT_DATA}},
+            "backpack": {{BACKPACK}},
+    }
+
+    and a response is the output the block would have printed (including
+    the return/error markers) along with the exit code it would have had:
+
+    {
+            "exit_code": 0,
+            "output": "Running script...\n<REFINERY_OUTPUT_CUSTOM_RUNTIME_START_MARKER>...",
+    }
+
+    If the worker crashes or doesn't respond before the timeout it is
+    killed and a fresh one is started for the next invocation.
+    """
+
+    def __init__(self, runtime_path, executable_path, cwd):
+        self.runtime_path = runtime_path
+        self.executable_path = executable_path
+        self.cwd = cwd
+        self.process = None
+        self.invocations = 0
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        worker_environment = dict(os.environ)
+        worker_environment["REFINERY_WARM_WORKER"] = "True"
+
+        self.process = subprocess.Popen(
+            [
+                self.runtime_path,
+                self.executable_path
+            ],
+            stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            shell=False,
+            cwd=self.cwd,
+            env=worker_environment,
+        )
+        self.invocations = 0
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+        self.process = None
+
+    def invoke(self, lambda_input, backpack, timeout_seconds):
+        """
+        Runs the block once and returns the response frame.
+
+        Raises WorkerTimeoutException or WorkerCrashedException, in which
+        case the worker has already been stopped.
+        """
+        if not self.is_alive():
+            self.start()
+
+        deadline = time.time() + timeout_seconds
+
+        try:
+            self._write_frame(json.dumps({
+                "lambda_input": lambda_input,
+                "backpack": backpack
+            }))
+
+            response = json.loads(
+                self._read_frame(deadline)
+            )
+        except (WorkerTimeoutException, WorkerCrashedException):
+            self.stop()
+            raise
+        except (IOError, OSError, ValueError):
+            self.stop()
+            raise WorkerCrashedException()
+
+        self.invocations += 1
+
+        return response
+
+    def _write_frame(self, payload):
+        self.process.stdin.write(
+            struct.pack(">I", len(payload)) + payload
+        )
+        self.process.stdin.flush()
+
+    def _read_exactly(self, length, deadline):
+        stdout_fd = self.process.stdout.fileno()
+        chunks = []
+        remaining = length
+
+        while remaining > 0:
+            seconds_left = deadline - time.time()
+
+            if seconds_left <= 0:
+                raise WorkerTimeoutException()
+
+            readable, _, _ = select.select(
+                [stdout_fd],
+                [],
+                [],
+                seconds_left
+            )
+
+            if not readable:
+                raise WorkerTimeoutException()
+
+            chunk = os.read(stdout_fd, remaining)
+
+            # EOF, the worker has died
+            if not chunk:
+                raise WorkerCrashedException()
+
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        return "".join(chunks)
+
+    def _read_frame(self, deadline):
+        frame_length = struct.unpack(
+            ">I",
+            self._read_exactly(4, deadline)
+        )[0]
+
+        return self._read_exactly(
+            frame_length,
+            deadline
+        )
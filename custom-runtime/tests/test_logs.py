@@ -0,0 +1,82 @@
+from unittest import TestCase
+import datetime
+import json
+
+from custom_runtime import logs
+from custom_runtime.logs import PipelineLogWriter
+
+
+class DictS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        del self.objects[Key]
+
+
+class TestPipelineLogWriter(TestCase):
+    def setUp(self):
+        self.get_nearest_five_minutes = logs.get_nearest_five_minutes
+        self.nearest_five_minutes = datetime.datetime(2019, 7, 15, 13, 35)
+        logs.get_nearest_five_minutes = lambda: self.nearest_five_minutes
+
+        self.s3_client = DictS3Client()
+
+    def tearDown(self):
+        logs.get_nearest_five_minutes = self.get_nearest_five_minutes
+
+    def invoke(self, pipeline_log_writer, program_output):
+        pipeline_log_writer.write(
+            "refinery-lambda-logging",
+            "project",
+            "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block",
+            "Untitled_Code_Block",
+            "execution",
+            "SUCCESS",
+            {},
+            program_output,
+            {},
+            {},
+            {}
+        )
+
+        # Once per invocation, as CustomRuntime does
+        pipeline_log_writer.flush()
+
+    def get_objects(self):
+        return sorted(
+            (s3_key.split("~")[-1], s3_object.split("\n"))
+            for s3_key, s3_object in self.s3_client.objects.items()
+        )
+
+    def test_write(self):
+        pipeline_log_writer = PipelineLogWriter(self.s3_client)
+
+        self.invoke(pipeline_log_writer, "a")
+        self.invoke(pipeline_log_writer, "b")
+
+        self.assertEqual(len(self.s3_client.objects), 2)
+
+    def test_write_coalesced(self):
+        pipeline_log_writer = PipelineLogWriter(self.s3_client, coalesce=True, max_coalesced_logs=3)
+
+        self.invoke(pipeline_log_writer, "a")
+        self.invoke(pipeline_log_writer, "b")
+
+        [(count, bodies)] = self.get_objects()
+        self.assertEqual(count, "2")
+        self.assertEqual([json.loads(body)["program_output"] for body in bodies], ["a", "b"])
+
+        # A full group is closed, the next log starts a new one
+        self.invoke(pipeline_log_writer, "c")
+        self.invoke(pipeline_log_writer, "d")
+        self.assertEqual([count for count, bodies in self.get_objects()], ["1", "3"])
+
+        # So is a group whose date shard has passed
+        self.nearest_five_minutes = datetime.datetime(2019, 7, 15, 13, 40)
+        pipeline_log_writer.flush()
+        self.invoke(pipeline_log_writer, "e")
+        self.assertEqual([count for count, bodies in self.get_objects()], ["1", "1", "3"])
@@ -0,0 +1,142 @@
+from unittest import TestCase
+import os
+
+# The runtime connects to redis lazily, these only have to be set
+os.environ.setdefault("REDIS_HOSTNAME", "127.0.0.1")
+os.environ.setdefault("REDIS_PASSWORD", "")
+os.environ.setdefault("REDIS_PORT", "6379")
+
+from botocore.exceptions import ClientError
+
+from custom_runtime import sqs
+from custom_runtime.constants import gmemory, INVOCATION_ENGINE
+
+
+class ListRedisPipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [
+            getattr(self.redis_client, name)(*args)
+            for name, args in self.commands
+        ]
+
+
+class ListRedisClient:
+    """
+    Just enough of a redis client for the SQS queue lists.
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    def pipeline(self):
+        return ListRedisPipeline(self)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def lrange(self, key, start, end):
+        return self.values.get(key, [])[start:end + 1]
+
+    def ltrim(self, key, start, end):
+        self.values[key] = self.values.get(key, [])[start:]
+
+    def rpush(self, key, *values):
+        self.values.setdefault(key, []).extend(values)
+
+    def expire(self, key, seconds):
+        pass
+
+
+class FailingSQSClient:
+    def __init__(self, failing_message_bodies=None):
+        # Every message fails if not set
+        self.failing_message_bodies = failing_message_bodies
+        self.message_bodies = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if self.failing_message_bodies is None:
+            raise ClientError(
+                {"Error": {"Code": "AWS.SimpleQueueService.NonExistentQueue"}},
+                "SendMessageBatch"
+            )
+
+        failed_entries = []
+
+        for entry in Entries:
+            if entry["MessageBody"] in self.failing_message_bodies:
+                failed_entries.append({"Id": entry["Id"], "SenderFault": False})
+            else:
+                self.message_bodies.append(entry["MessageBody"])
+
+        return {"Failed": failed_entries}
+
+
+class RecordingLambdaClient:
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        self.invocations.append(kwargs)
+
+
+class Context:
+    invoked_function_arn = "arn:aws:lambda:us-west-2:532121572788:function:Untitled_Code_Block"
+
+    def get_remaining_time_in_millis(self):
+        return 1000 * 60
+
+
+class TestSQSWorker(TestCase):
+    def setUp(self):
+        self.queue_items = [{"item": i} for i in range(0, 25)]
+        self.redis_values = {
+            "SQS_TARGET_QUEUE_URL_insert": "https://sqs.us-west-2.amazonaws.com/532121572788/queue",
+            "SQS_QUEUE_DATA_insert": [gmemory.codec.encode(queue_item) for queue_item in self.queue_items],
+        }
+        self.lambda_client = RecordingLambdaClient()
+        self.clients = {"lambda": self.lambda_client}
+
+        gmemory.redis_client = ListRedisClient(self.redis_values)
+        INVOCATION_ENGINE.get_client = lambda service_name: self.clients[service_name]
+
+        self.get_retry_delay = sqs._get_retry_delay
+        sqs._get_retry_delay = lambda attempt: 0
+
+    def tearDown(self):
+        gmemory.redis_client = False
+        del INVOCATION_ENGINE.get_client
+        sqs._get_retry_delay = self.get_retry_delay
+
+    def get_queue_items_in_redis(self):
+        return sorted(
+            [gmemory.codec.decode(value) for value in self.redis_values["SQS_QUEUE_DATA_insert"]],
+            key=lambda queue_item: queue_item["item"]
+        )
+
+    def test_sqs_worker_returns_unsent_items(self):
+        self.clients["sqs"] = FailingSQSClient()
+
+        sqs._sqs_worker("insert", "execution", [], [], Context())
+
+        self.assertEqual(self.get_queue_items_in_redis(), self.queue_items)
+
+        # SQS took nothing, so it isn't tried again
+        self.assertEqual(self.lambda_client.invocations, [])
+
+    def test_sqs_worker_retries_unsent_items(self):
+        failing_message_bodies = sqs._get_sqs_message_bodies(self.queue_items[:3], "insert", "execution", [], [])
+        sqs_client = FailingSQSClient(failing_message_bodies)
+        self.clients["sqs"] = sqs_client
+
+        sqs._sqs_worker("insert", "execution", [], [], Context())
+
+        self.assertEqual(len(sqs_client.message_bodies), 22)
+        self.assertEqual(self.get_queue_items_in_redis(), self.queue_items[:3])
+        self.assertEqual(len(self.lambda_client.invocations), 1)